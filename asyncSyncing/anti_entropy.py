@@ -0,0 +1,93 @@
+import hashlib
+
+
+# Sub-ranges per range when a differing bucket is split, and how deep splits
+# go; 4 ** 8 sub-ranges per bucket is far below what the 64-bit hash resolves.
+FANOUT = 4
+MAX_DEPTH = 8
+
+
+def key_hash(idempotency_key):
+    digest = hashlib.sha1(idempotency_key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+class KeyDigest:
+    """Bucketed digest of a set of idempotency keys.
+
+    Keys are spread over ``buckets`` buckets by hash; each bucket keeps the
+    XOR of its keys' 64-bit hashes and a count. Adding a key is O(1) and the
+    result does not depend on insertion order, so two nodes holding the same
+    keys have identical digests, and only the buckets that differ need their
+    keys compared.
+
+    A differing bucket can be narrowed down Merkle-style: a path
+    ``[bucket, i1, i2, ...]`` names a hash range, ``children(path)`` gives
+    the digests of its ``FANOUT`` sub-ranges (picked by the hash bits above
+    the bucket's), and only the sub-ranges that differ are split further, so
+    the keys exchanged scale with the number of differences rather than with
+    the bucket size.
+    """
+
+    def __init__(self, buckets=256):
+        self.buckets = buckets
+        self.hashes = [0] * buckets
+        self.counts = [0] * buckets
+        self.keys = [[] for _ in range(buckets)]
+
+    def add(self, idempotency_key):
+        if not isinstance(idempotency_key, str):
+            return
+        value = key_hash(idempotency_key)
+        bucket = value % self.buckets
+        self.hashes[bucket] ^= value
+        self.counts[bucket] += 1
+        self.keys[bucket].append((value, idempotency_key))
+
+    def update(self, idempotency_keys):
+        for idempotency_key in idempotency_keys:
+            self.add(idempotency_key)
+
+    def bucket_digests(self):
+        return [[f"{value:016x}", count] for value, count in zip(self.hashes, self.counts)]
+
+    def root(self):
+        combined = hashlib.sha1()
+        for value, count in zip(self.hashes, self.counts):
+            combined.update(f"{value:016x}:{count};".encode("ascii"))
+        return combined.hexdigest()
+
+    def count(self):
+        return sum(self.counts)
+
+    def _child(self, value, depth):
+        # Sub-range of a hash at split depth >= 1.
+        return value // self.buckets // FANOUT ** (depth - 1) % FANOUT
+
+    def _members(self, path):
+        # (hash, key) pairs in the range a path names; invalid paths are empty.
+        if not path or not 0 <= path[0] < self.buckets or len(path) > MAX_DEPTH + 1:
+            return []
+        return [
+            (value, idempotency_key)
+            for value, idempotency_key in self.keys[path[0]]
+            if all(self._child(value, depth) == index for depth, index in enumerate(path[1:], 1))
+        ]
+
+    def children(self, path):
+        hashes = [0] * FANOUT
+        counts = [0] * FANOUT
+        if len(path) <= MAX_DEPTH:
+            for value, _ in self._members(path):
+                index = self._child(value, len(path))
+                hashes[index] ^= value
+                counts[index] += 1
+        return [[f"{value:016x}", count] for value, count in zip(hashes, counts)]
+
+    def keys_in(self, paths):
+        # Keys of each path's range; a bare int is a whole bucket.
+        return [
+            idempotency_key
+            for path in paths
+            for _, idempotency_key in self._members([path] if isinstance(path, int) else path)
+        ]
@@ -1,10 +1,25 @@
+import atexit
+import gzip
+import itertools
 import json
 import os
-from datetime import datetime, timezone
-from threading import Lock
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from threading import RLock, Thread
 
 import requests
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
+
+from anti_entropy import FANOUT, MAX_DEPTH
+from circuit import HALF_OPEN, BreakerRegistry, retry_delay
+from group_commit import GroupCommitter
+from metrics import BYTE_BUCKETS, SIZE_BUCKETS, Registry, TimedLock
+from process_lock import ProcessLock
+from relay import PeerDirectory
+from storage import LogCache, open_store
+from sync_worker import SyncWorker
 
 
 app = Flask(__name__)
@@ -16,10 +31,91 @@ if LOGS_PATH:
 else:
     DATA_DIR = os.environ.get("DATA_DIR", os.path.join(BASE_DIR, "data"))
     LOGS_PATH = os.path.join(DATA_DIR, "logs.json")
-LOCK = Lock()
+# With MULTI_PROCESS=true (several WSGI workers on one DATA_DIR) LOCK is also
+# an flock on DATA_DIR/node.lock and state updates are written through.
+MULTI_PROCESS = os.environ.get("MULTI_PROCESS", "false").lower() == "true"
+METRICS = Registry()
+LOCK_WAIT_SECONDS = METRICS.histogram(
+    "node_lock_wait_seconds", "Time spent waiting to acquire the node lock."
+)
+LOCK = TimedLock(
+    ProcessLock(os.path.join(DATA_DIR, "node.lock")) if MULTI_PROCESS else RLock(),
+    LOCK_WAIT_SECONDS,
+)
 CENTRAL_DB_URL = os.environ.get("CENTRAL_DB_URL", "http://localhost:5001").rstrip("/")
 CENTRAL_DB_TIMEOUT = float(os.environ.get("CENTRAL_DB_TIMEOUT", "5"))
 CENTRAL_DB_BATCH_SIZE = int(os.environ.get("CENTRAL_DB_BATCH_SIZE", "50"))
+SYNC_CONCURRENCY = int(os.environ.get("SYNC_CONCURRENCY", "1"))
+SYNC_COMPRESSION = os.environ.get("SYNC_COMPRESSION", "auto").lower()
+MAX_BATCH_BYTES = int(os.environ.get("MAX_BATCH_BYTES", str(64 * 1024 * 1024)))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "3"))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get("CIRCUIT_RESET_TIMEOUT", "30"))
+RETRY_BACKOFF_BASE = float(os.environ.get("RETRY_BACKOFF_BASE", "1"))
+RETRY_BACKOFF_MAX = float(os.environ.get("RETRY_BACKOFF_MAX", "60"))
+SYNC_MAX_RETRIES = int(os.environ.get("SYNC_MAX_RETRIES", "10"))
+PEER_URLS = [url for url in os.environ.get("PEER_URLS", "").split(",") if url.strip()]
+PEER_HEALTH_TTL = float(os.environ.get("PEER_HEALTH_TTL", "15"))
+PEER_TIMEOUT = float(os.environ.get("PEER_TIMEOUT", "2"))
+ANTI_ENTROPY_BUCKETS = int(os.environ.get("ANTI_ENTROPY_BUCKETS", "256"))
+ANTI_ENTROPY_INTERVAL = float(os.environ.get("ANTI_ENTROPY_INTERVAL", "0"))
+ANTI_ENTROPY_CHUNK = 500
+# Differing ranges with at most this many keys on either side have their keys
+# compared; larger ones are split first. Requests carry at most MAX_PATHS
+# ranges, and /node/digest/keys answers at most MAX_KEYS keys.
+ANTI_ENTROPY_LEAF_KEYS = 8
+ANTI_ENTROPY_MAX_PATHS = 1024
+ANTI_ENTROPY_MAX_KEYS = 10000
+STORAGE_ENGINE = os.environ.get("STORAGE_ENGINE", "segments")
+SEGMENT_MAX_ENTRIES = int(os.environ.get("SEGMENT_MAX_ENTRIES", "10000"))
+STORE_FSYNC = os.environ.get("STORE_FSYNC", "false").lower() == "true"
+IDEMPOTENCY_SNAPSHOT = os.environ.get("IDEMPOTENCY_SNAPSHOT", "false").lower() == "true"
+IDEMPOTENCY_SNAPSHOT_EVERY = int(os.environ.get("IDEMPOTENCY_SNAPSHOT_EVERY", "1000"))
+CACHE_FLUSH_INTERVAL = float(os.environ.get("CACHE_FLUSH_INTERVAL", "1"))
+GROUP_COMMIT = os.environ.get("GROUP_COMMIT", "false").lower() == "true"
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get("GROUP_COMMIT_WINDOW_MS", "2"))
+GROUP_COMMIT_MAX_ENTRIES = int(os.environ.get("GROUP_COMMIT_MAX_ENTRIES", "256"))
+ARCHIVE_AFTER_HOURS = float(os.environ.get("ARCHIVE_AFTER_HOURS", "0"))
+ARCHIVE_INTERVAL = float(os.environ.get("ARCHIVE_INTERVAL", "3600"))
+SYNC_WORKER = os.environ.get("SYNC_WORKER", "false").lower() == "true"
+SYNC_IDLE_INTERVAL = float(os.environ.get("SYNC_IDLE_INTERVAL", "30"))
+SYNC_BACKOFF_MIN = float(os.environ.get("SYNC_BACKOFF_MIN", "1"))
+SYNC_BACKOFF_MAX = float(os.environ.get("SYNC_BACKOFF_MAX", "60"))
+WORKER = None
+STORE = None
+COMMITTER = None
+SESSION = None
+EXECUTOR = None
+IN_FLIGHT = set()
+UPSTREAM_CAPABILITIES = {}
+BREAKERS = BreakerRegistry(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+RETRY_AFTER = {}
+PEERS = None
+
+REQUEST_SECONDS = METRICS.histogram(
+    "http_request_duration_seconds", "Request latency by route.", labelnames=("method", "route")
+)
+REQUESTS = METRICS.counter(
+    "http_requests_total", "Requests by route and status.", ("method", "route", "status")
+)
+STORAGE_SECONDS = METRICS.histogram(
+    "node_storage_seconds", "Time spent in store operations.", labelnames=("operation",)
+)
+BATCH_ITEMS = METRICS.histogram(
+    "node_batch_items", "Entries per batch received or pushed.", SIZE_BUCKETS, ("endpoint",)
+)
+BATCH_BYTES = METRICS.histogram(
+    "node_batch_bytes", "Bytes per batch body received or pushed.", BYTE_BUCKETS, ("endpoint",)
+)
+INGEST_ITEMS = METRICS.counter(
+    "node_ingest_items_total", "Logs received from clients, by outcome.", ("outcome",)
+)
+PUSH_ITEMS = METRICS.counter(
+    "node_push_items_total", "Logs pushed to central, by outcome.", ("outcome",)
+)
+METRICS.gauge("node_sync_backlog", "Logs waiting to be synced.", lambda: _pending_count())
+METRICS.gauge(
+    "node_dead_letter", "Logs that exhausted their retries.", lambda: _dead_letter_count()
+)
 
 REQUIRED_FIELDS = [
     "log_id",
@@ -53,22 +149,186 @@ def _utc_now():
     return datetime.now(timezone.utc).isoformat()
 
 
-def _ensure_data_file():
-    os.makedirs(DATA_DIR, exist_ok=True)
-    if not os.path.exists(LOGS_PATH):
-        with open(LOGS_PATH, "w", encoding="utf-8") as handle:
-            json.dump([], handle, ensure_ascii=False, indent=2)
+def _get_store():
+    global STORE
+    if STORE is None:
+        # Opened under LOCK, since opening may migrate or compact files that
+        # another worker is using.
+        with LOCK:
+            if STORE is None:
+                STORE = _open_store()
+    return STORE
+
+
+def _open_store():
+    store = open_store(
+        STORAGE_ENGINE,
+        DATA_DIR,
+        LOGS_PATH,
+        segment_max_entries=SEGMENT_MAX_ENTRIES,
+        fsync=STORE_FSYNC,
+        index_snapshot=IDEMPOTENCY_SNAPSHOT,
+        snapshot_every=IDEMPOTENCY_SNAPSHOT_EVERY,
+    )
+    cache = LogCache(store, write_behind=CACHE_FLUSH_INTERVAL > 0 and not MULTI_PROCESS)
+    atexit.register(cache.save_index)
+    atexit.register(_flush_store)
+    if cache.write_behind:
+        Thread(target=_flush_loop, daemon=True).start()
+    if ARCHIVE_AFTER_HOURS > 0 and STORAGE_ENGINE == "segments":
+        Thread(target=_archive_loop, daemon=True).start()
+    if ANTI_ENTROPY_INTERVAL > 0 and PEER_URLS:
+        Thread(target=_anti_entropy_loop, daemon=True).start()
+    if SYNC_WORKER:
+        _start_worker()
+    return cache
+
+
+def _flush_store():
+    with LOCK:
+        if STORE is not None:
+            with STORAGE_SECONDS.time("flush"):
+                STORE.flush()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(CACHE_FLUSH_INTERVAL)
+        _flush_store()
+
+
+def _archive_loop():
+    while True:
+        time.sleep(ARCHIVE_INTERVAL)
+        _archive_synced(ARCHIVE_AFTER_HOURS)
+
+
+def _synced_before(log, cutoff):
+    try:
+        synced_at = datetime.fromisoformat(log.get("synced_at") or "")
+    except ValueError:
+        return False
+    if synced_at.tzinfo is None:
+        synced_at = synced_at.replace(tzinfo=timezone.utc)
+    return synced_at < cutoff
+
+
+def _archive_synced(older_than_hours):
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=older_than_hours)
+    with LOCK:
+        eligible = {
+            seq: log
+            for seq, log in _load_logs().items()
+            if log.get("synced") and _synced_before(log, cutoff)
+        }
+        with STORAGE_SECONDS.time("archive"):
+            return _get_store().archive(eligible)
+
+
+def _start_worker():
+    global WORKER
+    if WORKER is None:
+        WORKER = SyncWorker(
+            _push_to_central,
+            _pending_count,
+            idle_interval=SYNC_IDLE_INTERVAL,
+            min_backoff=SYNC_BACKOFF_MIN,
+            max_backoff=SYNC_BACKOFF_MAX,
+        )
+        WORKER.start()
+    return WORKER
+
+
+def _notify_worker():
+    if WORKER is not None:
+        WORKER.notify()
+
+
+def _pending_count():
+    with LOCK:
+        return _get_store().pending_count()
+
+
+def _dead_letter_count():
+    with LOCK:
+        return len(_get_store().dead_lettered())
 
 
 def _load_logs():
-    _ensure_data_file()
-    with open(LOGS_PATH, "r", encoding="utf-8") as handle:
-        return json.load(handle)
+    with STORAGE_SECONDS.time("load"):
+        return _get_store().load()
+
 
+def _append_logs(entries):
+    with STORAGE_SECONDS.time("append"):
+        return _get_store().append(entries)
 
-def _save_logs(logs):
-    with open(LOGS_PATH, "w", encoding="utf-8") as handle:
-        json.dump(logs, handle, ensure_ascii=False, indent=2)
+
+def _update_logs(changes):
+    with STORAGE_SECONDS.time("update"):
+        _get_store().update(changes)
+
+
+def _unsynced_logs():
+    # Pending and dead-lettered logs in seq order, without touching the
+    # synced history.
+    store = _get_store()
+    return sorted([*store.iter_pending(), *store.dead_lettered()], key=lambda item: item[0])
+
+
+def _insert_logs(payloads, replica=False):
+    # Caller holds LOCK. Stores the payloads that are not duplicates with one
+    # append and returns (stored, log_id) per payload; log_id is the existing
+    # entry's for duplicates. Replicas copied from a sibling node keep their
+    # synced state, so logs central already has are not pushed again.
+    stored = _get_store().find_many([payload["idempotency_key"] for payload in payloads])
+    new_entries = []
+    batch_keys = {}
+    outcomes = []
+    for payload in payloads:
+        key = payload["idempotency_key"]
+        existing = stored.get(key)
+        if existing is None:
+            existing = batch_keys.get(key)
+        if existing is not None:
+            outcomes.append((False, existing.get("log_id")))
+            continue
+        log_entry = dict(payload)
+        log_entry["created_at"] = _utc_now()
+        if replica and payload.get("synced") is True:
+            log_entry["synced_at"] = payload.get("synced_at")
+        else:
+            log_entry["synced"] = False
+            log_entry["synced_at"] = None
+        if replica:
+            log_entry.pop("relayed_to", None)
+            log_entry.pop("dead_lettered_at", None)
+        new_entries.append(log_entry)
+        batch_keys[key] = log_entry
+        outcomes.append((True, log_entry.get("log_id")))
+    _append_logs(new_entries)
+    return outcomes
+
+
+def _commit_group(payloads):
+    with LOCK:
+        outcomes = _insert_logs(payloads)
+    accepted = sum(1 for stored, _ in outcomes if stored)
+    INGEST_ITEMS.inc("accepted", amount=accepted)
+    INGEST_ITEMS.inc("duplicate", amount=len(outcomes) - accepted)
+    _notify_worker()
+    return outcomes
+
+
+def _get_committer():
+    global COMMITTER
+    if COMMITTER is None:
+        COMMITTER = GroupCommitter(
+            _commit_group,
+            window=GROUP_COMMIT_WINDOW_MS / 1000,
+            max_entries=GROUP_COMMIT_MAX_ENTRIES,
+        )
+    return COMMITTER
 
 
 def _validate_payload(payload):
@@ -77,137 +337,237 @@ def _validate_payload(payload):
         return False, f"Missing fields: {', '.join(missing)}"
     if not isinstance(payload.get("retries"), int):
         return False, "Field retries must be an integer"
+    if not isinstance(payload.get("idempotency_key"), str):
+        return False, "Field idempotency_key must be a string"
     return True, ""
 
 
-def _find_by_idempotency(logs, idempotency_key):
-    for log in logs:
-        if log.get("idempotency_key") == idempotency_key:
-            return log
-    return None
-
-
 def _missing_central_fields(log_entry):
     return [field for field in CENTRAL_REQUIRED_FIELDS if not log_entry.get(field)]
 
 
+def _read_batch_payload():
+    body = request.get_data(cache=False)
+    BATCH_BYTES.observe(len(body), request.url_rule.rule)
+    return _parse_batch_body(
+        body, request.headers.get("Content-Encoding", "identity"), request.mimetype
+    )
+
+
+def _is_json_mimetype(mimetype):
+    # Same rule as Flask's request.is_json.
+    return mimetype == "application/json" or (
+        mimetype.startswith("application/") and mimetype.endswith("+json")
+    )
+
+
+def _parse_batch_body(body, encoding, mimetype):
+    # Batch bodies may be gzip-compressed and/or NDJSON (one item per line).
+    # Returns (payload, None) or (None, (error_body, status)).
+    encoding = encoding.strip().lower()
+    if encoding == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(body, MAX_BATCH_BYTES)
+        except zlib.error:
+            return None, ({"error": "Invalid gzip body"}, 400)
+        if decompressor.unconsumed_tail:
+            return None, ({"error": "Batch body too large"}, 413)
+    elif encoding != "identity":
+        return None, ({"error": f"Unsupported Content-Encoding: {encoding}"}, 415)
+
+    try:
+        if mimetype == "application/x-ndjson":
+            lines = body.decode("utf-8").splitlines()
+            return [json.loads(line) for line in lines if line.strip()], None
+        if _is_json_mimetype(mimetype):
+            return json.loads(body), None
+    except (UnicodeDecodeError, ValueError):
+        pass
+    return None, ({"error": "Invalid JSON body"}, 400)
+
+
+def _observe_request(method, route, status, seconds):
+    REQUEST_SECONDS.observe(seconds, method, route)
+    REQUESTS.inc(method, route, status)
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    # Streamed responses are timed up to the first byte.
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    seconds = time.perf_counter() - g.request_started
+    _observe_request(request.method, route, response.status_code, seconds)
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(METRICS.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.route("/health", methods=["GET"])
 def health():
     return jsonify({"status": "ok"})
 
 
+@app.route("/node/capabilities", methods=["GET"])
+def node_capabilities():
+    return jsonify(
+        {
+            "content_types": ["application/json", "application/x-ndjson"],
+            "content_encodings": ["gzip"],
+        }
+    )
+
+
 @app.route("/logs", methods=["POST"])
 def create_log():
     payload = request.get_json(silent=True)
     if payload is None:
+        INGEST_ITEMS.inc("error")
         return jsonify({"error": "Invalid JSON body"}), 400
 
     is_valid, error = _validate_payload(payload)
     if not is_valid:
+        INGEST_ITEMS.inc("error")
         return jsonify({"error": error}), 400
 
-    with LOCK:
-        logs = _load_logs()
-        existing = _find_by_idempotency(logs, payload["idempotency_key"])
-        if existing is not None:
-            return (
-                jsonify(
-                    {
-                        "error": "Duplicate idempotency_key",
-                        "existing_log_id": existing.get("log_id"),
-                    }
-                ),
-                409,
-            )
+    if GROUP_COMMIT:
+        stored, log_id = _get_committer().submit(payload).result()
+    else:
+        stored, log_id = _commit_group([payload])[0]
+    if not stored:
+        return jsonify({"error": "Duplicate idempotency_key", "existing_log_id": log_id}), 409
+    return jsonify({"status": "stored", "log_id": log_id}), 201
 
-        log_entry = dict(payload)
-        log_entry["created_at"] = _utc_now()
-        log_entry["synced"] = False
-        log_entry["synced_at"] = None
-        logs.append(log_entry)
-        _save_logs(logs)
 
-    return jsonify({"status": "stored", "log_id": log_entry["log_id"]}), 201
+def _list_logs(synced_param):
+    want_synced = None if synced_param is None else synced_param.lower() == "true"
+    with LOCK:
+        if want_synced is False:
+            logs = [log for _, log in _unsynced_logs()]
+        else:
+            logs = list(_load_logs().values())
+
+    if want_synced is not None:
+        logs = [log for log in logs if log.get("synced") is want_synced]
+    return logs
 
 
 @app.route("/logs", methods=["GET"])
 def list_logs():
-    synced_param = request.args.get("synced")
+    logs = _list_logs(request.args.get("synced"))
+    return jsonify({"count": len(logs), "logs": logs})
+
+
+def _ingest_batch(payload):
+    # Stores a decoded batch and returns the response body with per-item
+    # results.
+    BATCH_ITEMS.observe(len(payload), "/node/logs/batch")
+    results = [None] * len(payload)
+    valid = []
+    for index, item in enumerate(payload):
+        if not isinstance(item, dict):
+            results[index] = {"index": index, "status": "error", "error": "Item must be object"}
+            continue
+        is_valid, error = _validate_payload(item)
+        if not is_valid:
+            results[index] = {"index": index, "status": "error", "error": error}
+            continue
+        valid.append((index, item))
+
     with LOCK:
-        logs = _load_logs()
+        outcomes = _insert_logs([item for _, item in valid])
 
-    if synced_param is not None:
-        want_synced = synced_param.lower() == "true"
-        logs = [log for log in logs if log.get("synced") is want_synced]
+    accepted = 0
+    for (index, item), (stored, log_id) in zip(valid, outcomes):
+        if stored:
+            results[index] = {
+                "index": index,
+                "status": "accepted",
+                "log_id": log_id,
+                "idempotency_key": item["idempotency_key"],
+            }
+            accepted += 1
+        else:
+            results[index] = {
+                "index": index,
+                "status": "duplicate",
+                "existing_log_id": log_id,
+                "idempotency_key": item["idempotency_key"],
+            }
+    duplicates = len(valid) - accepted
+    errors = len(payload) - len(valid)
+    INGEST_ITEMS.inc("accepted", amount=accepted)
+    INGEST_ITEMS.inc("duplicate", amount=duplicates)
+    INGEST_ITEMS.inc("error", amount=errors)
 
-    return jsonify({"count": len(logs), "logs": logs})
+    if accepted:
+        _notify_worker()
+    return {
+        "accepted": accepted,
+        "duplicates": duplicates,
+        "errors": errors,
+        "results": results,
+    }
 
 
 @app.route("/node/logs/batch", methods=["POST"])
 def ingest_node_batch():
-    payload = request.get_json(silent=True)
-    if payload is None:
-        return jsonify({"error": "Invalid JSON body"}), 400
+    payload, error = _read_batch_payload()
+    if error is not None:
+        return jsonify(error[0]), error[1]
     if not isinstance(payload, list):
         return jsonify({"error": "Expected a JSON array"}), 400
+    return jsonify(_ingest_batch(payload))
 
-    results = []
-    accepted = 0
-    duplicates = 0
-    errors = 0
 
-    with LOCK:
-        logs = _load_logs()
-        for index, item in enumerate(payload):
-            if not isinstance(item, dict):
-                results.append(
-                    {"index": index, "status": "error", "error": "Item must be object"}
-                )
-                errors += 1
-                continue
+@app.route("/archive/run", methods=["POST"])
+def run_archive():
+    if STORAGE_ENGINE != "segments":
+        return jsonify({"error": "Archiving requires STORAGE_ENGINE=segments"}), 400
+    payload = request.get_json(silent=True) or {}
+    older_than_hours = payload.get("older_than_hours", ARCHIVE_AFTER_HOURS)
+    if not isinstance(older_than_hours, (int, float)) or older_than_hours <= 0:
+        return jsonify({"error": "older_than_hours must be a positive number"}), 400
+    archived = _archive_synced(older_than_hours)
+    return jsonify({"archived": len(archived)})
 
-            is_valid, error = _validate_payload(item)
-            if not is_valid:
-                results.append({"index": index, "status": "error", "error": error})
-                errors += 1
-                continue
 
-            existing = _find_by_idempotency(logs, item["idempotency_key"])
-            if existing is not None:
-                results.append(
-                    {
-                        "index": index,
-                        "status": "duplicate",
-                        "existing_log_id": existing.get("log_id"),
-                        "idempotency_key": item["idempotency_key"],
-                    }
-                )
-                duplicates += 1
-                continue
+@app.route("/archive/logs", methods=["GET"])
+def list_archived_logs():
+    if STORAGE_ENGINE != "segments":
+        return jsonify({"error": "Archiving requires STORAGE_ENGINE=segments"}), 400
 
-            log_entry = dict(item)
-            log_entry["created_at"] = _utc_now()
-            log_entry["synced"] = False
-            log_entry["synced_at"] = None
-            logs.append(log_entry)
-            results.append(
-                {
-                    "index": index,
-                    "status": "accepted",
-                    "log_id": log_entry.get("log_id"),
-                    "idempotency_key": log_entry.get("idempotency_key"),
-                }
-            )
-            accepted += 1
+    idempotency_key = request.args.get("idempotency_key")
+    if idempotency_key is not None:
+        with LOCK:
+            log = _get_store().find_archived(idempotency_key)
+        logs = [] if log is None else [log]
+        return jsonify({"count": len(logs), "logs": logs})
 
-        _save_logs(logs)
+    try:
+        limit = int(request.args.get("limit") or 100)
+        cursor = int(request.args.get("cursor") or -1)
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "limit and cursor must be positive integers"}), 400
 
+    # Archive files are immutable, so they are read without holding LOCK.
+    rows = list(itertools.islice(_get_store().iter_archive(after=cursor), limit))
+    logs = [log for _, log in rows]
     return jsonify(
         {
-            "accepted": accepted,
-            "duplicates": duplicates,
-            "errors": errors,
-            "results": results,
+            "count": len(logs),
+            "logs": logs,
+            "next_cursor": str(rows[-1][0]) if len(rows) == limit else None,
         }
     )
 
@@ -215,134 +575,708 @@ def ingest_node_batch():
 @app.route("/sync/run", methods=["POST"])
 def run_sync():
     with LOCK:
-        logs = _load_logs()
-        updated = 0
         now = _utc_now()
-        for log in logs:
-            if not log.get("synced"):
-                log["synced"] = True
-                log["synced_at"] = now
-                updated += 1
-        _save_logs(logs)
+        changes = {seq: {"synced": True, "synced_at": now} for seq, _ in _unsynced_logs()}
+        _update_logs(changes)
 
-    return jsonify({"synced": updated})
+    return jsonify({"synced": len(changes)})
 
 
-@app.route("/sync/central", methods=["POST"])
-def sync_central():
-    with LOCK:
-        logs = _load_logs()
-        unsynced = [(index, log) for index, log in enumerate(logs) if not log.get("synced")]
+def _retry_changes(logs, seqs, poison_seqs=()):
+    # Every failure bumps retries and pushes the entry's next attempt out
+    # exponentially. Entries the upstream rejected on their own (poison) are
+    # dead-lettered once they reach SYNC_MAX_RETRIES; transport failures are
+    # left to the circuit breaker and never dead-letter an entry.
+    changes = {}
+    now = time.monotonic()
+    poison = set(poison_seqs)
+    for seq in list(seqs) + list(poison_seqs):
+        retries = int(logs[seq].get("retries", 0)) + 1
+        changes[seq] = {"retries": retries}
+        RETRY_AFTER[seq] = now + retry_delay(retries, RETRY_BACKOFF_BASE, RETRY_BACKOFF_MAX)
+        if seq in poison and retries >= SYNC_MAX_RETRIES:
+            changes[seq]["dead_lettered_at"] = _utc_now()
+            RETRY_AFTER.pop(seq, None)
+    return changes
+
+
+def _get_session():
+    global SESSION
+    if SESSION is None:
+        session = requests.Session()
+        # One pool per host: central plus each peer, which share the session
+        # for probes, relays and reconciliation. With fewer pools a peer call
+        # would evict the keep-alive connections to central.
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1 + len(PEER_URLS), pool_maxsize=max(SYNC_CONCURRENCY, 1)
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        SESSION = session
+    return SESSION
+
+
+def _get_executor():
+    global EXECUTOR
+    if EXECUTOR is None:
+        EXECUTOR = ThreadPoolExecutor(
+            max_workers=max(SYNC_CONCURRENCY, 1), thread_name_prefix="sync-push"
+        )
+    return EXECUTOR
+
+
+def _upstream_capabilities(base_url, path):
+    # Asked once per upstream; versions without the endpoint only understand
+    # plain JSON.
+    if SYNC_COMPRESSION == "off":
+        return {}
+    if base_url not in UPSTREAM_CAPABILITIES:
+        try:
+            response = _get_session().get(f"{base_url}{path}", timeout=CENTRAL_DB_TIMEOUT)
+        except requests.RequestException:
+            return {}
+        UPSTREAM_CAPABILITIES[base_url] = response.json() if response.status_code == 200 else {}
+    return UPSTREAM_CAPABILITIES[base_url]
 
-        if not unsynced:
-            return jsonify({"pushed": 0, "synced": 0, "duplicates": 0, "errors": 0})
 
+def _encode_batch(batch, capabilities):
+    headers = {"Content-Type": "application/json"}
+    if "application/x-ndjson" in capabilities.get("content_types", []):
+        headers["Content-Type"] = "application/x-ndjson"
+        body = "".join(
+            json.dumps(item, ensure_ascii=False, separators=(",", ":")) + "\n"
+            for item in batch
+        )
+    else:
+        body = json.dumps(batch, ensure_ascii=False, separators=(",", ":"))
+    data = body.encode("utf-8")
+    if "gzip" in capabilities.get("content_encodings", []):
+        headers["Content-Encoding"] = "gzip"
+        data = gzip.compress(data, compresslevel=6)
+    return data, headers
+
+
+def _claim_batches(max_batches):
+    # Picks up to max_batches disjoint batches and marks their entries in
+    # flight so concurrent callers never push the same log twice. Entries that
+    # are dead-lettered or still inside their retry backoff are skipped.
+    # Returns (batches, errors, deferred); deferred is None or, for entries
+    # skipped for their backoff, {"deferred": count, "retry_in": seconds
+    # until the earliest is due}.
+    with LOCK:
+        logs = _load_logs()
+        now = time.monotonic()
+        batches = []
+        windows = 0
+        window = 0
         batch = []
-        batch_indexes = []
-        errors = 0
-        for index, log in unsynced[:CENTRAL_DB_BATCH_SIZE]:
-            missing = _missing_central_fields(log)
-            if missing:
-                log["retries"] = int(log.get("retries", 0)) + 1
-                errors += 1
+        batch_seqs = []
+        skipped_seqs = []
+        deferred = 0
+        next_due = None
+        for seq, log in _get_store().iter_pending():
+            if seq in IN_FLIGHT:
                 continue
-            batch.append(log)
-            batch_indexes.append(index)
+            due = RETRY_AFTER.get(seq, 0)
+            if due > now:
+                deferred += 1
+                next_due = due if next_due is None else min(next_due, due)
+                continue
+            window += 1
+            if _missing_central_fields(log):
+                skipped_seqs.append(seq)
+            else:
+                batch.append(log)
+                batch_seqs.append(seq)
+            if window >= CENTRAL_DB_BATCH_SIZE:
+                if batch:
+                    batches.append((batch, batch_seqs))
+                batch, batch_seqs, window = [], [], 0
+                windows += 1
+                if windows >= max_batches:
+                    break
+        if batch:
+            batches.append((batch, batch_seqs))
+        for batch, seqs in batches:
+            IN_FLIGHT.update(seqs)
+            BATCH_ITEMS.observe(len(batch), "/sync/central")
+        _update_logs(_retry_changes(logs, [], poison_seqs=skipped_seqs))
+    if not deferred:
+        return batches, len(skipped_seqs), None
+    return batches, len(skipped_seqs), {
+        "deferred": deferred,
+        "retry_in": round(max(next_due - now, 0.0), 2),
+    }
 
-        if not batch:
-            _save_logs(logs)
-            return jsonify({"pushed": 0, "synced": 0, "duplicates": 0, "errors": errors})
+
+def _new_outcome():
+    return {
+        "changes": {},
+        "failed_seqs": [],
+        "poison_seqs": [],
+        "synced": 0,
+        "duplicates": 0,
+        "errors": 0,
+    }
+
+
+def _transport_failed(outcome, breaker, batch_seqs, exc):
+    breaker.record_failure()
+    outcome["failed_seqs"] = list(batch_seqs)
+    outcome["error"] = {"error": str(exc)}
+    return outcome
+
+
+def _read_push_response(outcome, breaker, batch, batch_seqs, response):
+    # Fills in the outcome of one push from central's response. Shared by the
+    # Flask app and asgi_app, so it only uses status_code and json().
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
 
     if len(batch) == 1:
-        log_index = batch_indexes[0]
-        try:
-            response = requests.post(
+        if response.status_code in (201, 409):
+            outcome["changes"][batch_seqs[0]] = {"synced": True, "synced_at": _utc_now()}
+            if response.status_code == 201:
+                outcome["synced"] = 1
+            else:
+                outcome["duplicates"] = 1
+        else:
+            if response.status_code >= 500:
+                outcome["failed_seqs"] = list(batch_seqs)
+            else:
+                outcome["poison_seqs"] = list(batch_seqs)
+            outcome["error"] = {"error": "Central DB error", "status": response.status_code}
+        return outcome
+
+    if response.status_code != 200:
+        outcome["failed_seqs"] = list(batch_seqs)
+        outcome["error"] = {"error": "Central DB error", "status": response.status_code}
+        return outcome
+
+    payload = response.json()
+    for result in payload.get("results", []):
+        result_index = result.get("index")
+        if result_index is None or result_index >= len(batch_seqs):
+            outcome["errors"] += 1
+            continue
+        seq = batch_seqs[result_index]
+        status = result.get("status")
+        if status in {"accepted", "duplicate"}:
+            outcome["changes"][seq] = {"synced": True, "synced_at": _utc_now()}
+            if status == "duplicate":
+                outcome["duplicates"] += 1
+            else:
+                outcome["synced"] += 1
+        else:
+            outcome["poison_seqs"].append(seq)
+            outcome["errors"] += 1
+    return outcome
+
+
+def _send_batch(batch, batch_seqs):
+    # Single logs go to POST /central/logs, anything larger to the batch
+    # endpoint.
+    outcome = _new_outcome()
+    breaker = BREAKERS.get(CENTRAL_DB_URL)
+    session = _get_session()
+    try:
+        if len(batch) == 1:
+            response = session.post(
                 f"{CENTRAL_DB_URL}/central/logs",
                 json=batch[0],
                 timeout=CENTRAL_DB_TIMEOUT,
             )
-        except requests.RequestException as exc:
-            with LOCK:
-                logs = _load_logs()
-                logs[log_index]["retries"] = int(logs[log_index].get("retries", 0)) + 1
-                _save_logs(logs)
-            return jsonify({"error": str(exc)}), 502
-
-        if response.status_code == 201:
-            logs[log_index]["synced"] = True
-            logs[log_index]["synced_at"] = _utc_now()
-            synced = 1
-            duplicates = 0
-        elif response.status_code == 409:
-            logs[log_index]["synced"] = True
-            logs[log_index]["synced_at"] = _utc_now()
-            synced = 0
-            duplicates = 1
         else:
-            with LOCK:
-                logs = _load_logs()
-                logs[log_index]["retries"] = int(logs[log_index].get("retries", 0)) + 1
-                _save_logs(logs)
-            return jsonify({"error": "Central DB error", "status": response.status_code}), 502
-    else:
-        try:
-            response = requests.post(
+            data, headers = _encode_batch(
+                batch, _upstream_capabilities(CENTRAL_DB_URL, "/central/capabilities")
+            )
+            BATCH_BYTES.observe(len(data), "/sync/central")
+            response = session.post(
                 f"{CENTRAL_DB_URL}/central/logs/batch",
-                json=batch,
+                data=data,
+                headers=headers,
                 timeout=CENTRAL_DB_TIMEOUT,
             )
-        except requests.RequestException as exc:
-            with LOCK:
-                logs = _load_logs()
-                for index in batch_indexes:
-                    logs[index]["retries"] = int(logs[index].get("retries", 0)) + 1
-                _save_logs(logs)
-            return jsonify({"error": str(exc)}), 502
+    except requests.RequestException as exc:
+        return _transport_failed(outcome, breaker, batch_seqs, exc)
+    return _read_push_response(outcome, breaker, batch, batch_seqs, response)
 
-        if response.status_code != 200:
-            with LOCK:
-                logs = _load_logs()
-                for index in batch_indexes:
-                    logs[index]["retries"] = int(logs[index].get("retries", 0)) + 1
-                _save_logs(logs)
-            return jsonify({"error": "Central DB error", "status": response.status_code}), 502
-
-        payload = response.json()
-        results = payload.get("results", [])
-        synced = 0
-        duplicates = 0
-        for result in results:
+
+def _get_peers():
+    global PEERS
+    if PEERS is None:
+        PEERS = PeerDirectory(
+            PEER_URLS, _get_session, ttl=PEER_HEALTH_TTL, timeout=PEER_TIMEOUT
+        )
+    return PEERS
+
+
+def _claim_relay_batch(peer_url):
+    with LOCK:
+        batch = []
+        batch_seqs = []
+        for seq, log in _get_store().iter_pending():
+            if seq in IN_FLIGHT:
+                continue
+            if peer_url in (log.get("relayed_to") or []) or _missing_central_fields(log):
+                continue
+            batch.append(log)
+            batch_seqs.append(seq)
+            if len(batch) >= CENTRAL_DB_BATCH_SIZE:
+                break
+        IN_FLIGHT.update(batch_seqs)
+    return batch, batch_seqs
+
+
+def _forward_batch(peer_url, batch, batch_seqs):
+    breaker = BREAKERS.get(peer_url)
+    data, headers = _encode_batch(batch, _upstream_capabilities(peer_url, "/node/capabilities"))
+    try:
+        response = _get_session().post(
+            f"{peer_url}/node/logs/batch",
+            data=data,
+            headers=headers,
+            timeout=PEER_TIMEOUT + CENTRAL_DB_TIMEOUT,
+        )
+    except requests.RequestException:
+        breaker.record_failure()
+        _get_peers().mark_failed(peer_url)
+        return None
+    if response.status_code != 200:
+        if response.status_code >= 500:
+            breaker.record_failure()
+        _get_peers().mark_failed(peer_url)
+        return None
+    breaker.record_success()
+
+    relayed = 0
+    errors = 0
+    changes = {}
+    with LOCK:
+        logs = _load_logs()
+        for result in response.json().get("results", []):
             result_index = result.get("index")
-            if result_index is None or result_index >= len(batch_indexes):
-                errors += 1
+            if result_index is None or result_index >= len(batch_seqs):
                 continue
-            log_index = batch_indexes[result_index]
-            status = result.get("status")
-            if status in {"accepted", "duplicate"}:
-                logs[log_index]["synced"] = True
-                logs[log_index]["synced_at"] = _utc_now()
-                if status == "duplicate":
-                    duplicates += 1
-                else:
-                    synced += 1
+            seq = batch_seqs[result_index]
+            if result.get("status") in {"accepted", "duplicate"}:
+                relayed += 1
             else:
-                logs[log_index]["retries"] = int(logs[log_index].get("retries", 0)) + 1
                 errors += 1
+            # Recorded for errors too, so the same peer is not asked again.
+            relayed_to = list(logs[seq].get("relayed_to") or [])
+            relayed_to.append(peer_url)
+            changes[seq] = {"relayed_to": relayed_to}
+        _update_logs(changes)
+    return {
+        "pushed": len(batch),
+        "synced": 0,
+        "duplicates": 0,
+        "errors": errors,
+        "relayed": relayed,
+        "peer": peer_url,
+    }
+
+
+def _relay_to_peers():
+    # Used while the central circuit is open: hand the backlog to the
+    # fastest healthy sibling, which syncs it onwards once it can.
+    for peer in _get_peers().ranked():
+        peer_url = peer["url"]
+        breaker = BREAKERS.get(peer_url)
+        if not breaker.allow():
+            continue
+        batch, batch_seqs = _claim_relay_batch(peer_url)
+        if not batch:
+            breaker.release_probe()
+            continue
+        try:
+            body = _forward_batch(peer_url, batch, batch_seqs)
+        finally:
+            with LOCK:
+                IN_FLIGHT.difference_update(batch_seqs)
+        if body is not None:
+            return body
+    return None
+
+
+def _digest():
+    return _get_store().digest(ANTI_ENTROPY_BUCKETS)
 
+
+def _store_replicas(payload):
+    # Returns (accepted, duplicates, errors) for entries copied from a peer.
+    valid = [
+        item for item in payload if isinstance(item, dict) and _validate_payload(item)[0]
+    ]
     with LOCK:
-        _save_logs(logs)
+        outcomes = _insert_logs(valid, replica=True)
+    accepted = sum(1 for stored, _ in outcomes if stored)
+    if accepted:
+        _notify_worker()
+    return accepted, len(valid) - accepted, len(payload) - len(valid)
 
-    return jsonify(
-        {
-            "pushed": len(batch),
-            "synced": synced,
-            "duplicates": duplicates,
-            "errors": errors,
+
+def _differing_ranges(session, peer_url, remote_digests):
+    # Narrows the differing buckets down to small hash ranges, one round of
+    # /node/digest/children per split level. Returns the paths of the ranges
+    # whose keys need comparing and the number of differing buckets.
+    with LOCK:
+        local_digests = _digest().bucket_digests()
+    pending = [
+        ([bucket], local_digests[bucket][1], remote_digests[bucket][1])
+        for bucket in range(len(local_digests))
+        if list(remote_digests[bucket]) != local_digests[bucket]
+    ]
+    differing_buckets = len(pending)
+    leaves = []
+    while pending:
+        split = []
+        for path, local_count, remote_count in pending:
+            small = max(local_count, remote_count) <= ANTI_ENTROPY_LEAF_KEYS
+            if small or len(path) > MAX_DEPTH:
+                leaves.append(path)
+            else:
+                split.append(path)
+        pending = []
+        for start in range(0, len(split), ANTI_ENTROPY_MAX_PATHS):
+            paths = split[start : start + ANTI_ENTROPY_MAX_PATHS]
+            response = session.post(
+                f"{peer_url}/node/digest/children", json={"paths": paths}, timeout=PEER_TIMEOUT
+            )
+            response.raise_for_status()
+            with LOCK:
+                digest = _digest()
+                local_children = [digest.children(path) for path in paths]
+            for path, remote, local in zip(paths, response.json()["children"], local_children):
+                for index, (local_child, remote_child) in enumerate(zip(local, remote)):
+                    if list(remote_child) != local_child:
+                        pending.append((path + [index], local_child[1], remote_child[1]))
+    return leaves, differing_buckets
+
+
+def _reconcile_with(peer_url):
+    # Compares bucketed key digests with one peer, splits the differing
+    # buckets until the ranges that differ are small, then sends the entries
+    # it lacks and fetches the ones this node lacks. Nodes that already agree
+    # exchange only the root digest.
+    session = _get_session()
+    result = {
+        "peer": peer_url,
+        "differing_buckets": 0,
+        "differing_ranges": 0,
+        "sent": 0,
+        "received": 0,
+    }
+    try:
+        remote = session.get(f"{peer_url}/node/digest", timeout=PEER_TIMEOUT)
+        remote.raise_for_status()
+        remote = remote.json()
+        if remote.get("bucket_count") != ANTI_ENTROPY_BUCKETS:
+            result["error"] = "Bucket count mismatch"
+            return result
+        with LOCK:
+            root = _digest().root()
+        if remote.get("root") == root:
+            return result
+
+        response = session.get(f"{peer_url}/node/digest/buckets", timeout=PEER_TIMEOUT)
+        response.raise_for_status()
+        leaves, result["differing_buckets"] = _differing_ranges(
+            session, peer_url, response.json()["digests"]
+        )
+        result["differing_ranges"] = len(leaves)
+
+        local_keys = set()
+        remote_keys = set()
+        for start in range(0, len(leaves), ANTI_ENTROPY_MAX_PATHS):
+            paths = leaves[start : start + ANTI_ENTROPY_MAX_PATHS]
+            with LOCK:
+                local_keys.update(_digest().keys_in(paths))
+            response = session.post(
+                f"{peer_url}/node/digest/keys",
+                json={"paths": paths},
+                timeout=PEER_TIMEOUT + CENTRAL_DB_TIMEOUT,
+            )
+            response.raise_for_status()
+            remote_keys.update(response.json()["keys"])
+
+        to_send = sorted(local_keys - remote_keys)
+        capabilities = _upstream_capabilities(peer_url, "/node/capabilities")
+        for start in range(0, len(to_send), ANTI_ENTROPY_CHUNK):
+            with LOCK:
+                entries = _get_store().entries_for(to_send[start : start + ANTI_ENTROPY_CHUNK])
+            data, headers = _encode_batch(entries, capabilities)
+            response = session.post(
+                f"{peer_url}/node/reconcile/entries",
+                data=data,
+                headers=headers,
+                timeout=PEER_TIMEOUT + CENTRAL_DB_TIMEOUT,
+            )
+            response.raise_for_status()
+            result["sent"] += response.json().get("accepted", 0)
+
+        to_fetch = sorted(remote_keys - local_keys)
+        for start in range(0, len(to_fetch), ANTI_ENTROPY_CHUNK):
+            response = session.post(
+                f"{peer_url}/node/reconcile/fetch",
+                json={"idempotency_keys": to_fetch[start : start + ANTI_ENTROPY_CHUNK]},
+                timeout=PEER_TIMEOUT + CENTRAL_DB_TIMEOUT,
+            )
+            response.raise_for_status()
+            accepted, _, _ = _store_replicas(response.json().get("logs", []))
+            result["received"] += accepted
+    except (requests.RequestException, ValueError, KeyError) as exc:
+        _get_peers().mark_failed(peer_url)
+        result["error"] = str(exc)
+    return result
+
+
+def _anti_entropy_loop():
+    while True:
+        time.sleep(ANTI_ENTROPY_INTERVAL)
+        for peer in _get_peers().ranked():
+            _reconcile_with(peer["url"])
+
+
+def _claim_push():
+    # First half of a push: circuit check, relay fallback while the circuit
+    # is open, and the batch claim. Returns (result, batches, errors); result
+    # is the (body, status) to answer with when there is nothing to send.
+    breaker = BREAKERS.get(CENTRAL_DB_URL)
+    if not breaker.allow():
+        if PEER_URLS:
+            relayed = _relay_to_peers()
+            if relayed is not None:
+                return (relayed, 200), [], 0
+        body = {"error": "Circuit open", "retry_in": round(breaker.retry_in(), 2)}
+        return (body, 503), [], 0
+    # A half-open circuit gets a single probe batch.
+    max_batches = 1 if breaker.state == HALF_OPEN else SYNC_CONCURRENCY
+    batches, errors, deferred = _claim_batches(max_batches)
+    if not batches:
+        if breaker.state == HALF_OPEN:
+            breaker.release_probe()
+        # Logs waiting out their retry backoff are reported, so callers do not
+        # take "nothing pushed" for "nothing left".
+        body = {"pushed": 0, "synced": 0, "duplicates": 0, "errors": errors, **(deferred or {})}
+        return (body, 200), [], errors
+    return None, batches, errors
+
+
+def _finish_push(batches, errors, outcomes):
+    # Second half: records the per-batch outcomes and builds the response.
+    with LOCK:
+        logs = _load_logs()
+        changes = {}
+        failed_seqs = []
+        poison_seqs = []
+        for outcome in outcomes:
+            changes.update(outcome["changes"])
+            failed_seqs.extend(outcome["failed_seqs"])
+            poison_seqs.extend(outcome["poison_seqs"])
+        for seq in changes:
+            RETRY_AFTER.pop(seq, None)
+        changes.update(_retry_changes(logs, failed_seqs, poison_seqs))
+        _update_logs(changes)
+
+    failed = [outcome["error"] for outcome in outcomes if "error" in outcome]
+    synced = sum(outcome["synced"] for outcome in outcomes)
+    duplicates = sum(outcome["duplicates"] for outcome in outcomes)
+    errors += sum(outcome["errors"] for outcome in outcomes)
+    failed_items = sum(len(outcome["failed_seqs"]) for outcome in outcomes if "error" in outcome)
+    # A single log central rejected is an error too, though not a failed batch.
+    rejected = sum(len(outcome["poison_seqs"]) for outcome in outcomes if "error" in outcome)
+    PUSH_ITEMS.inc("synced", amount=synced)
+    PUSH_ITEMS.inc("duplicate", amount=duplicates)
+    PUSH_ITEMS.inc("error", amount=errors + failed_items + rejected)
+    if len(failed) == len(outcomes):
+        return failed[0], 502
+
+    body = {
+        "pushed": sum(len(batch) for batch, _ in batches),
+        "synced": synced,
+        "duplicates": duplicates,
+        "errors": errors,
+    }
+    if failed:
+        body["failed_batches"] = len(failed)
+        body["errors"] += failed_items
+    return body, 200
+
+
+def _release_batches(batches):
+    with LOCK:
+        for _, seqs in batches:
+            IN_FLIGHT.difference_update(seqs)
+
+
+def _push_to_central():
+    result, batches, errors = _claim_push()
+    if result is not None:
+        return result
+    try:
+        if len(batches) == 1:
+            outcomes = [_send_batch(*batches[0])]
+        else:
+            executor = _get_executor()
+            futures = [executor.submit(_send_batch, batch, seqs) for batch, seqs in batches]
+            outcomes = [future.result() for future in futures]
+        return _finish_push(batches, errors, outcomes)
+    finally:
+        _release_batches(batches)
+
+
+@app.route("/sync/central", methods=["POST"])
+def sync_central():
+    body, status = _push_to_central()
+    return jsonify(body), status
+
+
+@app.route("/sync/status", methods=["GET"])
+def sync_status():
+    if WORKER is None:
+        body = {"running": False, "queue_depth": _pending_count()}
+    else:
+        body = WORKER.status()
+    body["dead_letter"] = _dead_letter_count()
+    body["circuits"] = BREAKERS.status()
+    return jsonify(body)
+
+
+@app.route("/peers", methods=["GET"])
+def list_peers():
+    peers = _get_peers()
+    peers.refresh()
+    status = peers.status()
+    for peer in status:
+        peer["circuit"] = BREAKERS.get(peer["url"]).status()
+    return jsonify({"count": len(status), "peers": status})
+
+
+@app.route("/node/digest", methods=["GET"])
+def node_digest():
+    with LOCK:
+        digest = _digest()
+        body = {
+            "bucket_count": digest.buckets,
+            "count": digest.count(),
+            "root": digest.root(),
         }
-    )
+    return jsonify(body)
+
+
+@app.route("/node/digest/buckets", methods=["GET"])
+def node_digest_buckets():
+    with LOCK:
+        digest = _digest()
+        body = {"bucket_count": digest.buckets, "digests": digest.bucket_digests()}
+    return jsonify(body)
+
+
+def _digest_paths(payload):
+    # Hash-range paths from a digest request body, or None when malformed.
+    # {"buckets": [...]} is the older form, one whole bucket per entry.
+    if isinstance(payload.get("buckets"), list):
+        paths = [[bucket] for bucket in payload["buckets"]]
+    else:
+        paths = payload.get("paths")
+    if not isinstance(paths, list) or len(paths) > ANTI_ENTROPY_MAX_PATHS:
+        return None
+    for path in paths:
+        if not isinstance(path, list) or not path:
+            return None
+        if not all(isinstance(index, int) and not isinstance(index, bool) for index in path):
+            return None
+    return paths
+
+
+@app.route("/node/digest/children", methods=["POST"])
+def node_digest_children():
+    paths = _digest_paths(request.get_json(silent=True) or {})
+    if paths is None:
+        error = f"paths must be a list of at most {ANTI_ENTROPY_MAX_PATHS} integer lists"
+        return jsonify({"error": error}), 400
+    with LOCK:
+        digest = _digest()
+        children = [digest.children(path) for path in paths]
+    return jsonify({"fanout": FANOUT, "children": children})
+
+
+@app.route("/node/digest/keys", methods=["POST"])
+def node_digest_keys():
+    paths = _digest_paths(request.get_json(silent=True) or {})
+    if paths is None:
+        error = f"paths must be a list of at most {ANTI_ENTROPY_MAX_PATHS} integer lists"
+        return jsonify({"error": error}), 400
+    with LOCK:
+        keys = _digest().keys_in(paths)
+    if len(keys) > ANTI_ENTROPY_MAX_KEYS:
+        error = f"{len(keys)} keys in range, more than {ANTI_ENTROPY_MAX_KEYS}; split it first"
+        return jsonify({"error": error, "count": len(keys)}), 413
+    return jsonify({"count": len(keys), "keys": keys})
+
+
+@app.route("/node/reconcile/fetch", methods=["POST"])
+def reconcile_fetch():
+    payload = request.get_json(silent=True) or {}
+    keys = payload.get("idempotency_keys")
+    if not isinstance(keys, list):
+        return jsonify({"error": "idempotency_keys must be a list"}), 400
+    with LOCK:
+        logs = _get_store().entries_for(key for key in keys if isinstance(key, str))
+    return jsonify({"count": len(logs), "logs": logs})
+
+
+@app.route("/node/reconcile/entries", methods=["POST"])
+def reconcile_entries():
+    payload, error = _read_batch_payload()
+    if error is not None:
+        return jsonify(error[0]), error[1]
+    if not isinstance(payload, list):
+        return jsonify({"error": "Expected a JSON array"}), 400
+    BATCH_ITEMS.observe(len(payload), "/node/reconcile/entries")
+    accepted, duplicates, errors = _store_replicas(payload)
+    return jsonify({"accepted": accepted, "duplicates": duplicates, "errors": errors})
+
+
+@app.route("/node/reconcile", methods=["POST"])
+def reconcile():
+    payload = request.get_json(silent=True) or {}
+    peer_urls = _get_peers().urls
+    if payload.get("peer") is not None:
+        if payload["peer"] not in peer_urls:
+            return jsonify({"error": "peer must be one of PEER_URLS"}), 400
+        peer_urls = [payload["peer"]]
+    results = [_reconcile_with(peer_url) for peer_url in peer_urls]
+    return jsonify({"count": len(results), "peers": results})
+
+
+@app.route("/sync/dead-letter", methods=["GET"])
+def list_dead_letter():
+    with LOCK:
+        logs = [log for _, log in _get_store().dead_lettered()]
+    return jsonify({"count": len(logs), "logs": logs})
+
+
+@app.route("/sync/dead-letter/retry", methods=["POST"])
+def retry_dead_letter():
+    payload = request.get_json(silent=True) or {}
+    wanted = payload.get("idempotency_keys")
+    with LOCK:
+        changes = {
+            seq: {"retries": 0, "dead_lettered_at": None}
+            for seq, log in _get_store().dead_lettered()
+            if wanted is None or log.get("idempotency_key") in wanted
+        }
+        _update_logs(changes)
+    _notify_worker()
+    return jsonify({"requeued": len(changes)})
 
 
 if __name__ == "__main__":
-    _ensure_data_file()
+    _get_store()
     port = int(os.environ.get("PORT", "5000"))
     app.run(host="0.0.0.0", port=port)
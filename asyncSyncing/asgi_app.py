@@ -0,0 +1,205 @@
+"""ASGI variant of the node service in app.py.
+
+    uvicorn asgi_app:app --port 5000
+
+Local ingest and reads, and POST /sync/central, run on the event loop: the
+storage work is handed to worker threads and pushes to central go out
+through one shared httpx.AsyncClient, so waiting on central never holds a
+request worker. Validation, storage and the push bookkeeping are the
+functions in app.py; every other route is served by the Flask app itself.
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import time
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import app as node
+from sync_worker import SyncWorker
+
+
+CLIENT = None
+
+
+def _mimetype(request):
+    return request.headers.get("content-type", "").split(";")[0].strip().lower()
+
+
+async def _read_json(request):
+    # Mirrors Flask's request.get_json(silent=True).
+    if not node._is_json_mimetype(_mimetype(request)):
+        return None
+    try:
+        return json.loads(await request.body())
+    except (UnicodeDecodeError, ValueError):
+        return None
+
+
+def _timed(route, endpoint):
+    # The native routes record the same request metrics as app.py's hooks do
+    # for the Flask routes.
+    async def timed(request):
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await endpoint(request)
+            status = response.status_code
+            return response
+        finally:
+            node._observe_request(request.method, route, status, time.perf_counter() - started)
+
+    return timed
+
+
+async def health(request):
+    return JSONResponse({"status": "ok"})
+
+
+async def create_log(request):
+    payload = await _read_json(request)
+    if payload is None:
+        node.INGEST_ITEMS.inc("error")
+        return JSONResponse({"error": "Invalid JSON body"}, status_code=400)
+
+    is_valid, error = node._validate_payload(payload)
+    if not is_valid:
+        node.INGEST_ITEMS.inc("error")
+        return JSONResponse({"error": error}, status_code=400)
+
+    if node.GROUP_COMMIT:
+        stored, log_id = await asyncio.wrap_future(node._get_committer().submit(payload))
+    else:
+        stored, log_id = (await asyncio.to_thread(node._commit_group, [payload]))[0]
+    if not stored:
+        return JSONResponse(
+            {"error": "Duplicate idempotency_key", "existing_log_id": log_id}, status_code=409
+        )
+    return JSONResponse({"status": "stored", "log_id": log_id}, status_code=201)
+
+
+async def list_logs(request):
+    logs = await asyncio.to_thread(node._list_logs, request.query_params.get("synced"))
+    return JSONResponse({"count": len(logs), "logs": logs})
+
+
+def _handle_batch(body, encoding, mimetype):
+    node.BATCH_BYTES.observe(len(body), "/node/logs/batch")
+    payload, error = node._parse_batch_body(body, encoding, mimetype)
+    if error is not None:
+        return error
+    if not isinstance(payload, list):
+        return {"error": "Expected a JSON array"}, 400
+    return node._ingest_batch(payload), 200
+
+
+async def ingest_node_batch(request):
+    body, status = await asyncio.to_thread(
+        _handle_batch,
+        await request.body(),
+        request.headers.get("content-encoding", "identity"),
+        _mimetype(request),
+    )
+    return JSONResponse(body, status_code=status)
+
+
+async def _upstream_capabilities(base_url, path):
+    if node.SYNC_COMPRESSION == "off":
+        return {}
+    if base_url not in node.UPSTREAM_CAPABILITIES:
+        try:
+            response = await CLIENT.get(f"{base_url}{path}")
+        except httpx.HTTPError:
+            return {}
+        capabilities = response.json() if response.status_code == 200 else {}
+        node.UPSTREAM_CAPABILITIES[base_url] = capabilities
+    return node.UPSTREAM_CAPABILITIES[base_url]
+
+
+async def _send_batch(batch, batch_seqs):
+    outcome = node._new_outcome()
+    breaker = node.BREAKERS.get(node.CENTRAL_DB_URL)
+    try:
+        if len(batch) == 1:
+            response = await CLIENT.post(f"{node.CENTRAL_DB_URL}/central/logs", json=batch[0])
+        else:
+            capabilities = await _upstream_capabilities(
+                node.CENTRAL_DB_URL, "/central/capabilities"
+            )
+            data, headers = node._encode_batch(batch, capabilities)
+            node.BATCH_BYTES.observe(len(data), "/sync/central")
+            response = await CLIENT.post(
+                f"{node.CENTRAL_DB_URL}/central/logs/batch", content=data, headers=headers
+            )
+    except httpx.HTTPError as exc:
+        return node._transport_failed(outcome, breaker, batch_seqs, exc)
+    return node._read_push_response(outcome, breaker, batch, batch_seqs, response)
+
+
+async def _push_to_central():
+    # The claim may relay to a peer while the central circuit is open; that
+    # path still uses app.py's blocking session, so it runs in a thread.
+    result, batches, errors = await asyncio.to_thread(node._claim_push)
+    if result is not None:
+        return result
+    try:
+        outcomes = await asyncio.gather(*(_send_batch(*batch) for batch in batches))
+        return await asyncio.to_thread(node._finish_push, batches, errors, outcomes)
+    finally:
+        await asyncio.to_thread(node._release_batches, batches)
+
+
+async def sync_central(request):
+    body, status = await _push_to_central()
+    return JSONResponse(body, status_code=status)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    global CLIENT
+    CLIENT = httpx.AsyncClient(timeout=node.CENTRAL_DB_TIMEOUT)
+    loop = asyncio.get_running_loop()
+    if node.SYNC_WORKER:
+        # Installed before the store opens so app.py does not start its own;
+        # the worker thread runs each push on the event loop.
+        node.WORKER = SyncWorker(
+            lambda: asyncio.run_coroutine_threadsafe(_push_to_central(), loop).result(),
+            node._pending_count,
+            idle_interval=node.SYNC_IDLE_INTERVAL,
+            min_backoff=node.SYNC_BACKOFF_MIN,
+            max_backoff=node.SYNC_BACKOFF_MAX,
+        )
+    await asyncio.to_thread(node._get_store)
+    if node.WORKER is not None:
+        node.WORKER.start()
+    try:
+        yield
+    finally:
+        if node.WORKER is not None:
+            node.WORKER.stop()
+        await CLIENT.aclose()
+
+
+app = Starlette(
+    routes=[
+        Route("/health", _timed("/health", health), methods=["GET"]),
+        Route("/logs", _timed("/logs", create_log), methods=["POST"]),
+        Route("/logs", _timed("/logs", list_logs), methods=["GET"]),
+        Route("/node/logs/batch", _timed("/node/logs/batch", ingest_node_batch), methods=["POST"]),
+        Route("/sync/central", _timed("/sync/central", sync_central), methods=["POST"]),
+        Mount("/", app=WSGIMiddleware(node.app)),
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", "5000")))
@@ -0,0 +1,214 @@
+"""Throughput of the node's data-path helpers at growing store sizes.
+
+Runs in-process against throwaway data directories, so no server is needed.
+For every size the store is filled with synthetic logs (not timed; 90% of
+them already synced), then each helper is timed on a fixed amount of work
+against it:
+
+    python bench_data_path.py                      # 1k, 10k, 100k and 1M logs
+    python bench_data_path.py --sizes 1000,10000 --engines segments,json
+    python bench_data_path.py --json               # for run_microbench.py
+
+The best of ``--repeat`` rounds is reported. ``json`` is the original engine
+that rewrites the whole file on every write; expect it to be slow at 100k+.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import app
+from storage import LogCache, open_store
+
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+FILL_CHUNK = 10000
+SYNCED_SHARE = 0.9
+TENANTS = [f"municipality-{index}" for index in range(10)]
+OPERATION_TYPES = ["record_transaction", "dispatch_unit", "close_incident", "update_inventory"]
+
+
+def make_log(index, synced):
+    return {
+        "log_id": f"bench-log-{index}",
+        "op_id": f"bench-op-{index}",
+        "idempotency_key": f"bench-idem-{index}",
+        "source_node_id": "node-1",
+        "target_scope": "central",
+        "operation_type": OPERATION_TYPES[index % len(OPERATION_TYPES)],
+        "operation_body": {"amount": index % 100},
+        "occurred_at": "2026-02-03T10:00:00Z",
+        "recorded_at": "2026-02-03T10:00:00Z",
+        "actor_type": "system",
+        "actor_id": "bench",
+        "tenant_id": TENANTS[index % len(TENANTS)],
+        "location_id": "location-1",
+        "region_id": f"region-{index % 5}",
+        "facility_id": f"facility-{index % 20}",
+        "retries": 0,
+        "created_at": "2026-02-03T10:00:01Z",
+        "synced": synced,
+        "synced_at": "2026-02-03T10:05:00Z" if synced else None,
+    }
+
+
+def open_cache(engine, data_dir):
+    store = open_store(engine, data_dir, os.path.join(data_dir, "logs.json"))
+    return LogCache(store, write_behind=False)
+
+
+def fill(engine, data_dir, size):
+    cache = open_cache(engine, data_dir)
+    rng = random.Random(size)
+    for start in range(0, size, FILL_CHUNK):
+        stop = min(start + FILL_CHUNK, size)
+        cache.append(
+            [make_log(index, rng.random() < SYNCED_SHARE) for index in range(start, stop)]
+        )
+    return cache
+
+
+def bench_load_cold(context):
+    # Opening the store and loading every log, as a restart does.
+    app.STORE = open_cache(context["engine"], context["data_dir"])
+    app._load_logs()
+    return context["size"]
+
+
+def bench_load(context):
+    for _ in range(1000):
+        app._load_logs()
+    return 1000
+
+
+def bench_find_many(context):
+    # The duplicate check of _insert_logs, 100 keys per call; half hits, half
+    # misses.
+    keys = context["lookup_keys"]
+    store = app._get_store()
+    with app.LOCK:
+        for start in range(0, len(keys), 100):
+            store.find_many(keys[start : start + 100])
+    return len(keys)
+
+
+def bench_validate_payload(context):
+    payloads = context["payloads"]
+    for payload in payloads:
+        app._validate_payload(payload)
+    return len(payloads)
+
+
+def bench_claim_batches(context):
+    # The unsynced selection behind POST /sync/central.
+    for _ in range(200):
+        batches, _, _ = app._claim_batches(app.SYNC_CONCURRENCY)
+        app._release_batches(batches)
+    return 200
+
+
+def bench_list_unsynced(context):
+    rows = 0
+    for _ in range(5):
+        rows += len(app._list_logs("false"))
+    return rows
+
+
+def bench_update(context):
+    # Marks 1000 pending logs synced, 100 per call, written through.
+    with app.LOCK:
+        seqs = [seq for seq, _ in itertools.islice(app._get_store().iter_pending(), 1000)]
+        for start in range(0, len(seqs), 100):
+            synced_at = app._utc_now()
+            app._update_logs(
+                {seq: {"synced": True, "synced_at": synced_at} for seq in seqs[start : start + 100]}
+            )
+    return len(seqs)
+
+
+def bench_insert(context):
+    # 1000 new logs, 100 per call, through the duplicate check and append.
+    first = context["next_index"]
+    context["next_index"] += 1000
+    payloads = [make_log(index, False) for index in range(first, first + 1000)]
+    with app.LOCK:
+        for start in range(0, len(payloads), 100):
+            app._insert_logs(payloads[start : start + 100])
+    return len(payloads)
+
+
+BENCHMARKS = (
+    ("load_cold", bench_load_cold),
+    ("load", bench_load),
+    ("find_many", bench_find_many),
+    ("validate_payload", bench_validate_payload),
+    ("claim_batches", bench_claim_batches),
+    ("list_unsynced", bench_list_unsynced),
+    ("update", bench_update),
+    ("insert", bench_insert),
+)
+
+
+def run(engine, size, repeat):
+    data_dir = tempfile.mkdtemp(prefix="node-bench-")
+    try:
+        app.STORE = fill(engine, data_dir, size)
+        rng = random.Random(0)
+        context = {
+            "engine": engine,
+            "data_dir": data_dir,
+            "size": size,
+            "next_index": size,
+            "lookup_keys": [f"bench-idem-{rng.randrange(size * 2)}" for _ in range(10000)],
+            "payloads": [make_log(index, False) for index in range(min(size, 10000))],
+        }
+        results = []
+        for name, benchmark in BENCHMARKS:
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                ops = benchmark(context)
+                elapsed = time.perf_counter() - started
+                if best is None or ops / elapsed > best["ops_per_second"]:
+                    best = {"ops": ops, "seconds": elapsed, "ops_per_second": ops / elapsed}
+            results.append(
+                {"service": "node", "engine": engine, "size": size, "benchmark": name, **best}
+            )
+        return results
+    finally:
+        app.STORE = None
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)))
+    parser.add_argument("--engines", default="segments")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for engine in args.engines.split(","):
+        for size in map(int, args.sizes.split(",")):
+            rows = run(engine, size, args.repeat)
+            results.extend(rows)
+            if not args.json:
+                for row in rows:
+                    print(
+                        f"{engine:>9} {size:>8} {row['benchmark']:>20} "
+                        f"{row['ops_per_second']:>14,.0f} ops/s",
+                        flush=True,
+                    )
+    if args.json:
+        json.dump(results, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import time
+from threading import Lock
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker for one upstream URL.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    ``allow()`` fails fast for ``reset_timeout`` seconds. Then a single probe
+    is let through (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, url, failure_threshold=3, reset_timeout=30.0):
+        self.url = url
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self._lock = Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def release_probe(self):
+        # The probe slot was taken but nothing was sent.
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def retry_in(self):
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def status(self):
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "retry_in_seconds": round(self.retry_in(), 2),
+        }
+
+
+class BreakerRegistry:
+    def __init__(self, failure_threshold=3, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = Lock()
+
+    def get(self, url):
+        with self._lock:
+            breaker = self._breakers.get(url)
+            if breaker is None:
+                breaker = CircuitBreaker(url, self.failure_threshold, self.reset_timeout)
+                self._breakers[url] = breaker
+            return breaker
+
+    def status(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.url: breaker.status() for breaker in breakers}
+
+
+def retry_delay(retries, base=1.0, maximum=300.0):
+    if retries <= 0:
+        return 0.0
+    return min(maximum, base * (2 ** (retries - 1)))
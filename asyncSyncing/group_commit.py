@@ -0,0 +1,58 @@
+import queue
+import time
+from concurrent.futures import Future
+from threading import Lock, Thread
+
+
+class GroupCommitter:
+    """Single writer thread that commits queued items in groups.
+
+    ``commit`` is called with a list of items and returns one result per
+    item, in order. A group closes ``window`` seconds after its first item
+    arrived or once it holds ``max_entries`` items, so concurrent writers
+    share one store append (and one fsync) instead of taking turns.
+    """
+
+    def __init__(self, commit, window=0.002, max_entries=256):
+        self.commit = commit
+        self.window = window
+        self.max_entries = max_entries
+        self._queue = queue.Queue()
+        self._lock = Lock()
+        self._thread = None
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future))
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = Thread(target=self._run, name="group-commit", daemon=True)
+                    self._thread.start()
+        return future
+
+    def _collect(self):
+        group = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(group) < self.max_entries:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    group.append(self._queue.get(timeout=remaining))
+                else:
+                    group.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return group
+
+    def _run(self):
+        while True:
+            group = self._collect()
+            try:
+                results = self.commit([item for item, _ in group])
+            except Exception as exc:  # every waiter in the group sees the failure
+                for _, future in group:
+                    future.set_exception(exc)
+                continue
+            for (_, future), result in zip(group, results):
+                future.set_result(result)
@@ -0,0 +1,60 @@
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, so the lock only covers this process
+    fcntl = None
+
+
+class ProcessLock:
+    """Re-entrant lock shared by threads and by processes, via ``flock`` on
+    ``path``.
+
+    The thread lock is taken first, so each process takes the file lock at
+    most once at a time. The lock file is reopened after a fork, so forked
+    workers do not share one open file (and with it, one lock).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._handle = None
+        self._pid = None
+
+    def _file(self):
+        if self._handle is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._handle = open(self.path, "a+b")
+            self._pid = os.getpid()
+        return self._handle
+
+    def acquire(self, blocking=True):
+        if not self._lock.acquire(blocking):
+            return False
+        if self._depth == 0 and fcntl is not None:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(self._file().fileno(), flags)
+            except BlockingIOError:
+                self._lock.release()
+                return False
+            except BaseException:
+                self._lock.release()
+                raise
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and fcntl is not None:
+            fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
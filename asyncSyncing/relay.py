@@ -0,0 +1,77 @@
+import time
+from threading import Lock
+
+import requests
+
+
+class PeerDirectory:
+    """Configured sibling nodes with cached health and measured latency.
+
+    Peers are probed with ``GET /health`` at most once per ``ttl`` seconds.
+    Latency is an exponentially weighted average of the probe round trips.
+    """
+
+    def __init__(self, urls, session_factory, ttl=15.0, timeout=2.0):
+        self.urls = [url.rstrip("/") for url in urls if url.strip()]
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.timeout = timeout
+        self._peers = {
+            url: {"url": url, "healthy": False, "latency_ms": None, "checked_at": None}
+            for url in self.urls
+        }
+        self._lock = Lock()
+
+    def _probe(self, url):
+        started = time.monotonic()
+        try:
+            response = self.session_factory().get(f"{url}/health", timeout=self.timeout)
+            healthy = response.status_code == 200
+        except requests.RequestException:
+            healthy = False
+        elapsed_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            peer = self._peers[url]
+            peer["healthy"] = healthy
+            peer["checked_at"] = time.monotonic()
+            if healthy:
+                previous = peer["latency_ms"]
+                peer["latency_ms"] = (
+                    elapsed_ms if previous is None else 0.7 * previous + 0.3 * elapsed_ms
+                )
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        for url in self.urls:
+            checked_at = self._peers[url]["checked_at"]
+            if force or checked_at is None or now - checked_at > self.ttl:
+                self._probe(url)
+
+    def mark_failed(self, url):
+        with self._lock:
+            if url in self._peers:
+                self._peers[url]["healthy"] = False
+                self._peers[url]["checked_at"] = time.monotonic()
+
+    def ranked(self, exclude=()):
+        self.refresh()
+        with self._lock:
+            healthy = [
+                dict(peer)
+                for url, peer in self._peers.items()
+                if peer["healthy"] and url not in exclude
+            ]
+        return sorted(healthy, key=lambda peer: peer["latency_ms"])
+
+    def status(self):
+        with self._lock:
+            peers = [dict(peer) for peer in self._peers.values()]
+        now = time.monotonic()
+        for peer in peers:
+            checked_at = peer.pop("checked_at")
+            peer["checked_seconds_ago"] = (
+                None if checked_at is None else round(now - checked_at, 1)
+            )
+            if peer["latency_ms"] is not None:
+                peer["latency_ms"] = round(peer["latency_ms"], 1)
+        return peers
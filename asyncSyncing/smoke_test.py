@@ -1,25 +1,45 @@
+import gzip
 import json
+import os
+import shutil
+import socket
+import subprocess
 import sys
+import tempfile
+import threading
+import time
+import uuid
 from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import requests
 
 
 BASE_URL = "http://localhost:5000"
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# New keys on every run, so the checks below also pass against a node that
+# earlier runs have filled.
+RUN_ID = uuid.uuid4().hex[:8]
+
+
+class SmokeFailure(Exception):
+    pass
+
+
+def expect(condition, message):
+    if not condition:
+        raise SmokeFailure(message)
 
 
 def utc_now():
     return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
 
 
-def main():
-    health = requests.get(f"{BASE_URL}/health", timeout=5)
-    health.raise_for_status()
-
-    payload = {
-        "log_id": "smoke-log-1",
-        "op_id": "smoke-op-1",
-        "idempotency_key": "smoke-idem-1",
+def make_payload(suffix):
+    return {
+        "log_id": f"smoke-log-{suffix}",
+        "op_id": f"smoke-op-{suffix}",
+        "idempotency_key": f"smoke-idem-{suffix}",
         "source_node_id": "node-1",
         "target_scope": "level-2",
         "operation_type": "record_transaction",
@@ -35,31 +55,319 @@ def main():
         "retries": 0,
     }
 
+
+def to_ndjson(items):
+    return "".join(json.dumps(item) + "\n" for item in items).encode("utf-8")
+
+
+def post_batch(data, headers):
+    return requests.post(f"{BASE_URL}/node/logs/batch", data=data, headers=headers, timeout=5)
+
+
+def check_batch_formats():
+    items = [make_payload(f"{RUN_ID}-fmt-{index}") for index in range(6)]
+
+    plain = post_batch(json.dumps(items[:2]), {"Content-Type": "application/json"})
+    plain.raise_for_status()
+    expect(plain.json()["accepted"] == 2, f"JSON batch: {plain.json()}")
+
+    ndjson = post_batch(to_ndjson(items[2:4]), {"Content-Type": "application/x-ndjson"})
+    ndjson.raise_for_status()
+    expect(ndjson.json()["accepted"] == 2, f"NDJSON batch: {ndjson.json()}")
+
+    gzipped = post_batch(
+        gzip.compress(to_ndjson(items[4:])),
+        {"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"},
+    )
+    gzipped.raise_for_status()
+    expect(gzipped.json()["accepted"] == 2, f"gzip NDJSON batch: {gzipped.json()}")
+
+    again = post_batch(json.dumps(items), {"Content-Type": "application/json"})
+    again.raise_for_status()
+    expect(again.json()["duplicates"] == 6, f"Repeated batch: {again.json()}")
+
+    rejected = [
+        ("bad gzip", b"not gzip", {"Content-Type": "application/json", "Content-Encoding": "gzip"}),
+        ("bad JSON", b"[{", {"Content-Type": "application/json"}),
+        ("non-array", b"{}", {"Content-Type": "application/json"}),
+    ]
+    for name, data, headers in rejected:
+        response = post_batch(data, headers)
+        expect(response.status_code == 400, f"{name}: {response.status_code}")
+    unsupported = post_batch(b"[]", {"Content-Type": "application/json", "Content-Encoding": "br"})
+    expect(unsupported.status_code == 415, f"Unknown encoding: {unsupported.status_code}")
+
+
+def check_digest():
+    digest = requests.get(f"{BASE_URL}/node/digest", timeout=5)
+    digest.raise_for_status()
+    bucket_count = digest.json()["bucket_count"]
+
+    buckets = requests.get(f"{BASE_URL}/node/digest/buckets", timeout=5)
+    buckets.raise_for_status()
+    expect(len(buckets.json()["digests"]) == bucket_count, "Bucket digests do not cover the ring")
+
+    children = requests.post(f"{BASE_URL}/node/digest/children", json={"paths": [[0]]}, timeout=5)
+    children.raise_for_status()
+    fanout = children.json()["fanout"]
+    expect(len(children.json()["children"][0]) == fanout, f"Children: {children.json()}")
+
+    all_buckets = [[bucket] for bucket in range(bucket_count)]
+    keys = requests.post(f"{BASE_URL}/node/digest/keys", json={"paths": all_buckets}, timeout=10)
+    keys.raise_for_status()
+    expect(keys.json()["count"] == digest.json()["count"], f"Digest keys: {keys.json()['count']}")
+
+    for route in ("children", "keys"):
+        for body in ({"paths": [[]]}, {"paths": "0"}, {"paths": [["0"]]}):
+            response = requests.post(f"{BASE_URL}/node/digest/{route}", json=body, timeout=5)
+            expect(response.status_code == 400, f"{route} {body}: {response.status_code}")
+
+
+def check_archive(node_url):
+    # The helper node rotates segments every two entries, so most of what it
+    # holds is in closed segments and can be archived.
+    logs = [make_payload(f"{RUN_ID}-archive-{index}") for index in range(5)]
+    requests.post(f"{node_url}/node/logs/batch", json=logs, timeout=5).raise_for_status()
+    requests.post(f"{node_url}/sync/run", timeout=5).raise_for_status()
+    too_soon = requests.post(f"{node_url}/archive/run", json={"older_than_hours": 0}, timeout=5)
+    expect(too_soon.status_code == 400, f"older_than_hours 0: {too_soon.status_code}")
+
+    time.sleep(1.5)
+    archived = requests.post(
+        f"{node_url}/archive/run", json={"older_than_hours": 0.0003}, timeout=30
+    )
+    archived.raise_for_status()
+    count = archived.json()["archived"]
+    expect(count > 0, f"Archive run: {archived.json()}")
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2}
+        if cursor is not None:
+            params["cursor"] = cursor
+        page = requests.get(f"{node_url}/archive/logs", params=params, timeout=10)
+        page.raise_for_status()
+        seen.extend(log["idempotency_key"] for log in page.json()["logs"])
+        cursor = page.json()["next_cursor"]
+        if cursor is None:
+            break
+    expect(len(seen) == count == len(set(seen)), f"Archive pages: {len(seen)} of {count}")
+
+    remaining = requests.get(f"{node_url}/logs", timeout=10)
+    remaining.raise_for_status()
+    left = {log["idempotency_key"] for log in remaining.json()["logs"]}
+    expect(not left & set(seen), "Archived logs still listed by GET /logs")
+
+    found = requests.get(f"{node_url}/archive/logs", params={"idempotency_key": seen[0]}, timeout=5)
+    found.raise_for_status()
+    expect(found.json()["count"] == 1, f"Archive lookup: {found.json()}")
+    missing = requests.get(
+        f"{node_url}/archive/logs", params={"idempotency_key": f"{RUN_ID}-none"}, timeout=5
+    )
+    missing.raise_for_status()
+    expect(missing.json()["count"] == 0, f"Archive lookup of a missing key: {missing.json()}")
+
+    bad = requests.get(f"{node_url}/archive/logs", params={"limit": "0"}, timeout=5)
+    expect(bad.status_code == 400, f"Archive limit 0: {bad.status_code}")
+    return count
+
+
+class FakeCentral(BaseHTTPRequestHandler):
+    # Stands in for central: "reject" answers 400 to every log, "down" 503.
+    mode = "reject"
+
+    def do_GET(self):
+        self._answer(404, {"error": "Not found"})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if FakeCentral.mode == "down":
+            self._answer(503, {"error": "Unavailable"})
+        else:
+            self._answer(400, {"error": "Rejected"})
+
+    def _answer(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def start_helper_node(central_url, data_dir):
+    # A second node that syncs to the fake central and relays to BASE_URL.
+    # It always uses the segment store, which archiving needs.
+    port = free_port()
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        DATA_DIR=data_dir,
+        CENTRAL_DB_URL=central_url,
+        PEER_URLS=BASE_URL,
+        STORAGE_ENGINE="segments",
+        SEGMENT_MAX_ENTRIES="2",
+        SYNC_MAX_RETRIES="2",
+        RETRY_BACKOFF_BASE="0.5",
+        CIRCUIT_FAILURE_THRESHOLD="1",
+        CIRCUIT_RESET_TIMEOUT="60",
+        SYNC_WORKER="false",
+        ANTI_ENTROPY_INTERVAL="0",
+    )
+    env.pop("LOGS_PATH", None)
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BASE_DIR, "app.py")],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://localhost:{port}"
+    for _ in range(100):
+        try:
+            requests.get(f"{url}/health", timeout=1).raise_for_status()
+            return process, url
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.terminate()
+    raise SmokeFailure("Helper node did not start")
+
+
+def check_helper_node():
+    # Failure paths need a central that rejects logs or is down, so they run
+    # against a second node started here. Returns the number archived.
+    central = ThreadingHTTPServer(("localhost", 0), FakeCentral)
+    threading.Thread(target=central.serve_forever, daemon=True).start()
+    data_dir = tempfile.mkdtemp(prefix="node-smoke-")
+    process = None
+    try:
+        process, node_url = start_helper_node(f"http://localhost:{central.server_port}", data_dir)
+        payload = make_payload(f"{RUN_ID}-failing")
+        key = payload["idempotency_key"]
+        requests.post(f"{node_url}/logs", json=payload, timeout=5).raise_for_status()
+
+        FakeCentral.mode = "reject"
+        rejected = requests.post(f"{node_url}/sync/central", timeout=10)
+        expect(rejected.status_code == 502, f"Rejected push: {rejected.status_code}")
+
+        # Inside its retry backoff the log is reported as deferred.
+        deferred = requests.post(f"{node_url}/sync/central", timeout=10)
+        deferred.raise_for_status()
+        body = deferred.json()
+        expect(body["pushed"] == 0 and body.get("deferred") == 1, f"Deferred push: {body}")
+        expect(body["retry_in"] > 0, f"Deferred retry_in: {body}")
+
+        time.sleep(body["retry_in"] + 0.1)
+        rejected = requests.post(f"{node_url}/sync/central", timeout=10)
+        expect(rejected.status_code == 502, f"Second rejected push: {rejected.status_code}")
+
+        dead = requests.get(f"{node_url}/sync/dead-letter", timeout=5)
+        dead.raise_for_status()
+        dead_keys = [log["idempotency_key"] for log in dead.json()["logs"]]
+        expect(dead_keys == [key], f"Dead letters: {dead_keys}")
+        status = requests.get(f"{node_url}/sync/status", timeout=5)
+        status.raise_for_status()
+        expect(status.json()["dead_letter"] == 1, f"Sync status: {status.json()}")
+        idle = requests.post(f"{node_url}/sync/central", timeout=10)
+        idle.raise_for_status()
+        expect("deferred" not in idle.json(), f"Dead letter still pending: {idle.json()}")
+
+        requeued = requests.post(
+            f"{node_url}/sync/dead-letter/retry", json={"idempotency_keys": [key]}, timeout=5
+        )
+        requeued.raise_for_status()
+        expect(requeued.json()["requeued"] == 1, f"Requeue: {requeued.json()}")
+
+        # A 5xx opens the central circuit; the next sync relays to the peer.
+        FakeCentral.mode = "down"
+        failed = requests.post(f"{node_url}/sync/central", timeout=10)
+        expect(failed.status_code == 502, f"Push to a down central: {failed.status_code}")
+        relayed = requests.post(f"{node_url}/sync/central", timeout=10)
+        relayed.raise_for_status()
+        expect(relayed.json().get("relayed") == 1, f"Relay: {relayed.json()}")
+        expect(relayed.json().get("peer") == BASE_URL, f"Relay peer: {relayed.json()}")
+        peer_logs = requests.get(f"{BASE_URL}/logs", timeout=10)
+        peer_logs.raise_for_status()
+        peer_keys = {log["idempotency_key"] for log in peer_logs.json()["logs"]}
+        expect(key in peer_keys, "Relayed log missing on the peer")
+
+        peers = requests.get(f"{node_url}/peers", timeout=5)
+        peers.raise_for_status()
+        expect(peers.json()["peers"][0]["url"] == BASE_URL, f"Peers: {peers.json()}")
+
+        reconciled = requests.post(
+            f"{node_url}/node/reconcile", json={"peer": BASE_URL}, timeout=60
+        )
+        reconciled.raise_for_status()
+        result = reconciled.json()["peers"][0]
+        expect("error" not in result, f"Reconcile: {result}")
+        expect(result["received"] > 0, f"Reconcile received nothing: {result}")
+        again = requests.post(f"{node_url}/node/reconcile", json={"peer": BASE_URL}, timeout=60)
+        again.raise_for_status()
+        result = again.json()["peers"][0]
+        expect(result["sent"] == 0 and result["received"] == 0, f"Second reconcile: {result}")
+
+        unknown = requests.post(
+            f"{node_url}/node/reconcile", json={"peer": "http://unknown"}, timeout=5
+        )
+        expect(unknown.status_code == 400, f"Unknown peer: {unknown.status_code}")
+
+        return check_archive(node_url)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+        central.shutdown()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def main():
+    health = requests.get(f"{BASE_URL}/health", timeout=5)
+    health.raise_for_status()
+
+    payload = make_payload("1")
+
     create = requests.post(
         f"{BASE_URL}/logs",
         data=json.dumps(payload),
         headers={"Content-Type": "application/json"},
         timeout=5,
     )
-    create.raise_for_status()
+    if create.status_code != 409:
+        create.raise_for_status()
 
     before = requests.get(f"{BASE_URL}/logs?synced=false", timeout=5)
     before.raise_for_status()
 
+    check_batch_formats()
+    check_digest()
+
     sync = requests.post(f"{BASE_URL}/sync/run", timeout=5)
     sync.raise_for_status()
 
     after = requests.get(f"{BASE_URL}/logs?synced=true", timeout=5)
     after.raise_for_status()
 
+    archived = check_helper_node()
+
     print("Smoke test passed.")
     print("Unsynced logs:", before.json().get("count"))
     print("Synced logs:", after.json().get("count"))
+    print("Archived logs on the helper node:", archived)
 
 
 if __name__ == "__main__":
     try:
         main()
-    except requests.RequestException as exc:
+    except (requests.RequestException, SmokeFailure) as exc:
         print(f"Smoke test failed: {exc}")
         sys.exit(1)
@@ -0,0 +1,817 @@
+import bisect
+import gzip
+import heapq
+import io
+import json
+import os
+
+from anti_entropy import KeyDigest
+
+
+STATE_FIELDS = ("synced", "synced_at", "retries", "dead_lettered_at", "relayed_to")
+
+
+def _dumps(record):
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+
+def _file_generation(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return (path, None, None)
+    return (path, stat.st_size, stat.st_mtime_ns)
+
+
+class IdempotencyIndex:
+    """In-memory map of idempotency_key -> (log_id, seq).
+
+    ``watermark`` is the next sequence number the index has not seen yet, so
+    a snapshot can be caught up by replaying only newer entries.
+    """
+
+    def __init__(self, snapshot_path=None):
+        self.snapshot_path = snapshot_path
+        self.entries = {}
+        self.watermark = 0
+        self._digest = None
+
+    def get(self, idempotency_key):
+        entry = self.entries.get(idempotency_key)
+        if entry is None:
+            return None
+        return {"log_id": entry[0], "seq": entry[1]}
+
+    def add(self, idempotency_key, log_id, seq):
+        if idempotency_key not in self.entries:
+            self.entries[idempotency_key] = (log_id, seq)
+            if self._digest is not None:
+                self._digest.add(idempotency_key)
+        self.watermark = max(self.watermark, seq + 1)
+
+    def digest(self, buckets):
+        # Built on first use, then kept current by add().
+        if self._digest is None or self._digest.buckets != buckets:
+            self._digest = KeyDigest(buckets)
+            self._digest.update(self.entries)
+        return self._digest
+
+    def load_snapshot(self, max_watermark):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as handle:
+                snapshot = json.load(handle)
+        except (OSError, json.JSONDecodeError):
+            return False
+        if snapshot.get("watermark", 0) > max_watermark:
+            return False
+        self.entries = {key: tuple(value) for key, value in snapshot["keys"].items()}
+        self.watermark = snapshot["watermark"]
+        self._digest = None
+        return True
+
+    def save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        # Per-process temp name: several workers may save at exit.
+        tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(
+                {"watermark": self.watermark, "keys": self.entries},
+                handle,
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+        os.replace(tmp_path, self.snapshot_path)
+
+
+class _IndexedStore:
+    snapshot_every = 0
+
+    def _open_index(self, snapshot_path):
+        self.index = IdempotencyIndex(snapshot_path)
+        self._unsnapshotted = 0
+        if not self.index.load_snapshot(self.next_seq()):
+            self.index = IdempotencyIndex(snapshot_path)
+        for seq, log in self.iter_since(self.index.watermark):
+            self.index.add(log.get("idempotency_key"), log.get("log_id"), seq)
+        self.index.watermark = self.next_seq()
+
+    def _index_appended(self, seqs, entries):
+        for seq, entry in zip(seqs, entries):
+            self.index.add(entry.get("idempotency_key"), entry.get("log_id"), seq)
+        self._unsnapshotted += len(entries)
+        if self.snapshot_every and self._unsnapshotted >= self.snapshot_every:
+            self.save_index()
+
+    def save_index(self):
+        self.index.save_snapshot()
+        self._unsnapshotted = 0
+
+    def find_by_idempotency(self, idempotency_key):
+        return self.index.get(idempotency_key)
+
+
+class JsonFileStore(_IndexedStore):
+    """Original layout: one JSON array, rewritten in full on every write."""
+
+    def __init__(self, path, snapshot_path=None, snapshot_every=0):
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self.snapshot_every = snapshot_every
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if not os.path.exists(self.path):
+            self._save([])
+        self._open_index(self.snapshot_path)
+
+    def next_seq(self):
+        return len(self._read())
+
+    def iter_since(self, seq):
+        logs = self._read()
+        return ((index, logs[index]) for index in range(seq, len(logs)))
+
+    def _save(self, logs):
+        with open(self.path, "w", encoding="utf-8") as handle:
+            json.dump(logs, handle, ensure_ascii=False, indent=2)
+
+    def _read(self):
+        with open(self.path, "r", encoding="utf-8") as handle:
+            return json.load(handle)
+
+    def load(self):
+        return dict(enumerate(self._read()))
+
+    def generation(self):
+        return _file_generation(self.path)
+
+    def read_new(self):
+        # The file is rewritten in full on every write, so any change made by
+        # another process means a reload.
+        return None
+
+    def append(self, entries):
+        logs = self._read()
+        first_seq = len(logs)
+        logs.extend(entries)
+        self._save(logs)
+        seqs = list(range(first_seq, first_seq + len(entries)))
+        self._index_appended(seqs, entries)
+        return seqs
+
+    def update(self, changes):
+        if not changes:
+            return
+        logs = self._read()
+        for seq, fields in changes.items():
+            logs[seq].update(fields)
+        self._save(logs)
+
+
+class SegmentStore(_IndexedStore):
+    """Append-only JSONL segments plus a sync-state journal.
+
+    Log entries are written once to the active segment as ``{"seq", "log"}``
+    records. Later changes to ``synced``, ``synced_at`` and ``retries`` go to
+    ``state.jsonl`` and are replayed over the segments on load.
+
+    ``archive()`` moves entries out of closed segments into immutable gzip
+    files under ``archive/``; their idempotency keys are kept in
+    ``archive/keys.jsonl`` and loaded into the index on open. Each archive is
+    written as one gzip member per ``ARCHIVE_CHUNK`` entries, with the first
+    seq and byte offset of every member in ``<archive>.idx``, so a read that
+    starts mid-archive decompresses from the member holding its first seq.
+
+    How far each segment and the journal have been read is remembered, so
+    ``read_new()`` can pick up lines appended by another process without
+    reading the files again.
+    """
+
+    SEGMENT_PREFIX = "segment-"
+    SEGMENT_SUFFIX = ".jsonl"
+    ARCHIVE_PREFIX = "archive-"
+    ARCHIVE_SUFFIX = ".jsonl.gz"
+    ARCHIVE_CHUNK = 1000
+
+    def __init__(
+        self,
+        root,
+        legacy_path=None,
+        segment_max_entries=10000,
+        fsync=False,
+        snapshot_path=None,
+        snapshot_every=0,
+    ):
+        self.root = root
+        self.legacy_path = legacy_path
+        self.segment_max_entries = segment_max_entries
+        self.fsync = fsync
+        self.snapshot_path = snapshot_path
+        self.snapshot_every = snapshot_every
+        self.segments_dir = os.path.join(root, "segments")
+        self.state_path = os.path.join(root, "state.jsonl")
+        self.archive_dir = os.path.join(root, "archive")
+        self.archive_keys_path = os.path.join(self.archive_dir, "keys.jsonl")
+        self._next_seq = 0
+        self._active_path = None
+        self._active_count = 0
+        self._offsets = {}
+        self._archive_members = {}
+
+    def open(self):
+        os.makedirs(self.root, exist_ok=True)
+        if not os.path.isdir(self.segments_dir):
+            self._migrate_legacy()
+        segments = self._segment_paths()
+        if segments:
+            self._active_path = segments[-1]
+            self._active_count, last_seq = self._recover_segment(self._active_path)
+            if last_seq is not None:
+                self._next_seq = last_seq + 1
+            else:
+                self._next_seq = self._segment_first_seq(self._active_path)
+        self._recover_tail(self.state_path)
+        self._recover_tail(self.archive_keys_path)
+        self._compact_state()
+        self._open_index(self.snapshot_path)
+        for record in self._read_records(self.archive_keys_path):
+            self.index.add(record["idempotency_key"], record["log_id"], record["seq"])
+
+    def next_seq(self):
+        return self._next_seq
+
+    def generation(self):
+        return tuple(_file_generation(path) for path in self._segment_paths()) + (
+            _file_generation(self.state_path),
+        )
+
+    def iter_since(self, seq):
+        segments = self._segment_paths()
+        for position, path in enumerate(segments):
+            following = segments[position + 1] if position + 1 < len(segments) else None
+            if following is not None and self._segment_first_seq(following) <= seq:
+                continue
+            for record in self._read_records(path):
+                if record["seq"] >= seq:
+                    yield record["seq"], record["log"]
+
+    def _segment_name(self, first_seq):
+        return f"{self.SEGMENT_PREFIX}{first_seq:012d}{self.SEGMENT_SUFFIX}"
+
+    def _segment_first_seq(self, path):
+        name = os.path.basename(path)
+        return int(name[len(self.SEGMENT_PREFIX) : -len(self.SEGMENT_SUFFIX)])
+
+    def _segment_paths(self):
+        names = sorted(
+            name
+            for name in os.listdir(self.segments_dir)
+            if name.startswith(self.SEGMENT_PREFIX) and name.endswith(self.SEGMENT_SUFFIX)
+        )
+        return [os.path.join(self.segments_dir, name) for name in names]
+
+    def _migrate_legacy(self):
+        staging_dir = self.segments_dir + ".tmp"
+        os.makedirs(staging_dir, exist_ok=True)
+        for name in os.listdir(staging_dir):
+            os.remove(os.path.join(staging_dir, name))
+
+        logs = []
+        if self.legacy_path and os.path.exists(self.legacy_path):
+            with open(self.legacy_path, "r", encoding="utf-8") as handle:
+                logs = json.load(handle)
+
+        for start in range(0, len(logs), self.segment_max_entries):
+            chunk = logs[start : start + self.segment_max_entries]
+            path = os.path.join(staging_dir, self._segment_name(start))
+            with open(path, "w", encoding="utf-8") as handle:
+                for offset, log in enumerate(chunk):
+                    handle.write(_dumps({"seq": start + offset, "log": log}) + "\n")
+                handle.flush()
+                os.fsync(handle.fileno())
+
+        os.rename(staging_dir, self.segments_dir)
+        if logs:
+            os.replace(self.legacy_path, self.legacy_path + ".migrated")
+
+    def _recover_tail(self, path):
+        # A crash mid-append can leave a partial last line; cut it off so the
+        # next append starts on a clean line.
+        if not os.path.exists(path):
+            return
+        with open(path, "rb+") as handle:
+            data = handle.read()
+            if not data or data.endswith(b"\n"):
+                return
+            handle.truncate(data.rfind(b"\n") + 1)
+
+    def _recover_segment(self, path):
+        self._recover_tail(path)
+        count = 0
+        last_seq = None
+        for record in self._read_records(path):
+            count += 1
+            last_seq = record["seq"]
+        return count, last_seq
+
+    def _read_records(self, path):
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as handle:
+            for line in handle:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def _write_lines(self, path, records):
+        # Callers hold the store lock and have caught up with read_new(), so
+        # the lines end where this store's read offset ends.
+        with open(path, "a", encoding="utf-8") as handle:
+            handle.write("".join(_dumps(record) + "\n" for record in records))
+            handle.flush()
+            if self.fsync:
+                os.fsync(handle.fileno())
+            self._offsets[path] = (os.fstat(handle.fileno()).st_ino, handle.tell())
+
+    def _read_tail(self, path):
+        # Records added to ``path`` past this store's offset, or None if the
+        # file was replaced or shrank since (archive, compaction).
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None if path in self._offsets else []
+        inode, offset = self._offsets.get(path, (stat.st_ino, 0))
+        if inode != stat.st_ino or stat.st_size < offset:
+            return None
+        if stat.st_size == offset:
+            return []
+        with open(path, "rb") as handle:
+            handle.seek(offset)
+            data = handle.read(stat.st_size - offset)
+        end = data.rfind(b"\n") + 1
+        self._offsets[path] = (inode, offset + end)
+        records = []
+        for line in data[:end].splitlines():
+            if line.strip():
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return records
+
+    def read_new(self):
+        """Returns ``(entries, states)`` written by other processes since this
+        store last read or wrote its files: new ``(seq, log)`` pairs and
+        journal records. Returns None when a file was rewritten or removed,
+        in which case the caller reopens and reloads."""
+        segments = self._segment_paths()
+        if any(path not in segments for path in self._offsets if path != self.state_path):
+            return None
+        entries = []
+        for path in segments:
+            records = self._read_tail(path)
+            if records is None:
+                return None
+            for record in records:
+                seq, log = record["seq"], record["log"]
+                entries.append((seq, log))
+                self.index.add(log.get("idempotency_key"), log.get("log_id"), seq)
+                self._next_seq = max(self._next_seq, seq + 1)
+            if path == self._active_path:
+                self._active_count += len(records)
+            elif path == segments[-1]:
+                self._active_path = path
+                self._active_count = len(records)
+        self.index.watermark = self._next_seq
+        states = self._read_tail(self.state_path)
+        if states is None:
+            return None
+        return entries, states
+
+    def _compact_state(self):
+        states = {}
+        lines = 0
+        for record in self._read_records(self.state_path):
+            lines += 1
+            states.setdefault(record["seq"], {}).update(record)
+        if lines <= max(1000, 2 * len(states)):
+            return
+        self._rewrite(self.state_path, [states[seq] for seq in sorted(states)])
+
+    def _rewrite(self, path, records):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            for record in records:
+                handle.write(_dumps(record) + "\n")
+            handle.flush()
+            os.fsync(handle.fileno())
+            written = (os.fstat(handle.fileno()).st_ino, handle.tell())
+        os.replace(tmp_path, path)
+        if path in self._offsets:
+            self._offsets[path] = written
+
+    def load(self):
+        logs = {}
+        self._offsets = {}
+        for path in self._segment_paths():
+            for record in self._read_tail(path):
+                logs[record["seq"]] = record["log"]
+        for record in self._read_tail(self.state_path):
+            log = logs.get(record["seq"])
+            if log is not None:
+                log.update({field: record[field] for field in STATE_FIELDS if field in record})
+        return logs
+
+    def append(self, entries):
+        seqs = []
+        pending = []
+        for entry in entries:
+            if self._active_path is None or self._active_count >= self.segment_max_entries:
+                if pending:
+                    self._write_lines(self._active_path, pending)
+                    pending = []
+                self._active_path = os.path.join(
+                    self.segments_dir, self._segment_name(self._next_seq)
+                )
+                self._active_count = 0
+            pending.append({"seq": self._next_seq, "log": entry})
+            seqs.append(self._next_seq)
+            self._next_seq += 1
+            self._active_count += 1
+        if pending:
+            self._write_lines(self._active_path, pending)
+        self._index_appended(seqs, entries)
+        return seqs
+
+    def update(self, changes):
+        if not changes:
+            return
+        records = []
+        for seq, fields in changes.items():
+            record = {field: fields[field] for field in STATE_FIELDS if field in fields}
+            record["seq"] = seq
+            records.append(record)
+        self._write_lines(self.state_path, records)
+
+    def _archive_range(self, path):
+        name = os.path.basename(path)[len(self.ARCHIVE_PREFIX) : -len(self.ARCHIVE_SUFFIX)]
+        first_seq, last_seq = name.split("-")
+        return int(first_seq), int(last_seq)
+
+    def _archive_paths(self):
+        if not os.path.isdir(self.archive_dir):
+            return []
+        names = sorted(
+            name
+            for name in os.listdir(self.archive_dir)
+            if name.startswith(self.ARCHIVE_PREFIX) and name.endswith(self.ARCHIVE_SUFFIX)
+        )
+        return [os.path.join(self.archive_dir, name) for name in names]
+
+    def _member_offsets(self, path):
+        # [[first seq, byte offset], ...] of the archive's gzip members, or
+        # None for archives written before the index existed. Archives never
+        # change, so the index is read once.
+        if path not in self._archive_members:
+            try:
+                with open(path + ".idx", "r", encoding="utf-8") as handle:
+                    self._archive_members[path] = json.load(handle)
+            except (OSError, ValueError):
+                return None
+        return self._archive_members[path]
+
+    def _read_archive(self, path, after=-1):
+        # Records in seq order, starting at the member that can hold the
+        # first seq > after; earlier records of that member are included.
+        offset = 0
+        members = self._member_offsets(path)
+        if members:
+            position = bisect.bisect_right([first for first, _ in members], after + 1) - 1
+            offset = members[max(position, 0)][1]
+        with open(path, "rb") as raw:
+            raw.seek(offset)
+            with gzip.GzipFile(fileobj=raw, mode="rb") as compressed:
+                for line in io.TextIOWrapper(compressed, encoding="utf-8"):
+                    if line.strip():
+                        record = json.loads(line)
+                        yield record["seq"], record["log"]
+
+    def archive(self, logs):
+        """Moves ``{seq: log}`` entries into a new archive file and drops them
+        from the segments and the state journal. Entries still in the active
+        segment are left alone. Returns the archived seqs."""
+        if self._active_path is None:
+            return []
+        active_first_seq = self._segment_first_seq(self._active_path)
+        seqs = sorted(seq for seq in logs if seq < active_first_seq)
+        if not seqs:
+            return []
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        name = f"{self.ARCHIVE_PREFIX}{seqs[0]:012d}-{seqs[-1]:012d}{self.ARCHIVE_SUFFIX}"
+        path = os.path.join(self.archive_dir, name)
+        tmp_path = path + ".tmp"
+        members = []
+        with open(tmp_path, "wb") as raw:
+            for start in range(0, len(seqs), self.ARCHIVE_CHUNK):
+                chunk = seqs[start : start + self.ARCHIVE_CHUNK]
+                members.append([chunk[0], raw.tell()])
+                with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=9) as handle:
+                    for seq in chunk:
+                        record = _dumps({"seq": seq, "log": logs[seq]})
+                        handle.write((record + "\n").encode("utf-8"))
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+        # Written after the archive: without it a read starts at the top.
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(members, handle)
+        os.replace(tmp_path, path + ".idx")
+        self._archive_members[path] = members
+        self._write_lines(
+            self.archive_keys_path,
+            [
+                {
+                    "seq": seq,
+                    "idempotency_key": logs[seq].get("idempotency_key"),
+                    "log_id": logs[seq].get("log_id"),
+                }
+                for seq in seqs
+            ],
+        )
+
+        # A crash from here on leaves entries in both places; reads of the
+        # archive skip the repeated seqs.
+        archived = set(seqs)
+        for segment in self._segment_paths():
+            if segment == self._active_path:
+                continue
+            records = list(self._read_records(segment))
+            kept = [record for record in records if record["seq"] not in archived]
+            if len(kept) == len(records):
+                continue
+            if kept:
+                self._rewrite(segment, kept)
+            else:
+                os.remove(segment)
+                self._offsets.pop(segment, None)
+        states = self._read_records(self.state_path)
+        self._rewrite(self.state_path, [state for state in states if state["seq"] not in archived])
+        return seqs
+
+    def iter_archive(self, after=-1):
+        """Yields archived ``(seq, log)`` pairs with seq > ``after`` in seq
+        order, decompressing only the files that can contain them."""
+        readers = [
+            self._read_archive(path, after)
+            for path in self._archive_paths()
+            if self._archive_range(path)[1] > after
+        ]
+        last_seq = after
+        for seq, log in heapq.merge(*readers, key=lambda item: item[0]):
+            if seq > last_seq:
+                last_seq = seq
+                yield seq, log
+
+    def find_archived(self, seq):
+        for path in self._archive_paths():
+            first_seq, last_seq = self._archive_range(path)
+            if first_seq <= seq <= last_seq:
+                for archived_seq, log in self._read_archive(path, seq - 1):
+                    if archived_seq == seq:
+                        return log
+                    if archived_seq > seq:
+                        break
+        return None
+
+
+class LogCache:
+    """Keeps a store's logs resident in memory.
+
+    Reads are served from memory. Appends are written through; state updates
+    are applied in memory and queued as dirty until ``flush()`` writes them
+    in one ``update`` call. The store's file generation is checked before
+    reads; writes made by another process are read in incrementally where
+    the store supports it, and trigger a reload otherwise.
+
+    The seqs still waiting to be synced are kept in ``pending`` (and
+    dead-lettered ones in ``dead_letter``) so callers can walk the sync
+    queue without scanning the synced history.
+    """
+
+    def __init__(self, store, write_behind=True):
+        self.store = store
+        self.write_behind = write_behind
+        self.logs = None
+        self.dirty = {}
+        self.pending = {}
+        self.dead_letter = {}
+        self._pending_unordered = False
+        # What the store saw when it was opened; a different generation at
+        # the first load means another process wrote since.
+        self._generation = store.generation()
+
+    @property
+    def index(self):
+        return self.store.index
+
+    def _refresh(self):
+        generation = self.store.generation()
+        if self.logs is not None and generation == self._generation:
+            return
+        if generation != self._generation:
+            changes = self.store.read_new() if self.logs is not None else None
+            if changes is not None:
+                self._apply_new(*changes)
+                self._generation = self.store.generation()
+                return
+            self.store.open()
+        self.logs = self.store.load()
+        for seq, fields in self.dirty.items():
+            if seq in self.logs:
+                self.logs[seq] = {**self.logs[seq], **fields}
+        self.pending = {}
+        self.dead_letter = {}
+        self._pending_unordered = False
+        for seq, log in self.logs.items():
+            self._track(seq, log)
+        self._generation = self.store.generation()
+
+    def _apply_new(self, entries, states):
+        for seq, log in entries:
+            self.logs[seq] = log
+            self._track(seq, log)
+        for record in states:
+            seq = record["seq"]
+            if seq not in self.logs:
+                continue
+            fields = {field: record[field] for field in STATE_FIELDS if field in record}
+            self.logs[seq] = {**self.logs[seq], **fields, **self.dirty.get(seq, {})}
+            self._track(seq, self.logs[seq])
+
+    def _track(self, seq, log):
+        # Dicts are used as insertion-ordered sets keyed by seq.
+        if log.get("synced"):
+            self.pending.pop(seq, None)
+            self.dead_letter.pop(seq, None)
+        elif log.get("dead_lettered_at"):
+            self.pending.pop(seq, None)
+            self.dead_letter[seq] = None
+        else:
+            self.dead_letter.pop(seq, None)
+            if seq not in self.pending:
+                # Seqs normally arrive in order; a requeued dead letter does
+                # not, and the queue is re-sorted on the next walk.
+                if self.pending and seq < next(reversed(self.pending)):
+                    self._pending_unordered = True
+                self.pending[seq] = None
+
+    def load(self):
+        self._refresh()
+        return self.logs
+
+    def find_many(self, idempotency_keys):
+        # One generation check for the whole batch, then plain index lookups;
+        # checking per key would stat every segment once per key.
+        self._refresh()
+        found = {}
+        for key in idempotency_keys:
+            entry = self.store.find_by_idempotency(key)
+            if entry is not None:
+                found[key] = entry
+        return found
+
+    def append(self, entries):
+        self._refresh()
+        seqs = self.store.append(entries)
+        for seq, entry in zip(seqs, entries):
+            self.logs[seq] = entry
+            self._track(seq, entry)
+        self._generation = self.store.generation()
+        return seqs
+
+    def iter_pending(self):
+        """Yields ``(seq, log)`` for unsynced, non-dead-lettered logs in seq
+        order. The cache must not be updated while the iterator is live."""
+        self._refresh()
+        if self._pending_unordered:
+            self.pending = dict.fromkeys(sorted(self.pending))
+            self._pending_unordered = False
+        for seq in self.pending:
+            yield seq, self.logs[seq]
+
+    def pending_count(self):
+        self._refresh()
+        return len(self.pending)
+
+    def dead_lettered(self):
+        self._refresh()
+        return [(seq, self.logs[seq]) for seq in sorted(self.dead_letter)]
+
+    def archive(self, logs):
+        self._refresh()
+        self.flush()
+        archived = self.store.archive(logs)
+        for seq in archived:
+            self.logs.pop(seq, None)
+            self.dirty.pop(seq, None)
+            self.pending.pop(seq, None)
+            self.dead_letter.pop(seq, None)
+        self._generation = self.store.generation()
+        return archived
+
+    def iter_archive(self, after=-1):
+        return self.store.iter_archive(after)
+
+    def digest(self, buckets):
+        self._refresh()
+        return self.store.index.digest(buckets)
+
+    def entries_for(self, idempotency_keys):
+        # Hot entries come from memory; archived ones are collected in one
+        # pass over the archive.
+        self._refresh()
+        found = []
+        archived_seqs = set()
+        for idempotency_key in idempotency_keys:
+            entry = self.store.find_by_idempotency(idempotency_key)
+            if entry is None:
+                continue
+            log = self.logs.get(entry["seq"])
+            if log is not None:
+                found.append(log)
+            else:
+                archived_seqs.add(entry["seq"])
+        if archived_seqs:
+            for seq, log in self.store.iter_archive(min(archived_seqs) - 1):
+                if seq in archived_seqs:
+                    found.append(log)
+        return found
+
+    def find_archived(self, idempotency_key):
+        self._refresh()
+        entry = self.store.find_by_idempotency(idempotency_key)
+        if entry is None or entry["seq"] in self.logs:
+            return None
+        return self.store.find_archived(entry["seq"])
+
+    def update(self, changes):
+        if not changes:
+            return
+        self._refresh()
+        for seq, fields in changes.items():
+            # Replace rather than mutate so entries already handed to readers
+            # stay consistent.
+            self.logs[seq] = {**self.logs[seq], **fields}
+            self.dirty.setdefault(seq, {}).update(fields)
+            self._track(seq, self.logs[seq])
+        if not self.write_behind:
+            self.flush()
+
+    def flush(self):
+        if not self.dirty:
+            return
+        stale = self.store.generation() != self._generation
+        dirty, self.dirty = self.dirty, {}
+        self.store.update(dirty)
+        if not stale:
+            self._generation = self.store.generation()
+
+    def save_index(self):
+        self.store.save_index()
+
+
+def open_store(
+    engine,
+    data_dir,
+    logs_path,
+    segment_max_entries=10000,
+    fsync=False,
+    index_snapshot=False,
+    snapshot_every=1000,
+):
+    snapshot_path = None
+    if index_snapshot:
+        snapshot_path = os.path.join(data_dir, "idempotency.idx.json")
+    if engine == "json":
+        store = JsonFileStore(logs_path, snapshot_path, snapshot_every)
+    elif engine == "segments":
+        store = SegmentStore(
+            os.path.join(data_dir, "store"),
+            legacy_path=logs_path,
+            segment_max_entries=segment_max_entries,
+            fsync=fsync,
+            snapshot_path=snapshot_path,
+            snapshot_every=snapshot_every,
+        )
+    else:
+        raise ValueError(f"Unknown storage engine: {engine}")
+    store.open()
+    return store
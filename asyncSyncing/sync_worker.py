@@ -0,0 +1,106 @@
+import time
+from collections import deque
+from datetime import datetime, timezone
+from threading import Event, Lock, Thread
+
+
+class SyncWorker:
+    """Background thread that keeps pushing batches until the queue is empty.
+
+    ``push`` is called with no arguments and returns ``(body, status_code)``
+    in the same shape as ``POST /sync/central``. ``pending`` returns the
+    current unsynced queue depth.
+    """
+
+    def __init__(self, push, pending, idle_interval=30.0, min_backoff=1.0, max_backoff=60.0):
+        self.push = push
+        self.pending = pending
+        self.idle_interval = idle_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._wake = Event()
+        self._stop = Event()
+        self._lock = Lock()
+        self._thread = None
+        self._drained = deque()
+        self.backoff = 0.0
+        self.last_success_at = None
+        self.last_error = None
+        self.last_error_at = None
+        self.total_synced = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = Thread(target=self._run, name="sync-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def notify(self):
+        self._wake.set()
+
+    def _record_drain(self, count):
+        now = time.monotonic()
+        with self._lock:
+            self._drained.append((now, count))
+            while self._drained and now - self._drained[0][0] > 60:
+                self._drained.popleft()
+
+    def drain_rate(self):
+        now = time.monotonic()
+        with self._lock:
+            recent = [(at, count) for at, count in self._drained if now - at <= 60]
+        if not recent:
+            return 0.0
+        span = max(now - recent[0][0], 1.0)
+        return sum(count for _, count in recent) / span
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                body, status = self.push()
+            except Exception as exc:  # keep the worker alive on unexpected errors
+                body, status = {"error": str(exc)}, 500
+
+            if status != 200:
+                self.last_error = body.get("error", f"status {status}")
+                self.last_error_at = datetime.now(timezone.utc).isoformat()
+                self.backoff = min(
+                    self.max_backoff, max(self.min_backoff, self.backoff * 2)
+                )
+                self._wake.clear()
+                self._stop.wait(self.backoff)
+                continue
+
+            drained = body.get("synced", 0) + body.get("duplicates", 0)
+            if drained:
+                self.total_synced += drained
+                self.last_success_at = datetime.now(timezone.utc).isoformat()
+                self._record_drain(drained)
+            if body.get("pushed", 0) == 0 and body.get("deferred"):
+                # Everything left is waiting out a retry backoff (the push
+                # before failed, so backoff is kept); retry when the first
+                # one is due rather than after the idle interval.
+                self._wake.wait(min(max(body.get("retry_in", 0), 0.01), self.idle_interval))
+                self._wake.clear()
+                continue
+            self.backoff = 0.0
+            if body.get("pushed", 0) == 0:
+                # Nothing pushable is left; sleep until new logs arrive.
+                self._wake.wait(self.idle_interval)
+                self._wake.clear()
+
+    def status(self):
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "queue_depth": self.pending(),
+            "last_success_at": self.last_success_at,
+            "last_error": self.last_error,
+            "last_error_at": self.last_error_at,
+            "backoff_seconds": self.backoff,
+            "drain_rate_per_second": round(self.drain_rate(), 2),
+            "total_synced": self.total_synced,
+        }
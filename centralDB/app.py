@@ -1,17 +1,70 @@
+import atexit
+import heapq
+import itertools
 import json
 import os
+import time
+import zlib
 from datetime import datetime, timezone
-from threading import Lock
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, stream_with_context
+
+from group_commit import GroupCommitter
+from metrics import BYTE_BUCKETS, SIZE_BUCKETS, Registry, TimedLock
+from storage import (
+    FILTER_FIELDS,
+    TIME_FIELDS,
+    merge_summaries,
+    open_shards,
+    parse_timestamp,
+)
 
 
 app = Flask(__name__)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, "data")
-LOGS_PATH = os.path.join(DATA_DIR, "logs.json")
-LOCK = Lock()
+DATA_DIR = os.environ.get("DATA_DIR", os.path.join(BASE_DIR, "data"))
+STORAGE_ENGINE = os.environ.get("STORAGE_ENGINE", "json")
+SHARD_BY_TENANT = os.environ.get("SHARD_BY_TENANT", "false").lower() == "true"
+IDEMPOTENCY_SNAPSHOT = os.environ.get("IDEMPOTENCY_SNAPSHOT", "false").lower() == "true"
+IDEMPOTENCY_SNAPSHOT_EVERY = int(os.environ.get("IDEMPOTENCY_SNAPSHOT_EVERY", "1000"))
+MAX_BATCH_BYTES = int(os.environ.get("MAX_BATCH_BYTES", str(64 * 1024 * 1024)))
+STORE_FSYNC = os.environ.get("STORE_FSYNC", "false").lower() == "true"
+GROUP_COMMIT = os.environ.get("GROUP_COMMIT", "false").lower() == "true"
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get("GROUP_COMMIT_WINDOW_MS", "2"))
+GROUP_COMMIT_MAX_ENTRIES = int(os.environ.get("GROUP_COMMIT_MAX_ENTRIES", "256"))
+CHANGES_MAX_WAIT = float(os.environ.get("CHANGES_MAX_WAIT", "30"))
+MULTI_PROCESS = os.environ.get("MULTI_PROCESS", "false").lower() == "true"
+SHARDS = None
+COMMITTER = None
+
+METRICS = Registry()
+REQUEST_SECONDS = METRICS.histogram(
+    "http_request_duration_seconds", "Request latency by route.", labelnames=("method", "route")
+)
+REQUESTS = METRICS.counter(
+    "http_requests_total", "Requests by route and status.", ("method", "route", "status")
+)
+STORAGE_SECONDS = METRICS.histogram(
+    "central_storage_seconds", "Time spent in store operations.", labelnames=("operation",)
+)
+LOCK_WAIT_SECONDS = METRICS.histogram(
+    "central_lock_wait_seconds", "Time spent waiting to acquire a shard lock."
+)
+BATCH_ITEMS = METRICS.histogram(
+    "central_batch_items", "Entries per batch received.", SIZE_BUCKETS, ("endpoint",)
+)
+BATCH_BYTES = METRICS.histogram(
+    "central_batch_bytes", "Bytes per batch body received.", BYTE_BUCKETS, ("endpoint",)
+)
+INGEST_ITEMS = METRICS.counter(
+    "central_ingest_items_total", "Logs received, by outcome.", ("outcome",)
+)
+METRICS.gauge(
+    "central_change_seq",
+    "Highest change_seq with no write still in flight.",
+    lambda: _get_shards().sequence.stable(),
+)
 
 REQUIRED_FIELDS = [
     "log_id",
@@ -32,59 +85,278 @@ REQUIRED_FIELDS = [
     "retries",
 ]
 
-FILTER_FIELDS = {"tenant_id", "region_id", "operation_type", "synced"}
+# Type-checked fields; the rest of REQUIRED_FIELDS only have to be present.
+# Nodes validate the same way, so whatever a node accepts, central accepts.
+FIELD_TYPES = {
+    "retries": (int, "an integer"),
+    "idempotency_key": (str, "a string"),
+}
 
 
-def _utc_now():
-    return datetime.now(timezone.utc).isoformat()
+def _compile_schema():
+    # (field, expected type, error message) per type-checked field, built
+    # once so validation is a flat loop of isinstance checks.
+    return tuple(
+        (field, expected, f"Field {field} must be {name}")
+        for field, (expected, name) in FIELD_TYPES.items()
+    )
 
 
-def _ensure_data_file():
-    os.makedirs(DATA_DIR, exist_ok=True)
-    if not os.path.exists(LOGS_PATH):
-        with open(LOGS_PATH, "w", encoding="utf-8") as handle:
-            json.dump([], handle, ensure_ascii=False, indent=2)
+SCHEMA = _compile_schema()
+REQUIRED_FIELD_SET = frozenset(REQUIRED_FIELDS)
 
 
-def _load_logs():
-    _ensure_data_file()
-    with open(LOGS_PATH, "r", encoding="utf-8") as handle:
-        return json.load(handle)
+def _utc_now():
+    return datetime.now(timezone.utc).isoformat()
 
 
-def _save_logs(logs):
-    with open(LOGS_PATH, "w", encoding="utf-8") as handle:
-        json.dump(logs, handle, ensure_ascii=False, indent=2)
+def _get_shards():
+    global SHARDS
+    if SHARDS is None:
+        SHARDS = open_shards(
+            STORAGE_ENGINE,
+            DATA_DIR,
+            sharded=SHARD_BY_TENANT,
+            fsync=STORE_FSYNC,
+            index_snapshot=IDEMPOTENCY_SNAPSHOT,
+            snapshot_every=IDEMPOTENCY_SNAPSHOT_EVERY,
+            multi_process=MULTI_PROCESS,
+        )
+        atexit.register(SHARDS.checkpoint)
+    return SHARDS
+
+
+def _insert_logs(store, items):
+    # Caller holds the shard lock. Items are validated payloads. Keys are
+    # checked with one index lookup and set operations, new items share one
+    # received_at and are written with a single insert. Returns
+    # (stored, log_id) per item; log_id is the existing entry's for duplicates.
+    # New entries are numbered with change_seq for the change feed.
+    with STORAGE_SECONDS.time("find"):
+        stored = store.find_many([item["idempotency_key"] for item in items])
+    fresh = {item["idempotency_key"] for item in items}.difference(stored)
+    received_at = _utc_now()
+    new_entries = []
+    batch_keys = {}
+    outcomes = []
+    for item in items:
+        key = item["idempotency_key"]
+        if key in fresh:
+            # First occurrence of a new key; later copies are duplicates.
+            fresh.discard(key)
+            batch_keys[key] = item.get("log_id")
+            new_entries.append({**item, "received_at": received_at})
+            outcomes.append((True, item.get("log_id")))
+            continue
+        existing = stored.get(key)
+        outcomes.append((False, existing.get("log_id") if existing else batch_keys[key]))
+    if new_entries:
+        sequence = _get_shards().sequence
+        first = sequence.reserve(len(new_entries))
+        try:
+            for offset, entry in enumerate(new_entries):
+                entry["change_seq"] = first + offset
+            with STORAGE_SECONDS.time("insert"):
+                store.insert(new_entries)
+        finally:
+            sequence.commit(first)
+    return outcomes
+
+
+def _commit_group(items):
+    # Items are split by tenant shard; each shard is locked and written on
+    # its own, so other tenants' writes are not held up.
+    shards = _get_shards()
+    groups = {}
+    for position, item in enumerate(items):
+        groups.setdefault(shards.shard_name(item["tenant_id"]), []).append(position)
+    outcomes = [None] * len(items)
+    for positions in groups.values():
+        shard = shards.shard(items[positions[0]]["tenant_id"])
+        with TimedLock(shard.lock, LOCK_WAIT_SECONDS):
+            # Another process may have written to the shard since.
+            with STORAGE_SECONDS.time("refresh"):
+                shard.store.refresh()
+            results = _insert_logs(shard.store, [items[position] for position in positions])
+        for position, outcome in zip(positions, results):
+            outcomes[position] = outcome
+    accepted = sum(1 for stored, _ in outcomes if stored)
+    INGEST_ITEMS.inc("accepted", amount=accepted)
+    INGEST_ITEMS.inc("duplicate", amount=len(outcomes) - accepted)
+    return outcomes
+
+
+def _get_committer():
+    global COMMITTER
+    if COMMITTER is None:
+        COMMITTER = GroupCommitter(
+            _commit_group,
+            window=GROUP_COMMIT_WINDOW_MS / 1000,
+            max_entries=GROUP_COMMIT_MAX_ENTRIES,
+        )
+    return COMMITTER
 
 
 def _validate_payload(payload):
-    missing = [field for field in REQUIRED_FIELDS if field not in payload]
-    if missing:
+    if not REQUIRED_FIELD_SET.issubset(payload):
+        missing = [field for field in REQUIRED_FIELDS if field not in payload]
         return False, f"Missing fields: {', '.join(missing)}"
-    if not isinstance(payload.get("retries"), int):
-        return False, "Field retries must be an integer"
+    for field, expected, error in SCHEMA:
+        if not isinstance(payload[field], expected):
+            return False, error
     return True, ""
 
 
-def _find_by_idempotency(logs, idempotency_key):
-    for log in logs:
-        if log.get("idempotency_key") == idempotency_key:
-            return log
-    return None
-
-
-def _apply_filters(logs, args):
-    filtered = logs
-    for field in FILTER_FIELDS:
-        value = args.get(field)
-        if value is None:
+def _filters_from_args(args):
+    return {field: args[field] for field in FILTER_FIELDS if args.get(field) is not None}
+
+
+def _ranges_from_args(args):
+    # occurred_after/occurred_before and received_after/received_before, as
+    # ISO timestamps; *_after is inclusive and *_before exclusive.
+    ranges = {}
+    for field in TIME_FIELDS:
+        prefix = field[: -len("_at")]
+        bounds = []
+        for name in (f"{prefix}_after", f"{prefix}_before"):
+            value = args.get(name)
+            timestamp = parse_timestamp(value) if value else None
+            if value and timestamp is None:
+                raise ValueError(f"{name} must be an ISO 8601 timestamp")
+            bounds.append(timestamp)
+        if bounds != [None, None]:
+            ranges[field] = tuple(bounds)
+    return ranges
+
+
+def _page_args(args):
+    limit = args.get("limit")
+    cursor = args.get("cursor")
+    limit = int(limit) if limit else None
+    cursor = _decode_cursor(cursor) if cursor else None
+    if limit is not None and limit < 1:
+        raise ValueError("limit must be positive")
+    return limit, cursor
+
+
+def _encode_cursor(shard_name, seq):
+    # Unsharded cursors stay plain seqs; sharded ones name the shard too.
+    return f"{shard_name}:{seq}" if shard_name else str(seq)
+
+
+def _decode_cursor(cursor):
+    shard_name, _, seq = cursor.rpartition(":")
+    return shard_name, int(seq)
+
+
+def _query_rows(filters, cursor, limit, stream=False, ranges=None):
+    # Yields ((shard name, seq), log). Shards are read one after another in
+    # name order, from their last published state without taking the shard
+    # lock; a tenant_id filter reads only that tenant's shard.
+    shards = _get_shards()
+    shards.refresh()
+    if "tenant_id" in filters:
+        shard = shards.shard(filters["tenant_id"], create=False)
+        shard_list = [] if shard is None else [shard]
+    else:
+        shard_list = shards.all()
+    start_name, after = cursor if cursor is not None else (None, None)
+    remaining = limit
+    for shard in shard_list:
+        if start_name is not None and shard.name < start_name:
             continue
-        if field == "synced":
-            want_synced = value.lower() == "true"
-            filtered = [log for log in filtered if log.get("synced") is want_synced]
-        else:
-            filtered = [log for log in filtered if str(log.get(field)) == value]
-    return filtered
+        shard_after = after if shard.name == start_name else None
+        rows = shard.store.iter_query(
+            filters, after=shard_after, limit=remaining, stream=stream, ranges=ranges
+        )
+        for seq, log in rows:
+            yield (shard.name, seq), log
+            if remaining is not None:
+                remaining -= 1
+        if remaining == 0:
+            return
+
+
+def _read_changes(since, limit):
+    # Entries with since < change_seq <= the committed high-water mark, oldest
+    # first, merged across shards.
+    shards = _get_shards()
+    # The high-water mark is read before catching up: everything at or below
+    # it is committed, so the blocking refresh reads it all in. Skipping a
+    # shard another worker is writing could move next_since past its entries.
+    until = shards.sequence.stable()
+    if until <= since:
+        return []
+    shards.refresh(blocking=True)
+    with STORAGE_SECONDS.time("changes"):
+        per_shard = [shard.store.iter_changes(since, until, limit) for shard in shards.all()]
+        merged = heapq.merge(*per_shard, key=lambda row: row[0])
+        return [log for _, log in itertools.islice(merged, limit)]
+
+
+def _wants_ndjson():
+    best = request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"])
+    return best == "application/x-ndjson"
+
+
+def _ndjson_lines(rows, limit=None):
+    # A paged stream ends with a {"next_cursor": ...} record, as the JSON body
+    # would carry it; the rows themselves do not say where they are stored.
+    returned = 0
+    position = None
+    for position, log in rows:
+        returned += 1
+        yield json.dumps(log, ensure_ascii=False) + "\n"
+    if limit is not None:
+        cursor = _encode_cursor(*position) if returned == limit else None
+        yield json.dumps({"next_cursor": cursor}) + "\n"
+
+
+def _read_batch_payload():
+    # Batch bodies may be gzip-compressed and/or NDJSON (one item per line).
+    # Returns (payload, None) or (None, (error_body, status)).
+    body = request.get_data(cache=False)
+    BATCH_BYTES.observe(len(body), request.url_rule.rule)
+    encoding = request.headers.get("Content-Encoding", "identity").strip().lower()
+    if encoding == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(body, MAX_BATCH_BYTES)
+        except zlib.error:
+            return None, ({"error": "Invalid gzip body"}, 400)
+        if decompressor.unconsumed_tail:
+            return None, ({"error": "Batch body too large"}, 413)
+    elif encoding != "identity":
+        return None, ({"error": f"Unsupported Content-Encoding: {encoding}"}, 415)
+
+    try:
+        if request.mimetype == "application/x-ndjson":
+            lines = body.decode("utf-8").splitlines()
+            return [json.loads(line) for line in lines if line.strip()], None
+        if request.is_json:
+            return json.loads(body), None
+    except (UnicodeDecodeError, ValueError):
+        pass
+    return None, ({"error": "Invalid JSON body"}, 400)
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    # Streamed responses are timed up to the first byte.
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, request.method, route)
+    REQUESTS.inc(request.method, route, response.status_code)
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(METRICS.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @app.route("/health", methods=["GET"])
@@ -92,94 +364,82 @@ def health():
     return jsonify({"status": "ok"})
 
 
+@app.route("/central/capabilities", methods=["GET"])
+def central_capabilities():
+    return jsonify(
+        {
+            "content_types": ["application/json", "application/x-ndjson"],
+            "content_encodings": ["gzip"],
+        }
+    )
+
+
 @app.route("/central/logs", methods=["POST"])
 def ingest_log():
     payload = request.get_json(silent=True)
     if payload is None:
+        INGEST_ITEMS.inc("error")
         return jsonify({"error": "Invalid JSON body"}), 400
 
     is_valid, error = _validate_payload(payload)
     if not is_valid:
+        INGEST_ITEMS.inc("error")
         return jsonify({"error": error}), 400
 
-    with LOCK:
-        logs = _load_logs()
-        existing = _find_by_idempotency(logs, payload["idempotency_key"])
-        if existing is not None:
-            return (
-                jsonify(
-                    {
-                        "error": "Duplicate idempotency_key",
-                        "existing_log_id": existing.get("log_id"),
-                    }
-                ),
-                409,
-            )
-
-        log_entry = dict(payload)
-        log_entry["received_at"] = _utc_now()
-        logs.append(log_entry)
-        _save_logs(logs)
-
-    return jsonify({"status": "stored", "log_id": log_entry["log_id"]}), 201
+    if GROUP_COMMIT:
+        stored, log_id = _get_committer().submit(payload).result()
+    else:
+        stored, log_id = _commit_group([payload])[0]
+    if not stored:
+        return jsonify({"error": "Duplicate idempotency_key", "existing_log_id": log_id}), 409
+    return jsonify({"status": "stored", "log_id": log_id}), 201
 
 
 @app.route("/central/logs/batch", methods=["POST"])
 def ingest_batch():
-    payload = request.get_json(silent=True)
-    if payload is None:
-        return jsonify({"error": "Invalid JSON body"}), 400
+    payload, error = _read_batch_payload()
+    if error is not None:
+        return jsonify(error[0]), error[1]
     if not isinstance(payload, list):
         return jsonify({"error": "Expected a JSON array"}), 400
 
-    results = []
+    # Validation runs before taking the lock; only the duplicate check and
+    # the single insert are serialized.
+    BATCH_ITEMS.observe(len(payload), "/central/logs/batch")
+    results = [None] * len(payload)
+    valid = []
+    for index, item in enumerate(payload):
+        if not isinstance(item, dict):
+            results[index] = {"index": index, "status": "error", "error": "Item must be object"}
+            continue
+        is_valid, error = _validate_payload(item)
+        if not is_valid:
+            results[index] = {"index": index, "status": "error", "error": error}
+            continue
+        valid.append((index, item))
+    errors = len(payload) - len(valid)
+    INGEST_ITEMS.inc("error", amount=errors)
+
+    outcomes = _commit_group([item for _, item in valid])
+
     accepted = 0
-    duplicates = 0
-    errors = 0
-
-    with LOCK:
-        logs = _load_logs()
-        for index, item in enumerate(payload):
-            if not isinstance(item, dict):
-                results.append(
-                    {"index": index, "status": "error", "error": "Item must be object"}
-                )
-                errors += 1
-                continue
-
-            is_valid, error = _validate_payload(item)
-            if not is_valid:
-                results.append({"index": index, "status": "error", "error": error})
-                errors += 1
-                continue
-
-            existing = _find_by_idempotency(logs, item["idempotency_key"])
-            if existing is not None:
-                results.append(
-                    {
-                        "index": index,
-                        "status": "duplicate",
-                        "existing_log_id": existing.get("log_id"),
-                        "idempotency_key": item["idempotency_key"],
-                    }
-                )
-                duplicates += 1
-                continue
-
-            log_entry = dict(item)
-            log_entry["received_at"] = _utc_now()
-            logs.append(log_entry)
-            results.append(
-                {
-                    "index": index,
-                    "status": "accepted",
-                    "log_id": log_entry.get("log_id"),
-                    "idempotency_key": log_entry.get("idempotency_key"),
-                }
-            )
+    for (index, item), (stored, log_id) in zip(valid, outcomes):
+        if stored:
+            results[index] = {
+                "index": index,
+                "status": "accepted",
+                "log_id": log_id,
+                "idempotency_key": item["idempotency_key"],
+            }
             accepted += 1
-
-        _save_logs(logs)
+        else:
+            results[index] = {
+                "index": index,
+                "status": "duplicate",
+                "existing_log_id": log_id,
+                "idempotency_key": item["idempotency_key"],
+            }
+    duplicates = len(valid) - accepted
 
     return jsonify(
         {
@@ -193,28 +453,62 @@ def ingest_batch():
 
 @app.route("/central/logs", methods=["GET"])
 def list_logs():
-    with LOCK:
-        logs = _load_logs()
-    filtered = _apply_filters(logs, request.args)
-    return jsonify({"count": len(filtered), "logs": filtered})
+    filters = _filters_from_args(request.args)
+    try:
+        limit, cursor = _page_args(request.args)
+    except ValueError:
+        return jsonify({"error": "limit and cursor must be positive integers"}), 400
+    try:
+        ranges = _ranges_from_args(request.args)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    if _wants_ndjson():
+        rows = _query_rows(filters, cursor, limit, stream=True, ranges=ranges)
+        return Response(
+            stream_with_context(_ndjson_lines(rows, limit)), mimetype="application/x-ndjson"
+        )
+
+    with STORAGE_SECONDS.time("query"):
+        rows = list(_query_rows(filters, cursor, limit, ranges=ranges))
+    filtered = [log for _, log in rows]
+    body = {"count": len(filtered), "logs": filtered}
+    if limit is not None:
+        body["next_cursor"] = _encode_cursor(*rows[-1][0]) if len(rows) == limit else None
+    return jsonify(body)
+
+
+@app.route("/central/changes", methods=["GET"])
+def list_changes():
+    try:
+        since = int(request.args.get("since", "0"))
+        limit = int(request.args.get("limit", "100"))
+        wait = float(request.args.get("wait", "0"))
+    except ValueError:
+        return jsonify({"error": "since, limit and wait must be numbers"}), 400
+    if since < 0 or limit < 1 or wait < 0:
+        error = "since and wait must not be negative, limit must be positive"
+        return jsonify({"error": error}), 400
+
+    changes = _read_changes(since, limit)
+    if not changes and wait > 0:
+        # Long poll: park until a newer entry is committed or the wait ends.
+        if _get_shards().sequence.wait(since, min(wait, CHANGES_MAX_WAIT)):
+            changes = _read_changes(since, limit)
+    next_since = changes[-1]["change_seq"] if changes else since
+    return jsonify({"count": len(changes), "changes": changes, "next_since": next_since})
 
 
 @app.route("/central/reports/summary", methods=["GET"])
 def summary():
-    with LOCK:
-        logs = _load_logs()
-
-    by_operation = {}
-    by_tenant = {}
-    for log in logs:
-        operation_type = log.get("operation_type")
-        tenant_id = log.get("tenant_id")
-        by_operation[operation_type] = by_operation.get(operation_type, 0) + 1
-        by_tenant[tenant_id] = by_tenant.get(tenant_id, 0) + 1
-
-    return jsonify({"count": len(logs), "by_operation_type": by_operation, "by_tenant_id": by_tenant})
+    shards = _get_shards()
+    shards.refresh()
+    with STORAGE_SECONDS.time("summary"):
+        reports = [shard.store.summary() for shard in shards.all()]
+    return jsonify(merge_summaries(reports))
 
 
 if __name__ == "__main__":
-    _ensure_data_file()
-    app.run(host="0.0.0.0", port=5001)
+    _get_shards()
+    port = int(os.environ.get("PORT", "5001"))
+    app.run(host="0.0.0.0", port=port)
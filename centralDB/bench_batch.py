@@ -0,0 +1,90 @@
+"""Items/second through POST /central/logs/batch at several batch sizes.
+
+Runs in-process against a throwaway data directory, so no server is needed:
+
+    python bench_batch.py            # json engine
+    STORAGE_ENGINE=sqlite python bench_batch.py
+"""
+
+import atexit
+import json
+import shutil
+import sys
+import tempfile
+import time
+
+import app
+
+
+BATCH_SIZES = (50, 500, 5000)
+ROUNDS = 5
+
+
+def make_payload(suffix):
+    return {
+        "log_id": f"bench-log-{suffix}",
+        "op_id": f"bench-op-{suffix}",
+        "idempotency_key": f"bench-idem-{suffix}",
+        "source_node_id": "node-1",
+        "target_scope": "central",
+        "operation_type": "record_transaction",
+        "operation_body": {"amount": 1},
+        "occurred_at": "2026-02-03T10:00:00Z",
+        "recorded_at": "2026-02-03T10:00:00Z",
+        "actor_type": "system",
+        "actor_id": "bench",
+        "tenant_id": "municipality-1",
+        "location_id": "location-1",
+        "region_id": "region-1",
+        "facility_id": "facility-1",
+        "retries": 0,
+    }
+
+
+def post_batch(client, items):
+    started = time.perf_counter()
+    response = client.post(
+        "/central/logs/batch",
+        data=json.dumps(items),
+        headers={"Content-Type": "application/json"},
+    )
+    elapsed = time.perf_counter() - started
+    if response.status_code != 200:
+        raise RuntimeError(f"batch failed with status {response.status_code}")
+    return elapsed, response.get_json()
+
+
+def run(batch_size, client, counter):
+    fresh_times = []
+    duplicate_times = []
+    for _ in range(ROUNDS):
+        items = [make_payload(next(counter)) for _ in range(batch_size)]
+        elapsed, body = post_batch(client, items)
+        assert body["accepted"] == batch_size, body
+        fresh_times.append(elapsed)
+        # Same batch again: every item is answered from the index.
+        elapsed, body = post_batch(client, items)
+        assert body["duplicates"] == batch_size, body
+        duplicate_times.append(elapsed)
+    return batch_size / min(fresh_times), batch_size / min(duplicate_times)
+
+
+def main():
+    data_dir = tempfile.mkdtemp(prefix="central-bench-")
+    app.DATA_DIR = data_dir
+    counter = iter(range(sys.maxsize))
+    client = app.app.test_client()
+    try:
+        print(f"engine={app.STORAGE_ENGINE} rounds={ROUNDS} (best round shown)")
+        print(f"{'batch':>6}  {'accepted items/s':>17}  {'duplicate items/s':>18}")
+        for batch_size in BATCH_SIZES:
+            accepted_rate, duplicate_rate = run(batch_size, client, counter)
+            print(f"{batch_size:>6}  {accepted_rate:>17,.0f}  {duplicate_rate:>18,.0f}")
+    finally:
+        if app.SHARDS is not None:
+            atexit.unregister(app.SHARDS.checkpoint)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""Throughput of central's data-path helpers at growing store sizes.
+
+Runs in-process against throwaway data directories, so no server is needed.
+For every size the store is filled with synthetic logs through the ingest
+path (not timed), then each helper is timed on a fixed amount of work
+against it:
+
+    python bench_data_path.py                      # 1k, 10k, 100k and 1M logs
+    python bench_data_path.py --sizes 1000,10000 --engines sqlite
+    SHARD_BY_TENANT=true python bench_data_path.py
+    python bench_data_path.py --json               # for run_microbench.py
+
+The best of ``--repeat`` rounds is reported.
+"""
+
+import argparse
+import atexit
+import json
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import app
+from storage import merge_summaries
+
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+FILL_CHUNK = 10000
+TENANTS = [f"municipality-{index}" for index in range(10)]
+REGIONS = [f"region-{index}" for index in range(5)]
+OPERATION_TYPES = ["record_transaction", "dispatch_unit", "close_incident", "update_inventory"]
+
+
+def make_payload(index):
+    return {
+        "log_id": f"bench-log-{index}",
+        "op_id": f"bench-op-{index}",
+        "idempotency_key": f"bench-idem-{index}",
+        "source_node_id": f"node-{index % 3}",
+        "target_scope": "central",
+        "operation_type": OPERATION_TYPES[index % len(OPERATION_TYPES)],
+        "operation_body": {"amount": index % 100},
+        "occurred_at": f"2026-02-{1 + index % 28:02d}T10:00:00Z",
+        "recorded_at": "2026-02-03T10:00:00Z",
+        "actor_type": "system",
+        "actor_id": "bench",
+        "tenant_id": TENANTS[index % len(TENANTS)],
+        "location_id": "location-1",
+        "region_id": REGIONS[index % len(REGIONS)],
+        "facility_id": f"facility-{index % 20}",
+        "retries": 0,
+    }
+
+
+def reopen_shards():
+    # A fresh set of shards over the same data, as a restart opens them.
+    if app.SHARDS is not None:
+        atexit.unregister(app.SHARDS.checkpoint)
+        for shard in app.SHARDS.all():
+            shard.store.close()
+    app.SHARDS = None
+    return app._get_shards()
+
+
+def fill(size):
+    for start in range(0, size, FILL_CHUNK):
+        stop = min(start + FILL_CHUNK, size)
+        app._commit_group([make_payload(index) for index in range(start, stop)])
+
+
+def lookups(size):
+    # 100 chunks of 100 keys, each from one tenant (and so one shard). Keys
+    # run up to twice the store size, so about half of them are stored.
+    rng = random.Random(0)
+    chunks = []
+    for chunk in range(100):
+        tenant = chunk % len(TENANTS)
+        indexes = [
+            rng.randrange(size * 2 // len(TENANTS)) * len(TENANTS) + tenant for _ in range(100)
+        ]
+        chunks.append((TENANTS[tenant], [f"bench-idem-{index}" for index in indexes]))
+    return chunks
+
+
+def bench_load_cold(context):
+    reopen_shards()
+    return context["size"]
+
+
+def bench_validate_payload(context):
+    payloads = context["payloads"]
+    for payload in payloads:
+        app._validate_payload(payload)
+    return len(payloads)
+
+
+def bench_find_many(context):
+    # The duplicate check: 100 lookups of 100 keys of one tenant, about half
+    # of them stored.
+    shards = app._get_shards()
+    for tenant_id, keys in context["lookups"]:
+        shards.shard(tenant_id).store.find_many(keys)
+    return sum(len(keys) for _, keys in context["lookups"])
+
+
+def bench_query_page(context):
+    # First page of 100 under each filter combination the list endpoint sees.
+    filters = context["filters"]
+    for index in range(200):
+        list(app._query_rows(filters[index % len(filters)], None, 100))
+    return 200
+
+
+def bench_query_all(context):
+    # Every log of one region, the unpaged list.
+    rows = 0
+    for region in REGIONS[:2]:
+        rows += sum(1 for _ in app._query_rows({"region_id": region}, None, None))
+    return rows
+
+
+def bench_summary(context):
+    shards = app._get_shards()
+    for _ in range(1000):
+        merge_summaries([shard.store.summary() for shard in shards.all()])
+    return 1000
+
+
+def bench_changes(context):
+    rng = random.Random(0)
+    for _ in range(500):
+        app._read_changes(rng.randrange(context["size"]), 100)
+    return 500
+
+
+def bench_insert(context):
+    # 1000 new logs, 100 per call, through the duplicate check and insert.
+    first = context["next_index"]
+    context["next_index"] += 1000
+    payloads = [make_payload(index) for index in range(first, first + 1000)]
+    for start in range(0, len(payloads), 100):
+        app._commit_group(payloads[start : start + 100])
+    return len(payloads)
+
+
+BENCHMARKS = (
+    ("load_cold", bench_load_cold),
+    ("validate_payload", bench_validate_payload),
+    ("find_many", bench_find_many),
+    ("query_page", bench_query_page),
+    ("query_all", bench_query_all),
+    ("summary", bench_summary),
+    ("changes", bench_changes),
+    ("insert", bench_insert),
+)
+
+
+def run(engine, size, repeat):
+    data_dir = tempfile.mkdtemp(prefix="central-bench-")
+    app.DATA_DIR = data_dir
+    app.STORAGE_ENGINE = engine
+    try:
+        reopen_shards()
+        fill(size)
+        context = {
+            "size": size,
+            "next_index": size,
+            "lookups": lookups(size),
+            "payloads": [make_payload(index) for index in range(min(size, 10000))],
+            "filters": [
+                {},
+                {"tenant_id": TENANTS[1]},
+                {"region_id": REGIONS[2]},
+                {"operation_type": OPERATION_TYPES[3]},
+                {"tenant_id": TENANTS[4], "facility_id": "facility-4"},
+            ],
+        }
+        results = []
+        for name, benchmark in BENCHMARKS:
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                ops = benchmark(context)
+                elapsed = time.perf_counter() - started
+                if best is None or ops / elapsed > best["ops_per_second"]:
+                    best = {"ops": ops, "seconds": elapsed, "ops_per_second": ops / elapsed}
+            results.append(
+                {"service": "central", "engine": engine, "size": size, "benchmark": name, **best}
+            )
+        return results
+    finally:
+        if app.SHARDS is not None:
+            atexit.unregister(app.SHARDS.checkpoint)
+            for shard in app.SHARDS.all():
+                shard.store.close()
+            app.SHARDS = None
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)))
+    parser.add_argument("--engines", default="json,sqlite")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for engine in args.engines.split(","):
+        for size in map(int, args.sizes.split(",")):
+            rows = run(engine, size, args.repeat)
+            results.extend(rows)
+            if not args.json:
+                for row in rows:
+                    print(
+                        f"{engine:>9} {size:>8} {row['benchmark']:>20} "
+                        f"{row['ops_per_second']:>14,.0f} ops/s",
+                        flush=True,
+                    )
+    if args.json:
+        json.dump(results, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
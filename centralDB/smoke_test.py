@@ -1,11 +1,25 @@
+import gzip
 import json
 import sys
+import uuid
 from datetime import datetime, timezone
 
 import requests
 
 
 BASE_URL = "http://localhost:5001"
+# New keys on every run, so the checks below also pass against a data
+# directory that earlier runs have filled.
+RUN_ID = uuid.uuid4().hex[:8]
+
+
+class SmokeFailure(Exception):
+    pass
+
+
+def expect(condition, message):
+    if not condition:
+        raise SmokeFailure(message)
 
 
 def utc_now():
@@ -35,6 +49,162 @@ def make_payload(suffix):
     }
 
 
+def to_ndjson(items):
+    return "".join(json.dumps(item) + "\n" for item in items).encode("utf-8")
+
+
+def post_batch(data, headers):
+    return requests.post(
+        f"{BASE_URL}/central/logs/batch", data=data, headers=headers, timeout=5
+    )
+
+
+def check_batch_formats():
+    tenant = f"smoke-{RUN_ID}"
+    items = [make_payload(f"{RUN_ID}-fmt-{index}") for index in range(6)]
+    for item in items:
+        item["tenant_id"] = tenant
+
+    plain = post_batch(json.dumps(items[:2]), {"Content-Type": "application/json"})
+    plain.raise_for_status()
+    expect(plain.json()["accepted"] == 2, f"JSON batch: {plain.json()}")
+
+    ndjson = post_batch(to_ndjson(items[2:4]), {"Content-Type": "application/x-ndjson"})
+    ndjson.raise_for_status()
+    expect(ndjson.json()["accepted"] == 2, f"NDJSON batch: {ndjson.json()}")
+
+    gzipped = post_batch(
+        gzip.compress(to_ndjson(items[4:])),
+        {"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"},
+    )
+    gzipped.raise_for_status()
+    expect(gzipped.json()["accepted"] == 2, f"gzip NDJSON batch: {gzipped.json()}")
+
+    again = post_batch(json.dumps(items), {"Content-Type": "application/json"})
+    again.raise_for_status()
+    expect(again.json()["duplicates"] == 6, f"Repeated batch: {again.json()}")
+
+    invalid = dict(make_payload(f"{RUN_ID}-invalid"), retries="many")
+    mixed = post_batch(json.dumps([invalid, "not an object"]), {"Content-Type": "application/json"})
+    mixed.raise_for_status()
+    statuses = [result["status"] for result in mixed.json()["results"]]
+    expect(statuses == ["error", "error"], f"Invalid items: {mixed.json()}")
+
+    rejected = [
+        ("bad gzip", b"not gzip", {"Content-Type": "application/json", "Content-Encoding": "gzip"}),
+        ("bad JSON", b"[{", {"Content-Type": "application/json"}),
+        ("non-array", b"{}", {"Content-Type": "application/json"}),
+    ]
+    for name, data, headers in rejected:
+        response = post_batch(data, headers)
+        expect(response.status_code == 400, f"{name}: {response.status_code}")
+    unsupported = post_batch(b"[]", {"Content-Type": "application/json", "Content-Encoding": "br"})
+    expect(unsupported.status_code == 415, f"Unknown encoding: {unsupported.status_code}")
+    return tenant, [item["idempotency_key"] for item in items]
+
+
+def check_paging(tenant, keys):
+    seen = []
+    cursor = None
+    for _ in range(len(keys) + 1):
+        params = {"tenant_id": tenant, "limit": 4}
+        if cursor is not None:
+            params["cursor"] = cursor
+        page = requests.get(f"{BASE_URL}/central/logs", params=params, timeout=5)
+        page.raise_for_status()
+        seen.extend(log["idempotency_key"] for log in page.json()["logs"])
+        cursor = page.json()["next_cursor"]
+        if cursor is None:
+            break
+    expect(seen == keys, f"Paged keys: {seen}")
+
+    streamed = requests.get(
+        f"{BASE_URL}/central/logs",
+        params={"tenant_id": tenant, "limit": 4},
+        headers={"Accept": "application/x-ndjson"},
+        timeout=5,
+    )
+    streamed.raise_for_status()
+    lines = [json.loads(line) for line in streamed.text.splitlines()]
+    expect(len(lines) == 5, f"NDJSON page has {len(lines)} lines")
+    expect(lines[-1].get("next_cursor") is not None, f"NDJSON trailer: {lines[-1]}")
+    rest = requests.get(
+        f"{BASE_URL}/central/logs",
+        params={"tenant_id": tenant, "limit": 4, "cursor": lines[-1]["next_cursor"]},
+        headers={"Accept": "application/x-ndjson"},
+        timeout=5,
+    )
+    rest.raise_for_status()
+    lines = [json.loads(line) for line in rest.text.splitlines()]
+    expect(lines[-1] == {"next_cursor": None}, f"Last NDJSON trailer: {lines[-1]}")
+    expect(len(lines) == 3, f"Last NDJSON page has {len(lines)} lines")
+
+    in_range = requests.get(
+        f"{BASE_URL}/central/logs",
+        params={"tenant_id": tenant, "occurred_after": "2000-01-01T00:00:00Z"},
+        timeout=5,
+    )
+    in_range.raise_for_status()
+    expect(in_range.json()["count"] == len(keys), f"Time range: {in_range.json()['count']}")
+
+    for params in ({"limit": "0"}, {"occurred_after": "yesterday"}):
+        response = requests.get(f"{BASE_URL}/central/logs", params=params, timeout=5)
+        expect(response.status_code == 400, f"{params}: {response.status_code}")
+
+
+def check_change_feed():
+    # Skip to the end of the feed, then store one entry and read it back.
+    since = 0
+    while True:
+        page = requests.get(
+            f"{BASE_URL}/central/changes", params={"since": since, "limit": 1000}, timeout=10
+        )
+        page.raise_for_status()
+        if page.json()["count"] == 0:
+            break
+        since = page.json()["next_since"]
+
+    idle = requests.get(
+        f"{BASE_URL}/central/changes", params={"since": since, "wait": 0.2}, timeout=5
+    )
+    idle.raise_for_status()
+    expect(idle.json()["count"] == 0, f"Idle feed: {idle.json()}")
+    expect(idle.json()["next_since"] == since, f"Idle next_since: {idle.json()}")
+
+    created = requests.post(
+        f"{BASE_URL}/central/logs", json=make_payload(f"{RUN_ID}-feed"), timeout=5
+    )
+    created.raise_for_status()
+    feed = requests.get(
+        f"{BASE_URL}/central/changes", params={"since": since, "wait": 5}, timeout=10
+    )
+    feed.raise_for_status()
+    keys = [change["idempotency_key"] for change in feed.json()["changes"]]
+    expect(f"central-idem-{RUN_ID}-feed" in keys, f"Change feed: {keys}")
+    expect(feed.json()["next_since"] > since, f"Feed next_since: {feed.json()['next_since']}")
+
+    for params in ({"since": "-1"}, {"limit": "0"}, {"wait": "soon"}):
+        response = requests.get(f"{BASE_URL}/central/changes", params=params, timeout=5)
+        expect(response.status_code == 400, f"{params}: {response.status_code}")
+
+
+def check_summary_groups():
+    # Group values that are not strings (here a dict, which is unhashable)
+    # are counted under their JSON text.
+    facility = {"site": RUN_ID}
+    created = requests.post(
+        f"{BASE_URL}/central/logs",
+        json=dict(make_payload(f"{RUN_ID}-group"), facility_id=facility),
+        timeout=5,
+    )
+    created.raise_for_status()
+    summary = requests.get(f"{BASE_URL}/central/reports/summary", timeout=5)
+    summary.raise_for_status()
+    groups = summary.json()["by_facility_id"]
+    key = json.dumps(facility, ensure_ascii=False)
+    expect(groups.get(key) == 1, f"Summary group {key}: {groups.get(key)}")
+
+
 def main():
     health = requests.get(f"{BASE_URL}/health", timeout=5)
     health.raise_for_status()
@@ -57,6 +227,11 @@ def main():
     )
     batch.raise_for_status()
 
+    tenant, keys = check_batch_formats()
+    check_paging(tenant, keys)
+    check_change_feed()
+    check_summary_groups()
+
     logs = requests.get(
         f"{BASE_URL}/central/logs?tenant_id=municipality-1", timeout=5
     )
@@ -73,6 +248,6 @@ def main():
 if __name__ == "__main__":
     try:
         main()
-    except requests.RequestException as exc:
+    except (requests.RequestException, SmokeFailure) as exc:
         print(f"Smoke test failed: {exc}")
         sys.exit(1)
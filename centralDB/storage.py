@@ -0,0 +1,1187 @@
+import bisect
+import hashlib
+import heapq
+import json
+import math
+import os
+import re
+import shutil
+import sqlite3
+import textwrap
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from threading import Condition, Lock, local
+
+from process_lock import ProcessLock
+
+
+FILTER_FIELDS = {"tenant_id", "region_id", "operation_type", "facility_id", "synced"}
+INDEXED_FIELDS = ("tenant_id", "region_id", "operation_type", "facility_id")
+TIME_FIELDS = ("occurred_at", "received_at")
+TIME_COLUMNS = {"occurred_at": "occurred_ts", "received_at": "received_ts"}
+
+
+def parse_timestamp(value):
+    """ISO 8601 string -> POSIX seconds, or None. Naive times count as UTC."""
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def matches_filters(log, filters):
+    for field, value in filters.items():
+        if field == "synced":
+            if log.get("synced") is not (value.lower() == "true"):
+                return False
+        elif str(log.get(field)) != value:
+            return False
+    return True
+
+
+SUMMARY_FIELDS = ("operation_type", "tenant_id", "region_id", "facility_id", "source_node_id")
+
+
+def _group_key(value):
+    # JSON object keys must be strings; mixing None or numbers with strings
+    # would also break the sorted output of jsonify.
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+class SummaryCounters:
+    """Per-field group counts for the summary report, updated at ingest.
+
+    Groups are keyed by ``_group_key``, as in the report, so unhashable
+    values (a dict ``facility_id``, a list ``region_id``) count like any
+    other. Persisted as ``[field, key, count]`` triples; ``watermark`` is the
+    number of entries counted.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.count = 0
+        self.groups = {field: {} for field in SUMMARY_FIELDS}
+
+    def add(self, entries):
+        self.add_tally(self.tally(entries), len(entries))
+
+    @staticmethod
+    def tally(entries):
+        # Per-field group counts of ``entries``, without touching the totals.
+        tally = {field: {} for field in SUMMARY_FIELDS}
+        for entry in entries:
+            for field in SUMMARY_FIELDS:
+                counts = tally[field]
+                key = _group_key(entry.get(field))
+                counts[key] = counts.get(key, 0) + 1
+        return tally
+
+    def add_tally(self, tally, count):
+        for field, counts in tally.items():
+            groups = self.groups[field]
+            for key, group_count in counts.items():
+                groups[key] = groups.get(key, 0) + group_count
+        self.count += count
+
+    def report(self):
+        report = {"count": self.count}
+        for field in SUMMARY_FIELDS:
+            report[f"by_{field}"] = dict(self.groups[field])
+        return report
+
+    def load(self, max_watermark):
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, "r", encoding="utf-8") as handle:
+                snapshot = json.load(handle)
+        except (OSError, json.JSONDecodeError):
+            return False
+        if snapshot.get("watermark", 0) > max_watermark:
+            return False
+        self.count = snapshot["watermark"]
+        self.groups = {field: {} for field in SUMMARY_FIELDS}
+        for field, value, count in snapshot["groups"]:
+            if field in self.groups:
+                # Files written before keys were normalized hold raw values.
+                key = _group_key(value)
+                groups = self.groups[field]
+                groups[key] = groups.get(key, 0) + count
+        return True
+
+    def save(self):
+        if not self.path:
+            return
+        groups = [
+            [field, value, count]
+            for field in SUMMARY_FIELDS
+            for value, count in self.groups[field].items()
+        ]
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(
+                {"watermark": self.count, "groups": groups},
+                handle,
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+        os.replace(tmp_path, self.path)
+
+
+def merge_summaries(reports):
+    merged = {"count": 0}
+    merged.update({f"by_{field}": {} for field in SUMMARY_FIELDS})
+    for report in reports:
+        merged["count"] += report["count"]
+        for field in SUMMARY_FIELDS:
+            groups = merged[f"by_{field}"]
+            for value, count in report[f"by_{field}"].items():
+                groups[value] = groups.get(value, 0) + count
+    return merged
+
+
+def seqs_between(runs, start=None, end=None, count=None):
+    # Seqs of the (value, seq) pairs with start <= value < end, from each
+    # sorted run of a TimeIndex, in no particular order. Pairs with
+    # seq >= count were added after the caller's snapshot and are skipped.
+    seqs = []
+    for entries in runs:
+        low = 0 if start is None else bisect.bisect_left(entries, (start, -1))
+        high = len(entries) if end is None else bisect.bisect_left(entries, (end, -1))
+        seqs.extend(seq for _, seq in entries[low:high] if count is None or seq < count)
+    return seqs
+
+
+def _iter_from(entries, start):
+    # Pairs of one sorted run from the first one >= start, without copying
+    # the tail.
+    for position in range(bisect.bisect_left(entries, start), len(entries)):
+        yield entries[position]
+
+
+class TimeIndex:
+    """Sorted ``(timestamp, seq)`` pairs for one ISO timestamp field.
+
+    Timestamps are parsed once when an entry is added; a range lookup is two
+    bisections plus the matching slice. Entries whose value does not parse
+    are left out and never match a range.
+
+    Pairs that sort after the last one in ``entries`` are appended in place,
+    which readers of an older snapshot cannot see past their seq bound. Out
+    of order pairs (late ``occurred_at`` values from a node's backlog) go to
+    ``pending``, a small sorted run that is replaced rather than changed, and
+    are merged into a new ``entries`` list once it outgrows
+    ``pending_limit()``. A list a reader already holds is never reordered
+    under it, and an out of order insert costs the size of the side run
+    rather than of the whole index.
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self.entries = []
+        self.pending = []
+
+    def __len__(self):
+        return len(self.entries) + len(self.pending)
+
+    def value(self, log):
+        return parse_timestamp(log.get(self.field))
+
+    def runs(self):
+        return self.entries, self.pending
+
+    def last(self):
+        # Largest value in the index, or None when it is empty.
+        tails = [run[-1][0] for run in self.runs() if run]
+        return max(tails) if tails else None
+
+    def pending_limit(self):
+        # About sqrt(n * batch size) for batches of a few hundred, which
+        # balances copying the side run on every insert against merging it.
+        return max(1024, math.isqrt(len(self.entries)) * 16)
+
+    def add_many(self, first_seq, logs):
+        self.add_pairs(self.pairs(first_seq, logs))
+
+    def pairs(self, first_seq, logs):
+        # Sorted (value, seq) pairs of ``logs``, ready for ``add_pairs``.
+        added = []
+        for offset, log in enumerate(logs):
+            value = self.value(log)
+            if value is not None:
+                added.append((value, first_seq + offset))
+        added.sort()
+        return added
+
+    def add_pairs(self, added):
+        if not added:
+            return
+        split = bisect.bisect_left(added, self.entries[-1]) if self.entries else 0
+        if split == 0:
+            self.entries.extend(added)
+            return
+        pending = self.pending + added[:split]
+        pending.sort()
+        if len(pending) > self.pending_limit():
+            # Two sorted runs, which sort() merges in linear time.
+            entries = self.entries + pending
+            entries.sort()
+            self.entries = entries
+            self.pending = []
+        else:
+            self.pending = pending
+        self.entries.extend(added[split:])
+
+
+class ChangeIndex(TimeIndex):
+    """Sorted ``(change_seq, seq)`` pairs, for reading the change feed."""
+
+    def __init__(self):
+        super().__init__("change_seq")
+
+    def value(self, log):
+        change_seq = log.get("change_seq")
+        return change_seq if isinstance(change_seq, int) else None
+
+
+class ChangeSequence:
+    """Hands out ``change_seq`` numbers and tracks which are committed.
+
+    Writers ``reserve()`` numbers before inserting and ``commit()`` them
+    afterwards. ``stable()`` is the highest number at or below which nothing
+    is still being written, so a reader that stops there never skips an
+    entry that commits later with a lower number.
+    """
+
+    def __init__(self, next_seq=1):
+        self._next = next_seq
+        self._pending = set()
+        self._condition = Condition()
+
+    def reserve(self, count):
+        with self._condition:
+            first = self._next
+            self._next += count
+            self._pending.add(first)
+            return first
+
+    def commit(self, first):
+        with self._condition:
+            self._pending.discard(first)
+            self._condition.notify_all()
+
+    def _stable(self):
+        return (min(self._pending) if self._pending else self._next) - 1
+
+    def stable(self):
+        with self._condition:
+            return self._stable()
+
+    def wait(self, since, timeout):
+        # Blocks until something newer than ``since`` is committed.
+        with self._condition:
+            return self._condition.wait_for(lambda: self._stable() > since, timeout)
+
+
+# What JsonFileStore readers see: the first ``count`` entries of ``logs``,
+# the matching index lists and the summary report, published together.
+JsonSnapshot = namedtuple("JsonSnapshot", "logs count time_runs change_runs summary")
+
+
+class SharedChangeSequence(ChangeSequence):
+    """ChangeSequence kept in a file, for several processes on one data dir.
+
+    ``next`` and the reservations not yet committed (with the reserving
+    process id) are read and rewritten under an flock for every call.
+    Reservations left behind by a process that died are ignored, and
+    dropped on the next ``reserve``. ``wait`` polls, since a commit made by
+    another process cannot wake this one.
+    """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, path, next_seq=1):
+        super().__init__(next_seq)
+        self.path = path
+        self._file_lock = ProcessLock(path + ".lock")
+        with self._file_lock:
+            state = self._read()
+            state["next"] = max(state["next"], next_seq)
+            self._write(state)
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            return {"next": 1, "pending": {}}
+
+    def _write(self, state):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(state, handle)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def reserve(self, count):
+        with self._file_lock:
+            state = self._read()
+            first = state["next"]
+            state["next"] += count
+            state["pending"] = {
+                key: pid for key, pid in state["pending"].items() if self._alive(pid)
+            }
+            state["pending"][str(first)] = os.getpid()
+            self._write(state)
+        return first
+
+    def commit(self, first):
+        with self._file_lock:
+            state = self._read()
+            state["pending"].pop(str(first), None)
+            self._write(state)
+        with self._condition:
+            self._condition.notify_all()
+
+    def stable(self):
+        with self._file_lock:
+            state = self._read()
+        live = [int(first) for first, pid in state["pending"].items() if self._alive(pid)]
+        return (min(live) if live else state["next"]) - 1
+
+    def wait(self, since, timeout):
+        deadline = time.monotonic() + timeout
+        while self.stable() <= since:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            with self._condition:
+                self._condition.wait(min(remaining, self.POLL_INTERVAL))
+        return True
+
+
+class IdempotencyIndex:
+    """In-memory map of idempotency_key -> (log_id, seq).
+
+    ``watermark`` is the number of stored entries the index covers, so a
+    snapshot can be caught up by replaying only newer entries.
+    """
+
+    def __init__(self, snapshot_path=None):
+        self.snapshot_path = snapshot_path
+        self.entries = {}
+        self.watermark = 0
+
+    def get(self, idempotency_key):
+        entry = self.entries.get(idempotency_key)
+        if entry is None:
+            return None
+        return {"log_id": entry[0], "seq": entry[1]}
+
+    def add(self, idempotency_key, log_id, seq):
+        self.entries.setdefault(idempotency_key, (log_id, seq))
+        self.watermark = max(self.watermark, seq + 1)
+
+    def load_snapshot(self, max_watermark):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as handle:
+                snapshot = json.load(handle)
+        except (OSError, json.JSONDecodeError):
+            return False
+        if snapshot.get("watermark", 0) > max_watermark:
+            return False
+        self.entries = {key: tuple(value) for key, value in snapshot["keys"].items()}
+        self.watermark = snapshot["watermark"]
+        return True
+
+    def save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(
+                {"watermark": self.watermark, "keys": self.entries},
+                handle,
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+        os.replace(tmp_path, self.snapshot_path)
+
+
+class JsonFileStore:
+    """Original layout: one JSON array, loaded and rewritten per request.
+
+    Duplicate checks go through an in-memory ``IdempotencyIndex`` and the
+    summary report through ``SummaryCounters``; both are caught up from the
+    file when the store is opened.
+
+    Entries are kept resident and reads go through ``snapshot``, which the
+    writer replaces after every insert. Readers take no lock: a snapshot is
+    never changed once published, and the entries list only grows past it.
+
+    ``refresh()`` reads in entries that another process spliced into the
+    file since this store last read or wrote it; a file that was replaced
+    instead is reopened.
+    """
+
+    def __init__(
+        self, path, snapshot_path=None, snapshot_every=0, summary_path=None, fsync=False
+    ):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.index = IdempotencyIndex(snapshot_path)
+        self.counters = SummaryCounters(summary_path)
+        self.time_indexes = {field: TimeIndex(field) for field in TIME_FIELDS}
+        self.change_index = ChangeIndex()
+        self.logs = []
+        self.snapshot = None
+        self._file_state = None
+        self._unsnapshotted = 0
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if not os.path.exists(self.path):
+            self._save([])
+        logs = self.load()
+        stat = os.stat(self.path)
+        self._file_state = (stat.st_ino, stat.st_size)
+        if not self.index.load_snapshot(len(logs)):
+            self.index = IdempotencyIndex(self.index.snapshot_path)
+        for seq in range(self.index.watermark, len(logs)):
+            self.index.add(logs[seq].get("idempotency_key"), logs[seq].get("log_id"), seq)
+        self.index.watermark = len(logs)
+        if not self.counters.load(len(logs)):
+            self.counters = SummaryCounters(self.counters.path)
+        self.counters.add(logs[self.counters.count :])
+        self._index_times(logs)
+
+    def _index_times(self, logs):
+        self.time_indexes = {field: TimeIndex(field) for field in TIME_FIELDS}
+        self.change_index = ChangeIndex()
+        for time_index in self.time_indexes.values():
+            time_index.add_many(0, logs)
+        self.change_index.add_many(0, logs)
+        self.logs = logs
+        self._publish()
+
+    def _publish(self):
+        self.snapshot = JsonSnapshot(
+            self.logs,
+            len(self.logs),
+            {field: index.runs() for field, index in self.time_indexes.items()},
+            self.change_index.runs(),
+            self.counters.report(),
+        )
+
+    def max_change_seq(self):
+        return self.change_index.last() or 0
+
+    def assign_change_seqs(self, next_seq):
+        # Entries stored before the change feed existed get numbers once, in
+        # file order. Returns the next free number.
+        if len(self.change_index) == self.index.watermark:
+            return next_seq
+        logs = self.logs
+        for log in logs:
+            if self.change_index.value(log) is None:
+                log["change_seq"] = next_seq
+                next_seq += 1
+        self._save(logs)
+        self._index_times(logs)
+        return next_seq
+
+    def checkpoint(self):
+        self.index.save_snapshot()
+        self.counters.save()
+        self._unsnapshotted = 0
+
+    def close(self):
+        self.checkpoint()
+
+    def _save(self, logs):
+        # Replaced rather than rewritten in place, so other processes see a
+        # new inode and reopen instead of reading a tail.
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(logs, handle, ensure_ascii=False, indent=2)
+            self._sync(handle)
+            self._file_state = (os.fstat(handle.fileno()).st_ino, handle.tell())
+        os.replace(tmp_path, self.path)
+
+    def _sync(self, handle):
+        if self.fsync:
+            handle.flush()
+            os.fsync(handle.fileno())
+
+    def load(self):
+        with open(self.path, "r", encoding="utf-8") as handle:
+            return json.load(handle)
+
+    def find_many(self, idempotency_keys):
+        found = {}
+        for key in idempotency_keys:
+            entry = self.index.get(key)
+            if entry is not None:
+                found[key] = entry
+        return found
+
+    def _append(self, entries):
+        # Splices the entries in before the closing bracket instead of
+        # rewriting the whole array. Falls back to a rewrite if the file does
+        # not end the way json.dump(indent=2) leaves it.
+        body = ",\n".join(
+            textwrap.indent(json.dumps(entry, ensure_ascii=False, indent=2), "  ")
+            for entry in entries
+        )
+        with open(self.path, "rb+") as handle:
+            handle.seek(0, os.SEEK_END)
+            size = handle.tell()
+            if size >= 2:
+                handle.seek(size - 2)
+                if handle.read(2) == b"\n]":
+                    handle.seek(size - 2)
+                    handle.write((",\n" + body + "\n]").encode("utf-8"))
+                    self._sync(handle)
+                    self._file_state = (os.fstat(handle.fileno()).st_ino, handle.tell())
+                    return
+        self._save(self.logs + entries)
+
+    def insert(self, entries):
+        if not entries:
+            return
+        first_seq = self.index.watermark
+        # Everything derived from the entries is worked out first, so a bad
+        # value fails the insert before the file or any in-memory state is
+        # changed, and _apply cannot leave them out of step.
+        derived = self._derive(first_seq, entries)
+        if first_seq == 0:
+            self._save(entries)
+        else:
+            self._append(entries)
+        self._apply(first_seq, entries, derived)
+
+    def refresh(self):
+        # Caller holds the shard lock, so no other process is mid-write.
+        stat = os.stat(self.path)
+        if (stat.st_ino, stat.st_size) == self._file_state:
+            return
+        inode, size = self._file_state
+        entries = None
+        if stat.st_ino == inode and stat.st_size > size >= 2:
+            # Spliced entries replace the closing "\n]": the new tail is
+            # ",\n" + entries + "\n]".
+            with open(self.path, "rb") as handle:
+                handle.seek(size - 2)
+                tail = handle.read(stat.st_size - size + 2)
+            if tail.startswith(b",\n") and tail.endswith(b"\n]"):
+                try:
+                    entries = json.loads(b"[" + tail[2:-2] + b"]")
+                except ValueError:
+                    entries = None
+        if entries is None:
+            self.open()
+            return
+        derived = self._derive(self.index.watermark, entries)
+        self._file_state = (stat.st_ino, stat.st_size)
+        self._apply(self.index.watermark, entries, derived)
+
+    def _derive(self, first_seq, entries):
+        # Index keys, time and change pairs and summary counts of the entries:
+        # the steps that can raise on a bad value (an unhashable key, mixed
+        # types that do not sort).
+        keys = {}
+        for offset, entry in enumerate(entries):
+            key = entry.get("idempotency_key")
+            keys.setdefault(key, (entry.get("log_id"), first_seq + offset))
+        time_pairs = {
+            field: index.pairs(first_seq, entries) for field, index in self.time_indexes.items()
+        }
+        change_pairs = self.change_index.pairs(first_seq, entries)
+        return keys, time_pairs, change_pairs, SummaryCounters.tally(entries)
+
+    def _apply(self, first_seq, entries, derived):
+        # Only dict and list updates of values checked by _derive.
+        keys, time_pairs, change_pairs, tally = derived
+        for key, (log_id, seq) in keys.items():
+            self.index.add(key, log_id, seq)
+        self.index.watermark = max(self.index.watermark, first_seq + len(entries))
+        for field, time_index in self.time_indexes.items():
+            time_index.add_pairs(time_pairs[field])
+        self.change_index.add_pairs(change_pairs)
+        self.counters.add_tally(tally, len(entries))
+        self.logs.extend(entries)
+        self._publish()
+        self._unsnapshotted += len(entries)
+        if self.snapshot_every and self._unsnapshotted >= self.snapshot_every:
+            self.checkpoint()
+
+    def iter_query(self, filters, after=None, limit=None, stream=False, ranges=None):
+        # Reads one snapshot throughout. ``ranges`` maps a TIME_FIELDS field to
+        # a (start, end) pair of POSIX seconds, either end optional.
+        snapshot = self.snapshot
+        logs = snapshot.logs
+        start = 0 if after is None else after + 1
+        seqs = range(start, snapshot.count)
+        for field, (range_start, range_end) in (ranges or {}).items():
+            matching = seqs_between(
+                snapshot.time_runs[field], range_start, range_end, snapshot.count
+            )
+            if isinstance(seqs, range):
+                seqs = {seq for seq in matching if seq >= start}
+            else:
+                seqs.intersection_update(matching)
+        if not isinstance(seqs, range):
+            seqs = sorted(seqs)
+        return self._iter_rows(logs, filters, seqs, limit)
+
+    def iter_changes(self, since, until, limit):
+        # (change_seq, log) pairs with since < change_seq <= until, oldest first.
+        # Walks forward from since and stops at limit, so a page costs its
+        # size rather than the length of the feed after since.
+        snapshot = self.snapshot
+        start = (since + 1, -1)
+        changes = []
+        runs = [_iter_from(run, start) for run in snapshot.change_runs]
+        for change_seq, seq in heapq.merge(*runs):
+            if change_seq > until or len(changes) >= limit:
+                break
+            if seq < snapshot.count:
+                changes.append((change_seq, snapshot.logs[seq]))
+        return changes
+
+    def _iter_rows(self, logs, filters, seqs, limit):
+        returned = 0
+        for seq in seqs:
+            if limit is not None and returned >= limit:
+                return
+            if matches_filters(logs[seq], filters):
+                returned += 1
+                yield seq, logs[seq]
+
+    def summary(self):
+        return self.snapshot.summary
+
+
+def _column_value(value):
+    if value is None:
+        return None
+    return str(value)
+
+
+class SqliteStore:
+    """SQLite (WAL) store with indexed filter columns.
+
+    The full entry, including ``operation_body``, is kept as JSON text in
+    ``entry``; filter fields are copied into their own indexed columns.
+
+    Writes go through ``conn``. Reads use a connection per thread, so they
+    never wait on the writer: WAL gives each read statement the last
+    committed state.
+    """
+
+    def __init__(self, path, legacy_path=None, fsync=False):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.fsync = fsync
+        self.conn = None
+        self._readers = local()
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA synchronous={'FULL' if self.fsync else 'NORMAL'}")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS logs ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " idempotency_key TEXT NOT NULL UNIQUE,"
+                " log_id TEXT,"
+                " tenant_id TEXT,"
+                " region_id TEXT,"
+                " operation_type TEXT,"
+                " facility_id TEXT,"
+                " synced INTEGER,"
+                " entry TEXT NOT NULL,"
+                " occurred_ts REAL,"
+                " received_ts REAL,"
+                " change_seq INTEGER)"
+            )
+            self._add_time_columns()
+            self._add_change_seq_column()
+            for field in INDEXED_FIELDS + tuple(TIME_COLUMNS.values()) + ("change_seq",):
+                self.conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_logs_{field} ON logs ({field})"
+                )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            # Values are JSON-encoded so NULL groups still hit the primary key.
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS summary_counts ("
+                " field TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " count INTEGER NOT NULL,"
+                " PRIMARY KEY (field, value))"
+            )
+        self._import_legacy()
+        self._ensure_summary()
+
+    def _add_time_columns(self):
+        # Databases created before time-range queries get the columns added
+        # and filled from the stored entries once.
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(logs)")}
+        if "occurred_ts" in columns:
+            return
+        self.conn.execute("ALTER TABLE logs ADD COLUMN occurred_ts REAL")
+        self.conn.execute("ALTER TABLE logs ADD COLUMN received_ts REAL")
+        rows = self.conn.execute("SELECT seq, entry FROM logs").fetchall()
+        updates = []
+        for seq, entry in rows:
+            log = json.loads(entry)
+            updates.append(
+                (
+                    parse_timestamp(log.get("occurred_at")),
+                    parse_timestamp(log.get("received_at")),
+                    seq,
+                )
+            )
+        self.conn.executemany(
+            "UPDATE logs SET occurred_ts = ?, received_ts = ? WHERE seq = ?", updates
+        )
+
+    def _add_change_seq_column(self):
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(logs)")}
+        if "change_seq" not in columns:
+            self.conn.execute("ALTER TABLE logs ADD COLUMN change_seq INTEGER")
+
+    def max_change_seq(self):
+        row = self.conn.execute("SELECT MAX(change_seq) FROM logs").fetchone()
+        return row[0] or 0
+
+    def assign_change_seqs(self, next_seq):
+        # Rows stored before the change feed existed get numbers once, in seq
+        # order, in both the column and the entry JSON.
+        rows = self.conn.execute(
+            "SELECT seq, entry FROM logs WHERE change_seq IS NULL ORDER BY seq"
+        ).fetchall()
+        updates = []
+        for seq, entry in rows:
+            log = json.loads(entry)
+            log["change_seq"] = next_seq
+            updates.append(
+                (next_seq, json.dumps(log, ensure_ascii=False, separators=(",", ":")), seq)
+            )
+            next_seq += 1
+        if updates:
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE logs SET change_seq = ?, entry = ? WHERE seq = ?", updates
+                )
+        return next_seq
+
+    def iter_changes(self, since, until, limit):
+        rows = self._reader().execute(
+            "SELECT change_seq, entry FROM logs"
+            " WHERE change_seq > ? AND change_seq <= ? ORDER BY change_seq LIMIT ?",
+            (since, until, limit),
+        )
+        return [(change_seq, json.loads(entry)) for change_seq, entry in rows]
+
+    def _import_legacy(self):
+        done = self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'legacy_import'"
+        ).fetchone()
+        if done is not None:
+            return
+        logs = []
+        if self.legacy_path and os.path.exists(self.legacy_path):
+            with open(self.legacy_path, "r", encoding="utf-8") as handle:
+                logs = json.load(handle)
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO logs"
+                " (idempotency_key, log_id, tenant_id, region_id, operation_type,"
+                " facility_id, synced, entry, occurred_ts, received_ts, change_seq)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [self._row(log) for log in logs],
+            )
+            self.conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('legacy_import', ?)",
+                (str(len(logs)),),
+            )
+
+    def _row(self, log):
+        synced = log.get("synced")
+        return (
+            log.get("idempotency_key"),
+            _column_value(log.get("log_id")),
+            _column_value(log.get("tenant_id")),
+            _column_value(log.get("region_id")),
+            _column_value(log.get("operation_type")),
+            _column_value(log.get("facility_id")),
+            int(synced) if isinstance(synced, bool) else None,
+            json.dumps(log, ensure_ascii=False, separators=(",", ":")),
+            parse_timestamp(log.get("occurred_at")),
+            parse_timestamp(log.get("received_at")),
+            log.get("change_seq") if isinstance(log.get("change_seq"), int) else None,
+        )
+
+    def _ensure_summary(self):
+        done = self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'summary_counts'"
+        ).fetchone()
+        if done is None:
+            self.rebuild_summary()
+
+    def rebuild_summary(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM summary_counts")
+            for field in SUMMARY_FIELDS:
+                self.conn.execute(
+                    "INSERT INTO summary_counts (field, value, count)"
+                    " SELECT ?, json_quote(json_extract(entry, ?)), COUNT(*)"
+                    " FROM logs GROUP BY 2",
+                    (field, f"$.{field}"),
+                )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('summary_counts', '1')"
+            )
+
+    def _bump_summary(self, entries):
+        deltas = {}
+        for entry in entries:
+            for field in SUMMARY_FIELDS:
+                key = (field, json.dumps(entry.get(field), ensure_ascii=False))
+                deltas[key] = deltas.get(key, 0) + 1
+        self.conn.executemany(
+            "INSERT INTO summary_counts (field, value, count) VALUES (?, ?, ?)"
+            " ON CONFLICT (field, value) DO UPDATE SET count = count + excluded.count",
+            [(field, value, count) for (field, value), count in deltas.items()],
+        )
+
+    def checkpoint(self):
+        # idempotency_key is a UNIQUE column and summary_counts is updated in
+        # the insert transaction, so there is nothing to write here.
+        pass
+
+    def refresh(self):
+        # Every query reads the database, other processes' commits included.
+        pass
+
+    def close(self):
+        reader = getattr(self._readers, "conn", None)
+        if reader is not None:
+            reader.close()
+            self._readers.conn = None
+        self.conn.close()
+
+    def _reader(self):
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            self._readers.conn = conn
+        return conn
+
+    def find_many(self, idempotency_keys):
+        keys = list(set(idempotency_keys))
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start : start + 500]
+            placeholders = ", ".join("?" for _ in chunk)
+            rows = self.conn.execute(
+                f"SELECT idempotency_key, log_id, seq FROM logs"
+                f" WHERE idempotency_key IN ({placeholders})",
+                chunk,
+            )
+            for key, log_id, seq in rows:
+                found[key] = {"log_id": log_id, "seq": seq}
+        return found
+
+    def insert(self, entries):
+        if not entries:
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO logs"
+                " (idempotency_key, log_id, tenant_id, region_id, operation_type,"
+                " facility_id, synced, entry, occurred_ts, received_ts, change_seq)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [self._row(entry) for entry in entries],
+            )
+            self._bump_summary(entries)
+
+    def _where(self, filters, ranges):
+        clauses = []
+        params = []
+        for field, (start, end) in ranges.items():
+            column = TIME_COLUMNS[field]
+            if start is not None:
+                clauses.append(f"{column} >= ?")
+                params.append(start)
+            if end is not None:
+                clauses.append(f"{column} < ?")
+                params.append(end)
+        for field, value in filters.items():
+            if field == "synced":
+                clauses.append("synced = ?")
+                params.append(1 if value.lower() == "true" else 0)
+            else:
+                clauses.append(f"{field} = ?")
+                params.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    def iter_query(self, filters, after=None, limit=None, stream=False, ranges=None):
+        where, params = self._where(filters, ranges or {})
+        if after is not None:
+            where += " AND seq > ?" if where else " WHERE seq > ?"
+            params.append(after)
+        sql = f"SELECT seq, entry FROM logs{where} ORDER BY seq"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        if not stream:
+            rows = self._reader().execute(sql, params).fetchall()
+            return ((seq, json.loads(entry)) for seq, entry in rows)
+        return self._stream_rows(sql, params)
+
+    def _stream_rows(self, sql, params):
+        # Streams outlive the request, so they read through their own
+        # connection; WAL gives them a consistent snapshot.
+        conn = sqlite3.connect(self.path)
+        try:
+            for seq, entry in conn.execute(sql, params):
+                yield seq, json.loads(entry)
+        finally:
+            conn.close()
+
+    def summary(self):
+        report = {f"by_{field}": {} for field in SUMMARY_FIELDS}
+        rows = self._reader().execute("SELECT field, value, count FROM summary_counts")
+        for field, value, group_count in rows:
+            if field in SUMMARY_FIELDS:
+                report[f"by_{field}"][_group_key(json.loads(value))] = group_count
+        report["count"] = sum(report["by_operation_type"].values())
+        return report
+
+
+def open_store(engine, data_dir, fsync=False, index_snapshot=False, snapshot_every=1000):
+    logs_path = os.path.join(data_dir, "logs.json")
+    if engine == "json":
+        snapshot_path = None
+        if index_snapshot:
+            snapshot_path = os.path.join(data_dir, "idempotency.idx.json")
+        store = JsonFileStore(
+            logs_path,
+            snapshot_path,
+            snapshot_every,
+            summary_path=os.path.join(data_dir, "summary.json"),
+            fsync=fsync,
+        )
+    elif engine == "sqlite":
+        store = SqliteStore(
+            os.path.join(data_dir, "logs.sqlite3"), legacy_path=logs_path, fsync=fsync
+        )
+    else:
+        raise ValueError(f"Unknown storage engine: {engine}")
+    store.open()
+    return store
+
+
+class Shard:
+    def __init__(self, name, store, lock=None):
+        self.name = name
+        self.store = store
+        self.lock = Lock() if lock is None else lock
+
+    def refresh(self, blocking=False):
+        # By default skipped while a writer holds the lock rather than waiting
+        # on it; the writer catches up itself before writing.
+        if self.lock.acquire(blocking):
+            try:
+                self.store.refresh()
+            finally:
+                self.lock.release()
+
+
+class TenantShards:
+    """One store and one lock per ``tenant_id`` under ``data_dir/shards/``.
+
+    Shards are created on first write for a tenant and named after it (made
+    filesystem-safe, plus a short hash). With ``sharded=False`` every tenant
+    maps to a single store in ``data_dir`` itself, the unsharded layout.
+
+    The shard map is replaced, never changed in place, when a shard is
+    added, so lookups and ``all()`` read it without taking ``_lock``.
+
+    With ``multi_process`` the registry and shard locks are ``ProcessLock``
+    files (``shards.lock``, ``<shard>/shard.lock``), change_seq numbers come
+    from a ``SharedChangeSequence`` and ``refresh()`` picks up what other
+    processes wrote.
+    """
+
+    LEGACY_FILES = ("logs.json", "logs.sqlite3")
+
+    def __init__(self, data_dir, open_shard, sharded=True, multi_process=False):
+        self.data_dir = data_dir
+        self.open_shard = open_shard
+        self.sharded = sharded
+        self.multi_process = multi_process
+        self.shards_dir = os.path.join(data_dir, "shards")
+        self._shards = {}
+        self._ordered = ()
+        self._lock = self._new_lock(os.path.join(data_dir, "shards.lock"))
+        self.sequence = None
+
+    def _new_lock(self, path):
+        return ProcessLock(path) if self.multi_process else Lock()
+
+    def _open_shard(self, name, shard_dir):
+        lock = self._new_lock(os.path.join(shard_dir, "shard.lock"))
+        with lock:
+            return Shard(name, self.open_shard(shard_dir), lock)
+
+    def open(self):
+        with self._lock:
+            self._open()
+
+    def _open(self):
+        shards = {}
+        if not self.sharded:
+            shards[""] = self._open_shard("", self.data_dir)
+        else:
+            if not os.path.isdir(self.shards_dir):
+                self._split_legacy()
+            for name in sorted(os.listdir(self.shards_dir)):
+                shards[name] = self._open_shard(name, os.path.join(self.shards_dir, name))
+        self._set_shards(shards)
+        # change_seq numbers are global across shards.
+        shards = self.all()
+        next_seq = max([shard.store.max_change_seq() for shard in shards] + [0]) + 1
+        for shard in shards:
+            with shard.lock:
+                next_seq = shard.store.assign_change_seqs(next_seq)
+        if self.multi_process:
+            path = os.path.join(self.data_dir, "change_seq.json")
+            self.sequence = SharedChangeSequence(path, next_seq)
+        else:
+            self.sequence = ChangeSequence(next_seq)
+
+    def refresh(self, blocking=False):
+        # Only other processes write behind this one's back. With ``blocking``
+        # every shard is read up to date, waiting out a writer in another
+        # process; otherwise shards being written are left as they are.
+        if not self.multi_process:
+            return
+        if self.sharded:
+            added = [name for name in os.listdir(self.shards_dir) if name not in self._shards]
+            if added:
+                with self._lock:
+                    shards = dict(self._shards)
+                    for name in added:
+                        if name not in shards:
+                            shard_dir = os.path.join(self.shards_dir, name)
+                            shards[name] = self._open_shard(name, shard_dir)
+                    self._set_shards(shards)
+        for shard in self.all():
+            shard.refresh(blocking)
+
+    def _split_legacy(self):
+        # Copies an existing unsharded store into per-tenant shards, staged in
+        # shards.tmp and renamed into place once complete. The unsharded files
+        # are left where they are.
+        staging_dir = self.shards_dir + ".tmp"
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir)
+        legacy_files = [os.path.join(self.data_dir, name) for name in self.LEGACY_FILES]
+        if any(os.path.exists(path) for path in legacy_files):
+            legacy = self.open_shard(self.data_dir)
+            stores = {}
+            pending = {}
+            for _, log in legacy.iter_query({}):
+                name = self.shard_name(log.get("tenant_id"))
+                if name not in stores:
+                    stores[name] = self.open_shard(os.path.join(staging_dir, name))
+                pending.setdefault(name, []).append(log)
+                if len(pending[name]) >= 1000:
+                    stores[name].insert(pending.pop(name))
+            for name, logs in pending.items():
+                stores[name].insert(logs)
+            for store in stores.values():
+                store.close()
+            legacy.close()
+        os.rename(staging_dir, self.shards_dir)
+
+    def shard_name(self, tenant_id):
+        if not self.sharded:
+            return ""
+        key = _group_key(tenant_id)
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:8]
+        return f"{re.sub(r'[^A-Za-z0-9_.-]', '_', key)[:40]}-{digest}"
+
+    def shard(self, tenant_id, create=True):
+        name = self.shard_name(tenant_id)
+        shard = self._shards.get(name)
+        if shard is None and create:
+            with self._lock:
+                shard = self._shards.get(name)
+                if shard is None:
+                    shard = self._open_shard(name, os.path.join(self.shards_dir, name))
+                    self._set_shards({**self._shards, name: shard})
+        return shard
+
+    def _set_shards(self, shards):
+        self._ordered = tuple(shards[name] for name in sorted(shards))
+        self._shards = shards
+
+    def all(self):
+        return list(self._ordered)
+
+    def checkpoint(self):
+        for shard in self.all():
+            with shard.lock:
+                shard.store.checkpoint()
+
+
+def open_shards(
+    engine,
+    data_dir,
+    sharded=False,
+    fsync=False,
+    index_snapshot=False,
+    snapshot_every=1000,
+    multi_process=False,
+):
+    def open_shard(shard_dir):
+        return open_store(
+            engine,
+            shard_dir,
+            fsync=fsync,
+            index_snapshot=index_snapshot,
+            snapshot_every=snapshot_every,
+        )
+
+    shards = TenantShards(data_dir, open_shard, sharded=sharded, multi_process=multi_process)
+    shards.open()
+    return shards
@@ -0,0 +1,397 @@
+"""Headless load benchmark: central plus N nodes, built on run_demo.py.
+
+Starts central and ``--nodes`` node processes on throwaway data directories
+and runs three phases back to back, with no pacing:
+
+- ingest: ``--clients`` concurrent clients per node each post
+  ``--logs-per-client`` logs, one per ``POST /logs`` or ``--batch-size`` per
+  ``POST /node/logs/batch``.
+- drain: every node calls ``POST /sync/central`` until its backlog is empty.
+- query: ``--clients`` clients per node each run ``--queries-per-client``
+  reads, cycling through central's list, tenant, change-feed and summary
+  queries and the node's unsynced list.
+
+Each phase reports items/second and request latency percentiles. The full
+configuration and results go to a JSON report, so runs on different storage
+backends or settings can be compared:
+
+    python run_bench.py --nodes 3 --clients 8 --logs-per-client 500
+    python run_bench.py --central-engine sqlite --report sqlite.json
+    python run_bench.py --batch-size 100 --payload-bytes 64,4096 \\
+        --mix record_transaction=3,dispatch_unit=1 --tenants 4 \\
+        --central-env SHARD_BY_TENANT=true --node-env SYNC_CONCURRENCY=4
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from run_demo import build_log, request_json, start_central, start_node, wait_for_health
+
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+PERCENTILES = (50, 90, 95, 99)
+
+
+def parse_mix(value):
+    # "record_transaction=3,dispatch_unit=1" -> ([types], [weights])
+    names, weights = [], []
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        names.append(name.strip())
+        weights.append(float(weight) if weight else 1.0)
+    return names, weights
+
+
+def parse_env(pairs):
+    env = {}
+    for pair in pairs:
+        name, separator, value = pair.partition("=")
+        if not separator:
+            raise argparse.ArgumentTypeError(f"expected KEY=VALUE, got {pair!r}")
+        env[name] = value
+    return env
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=2)
+    parser.add_argument("--clients", type=int, default=4, help="concurrent clients per node")
+    parser.add_argument("--logs-per-client", type=int, default=200)
+    parser.add_argument(
+        "--batch-size", type=int, default=0, help="logs per batch request, 0 posts them one by one"
+    )
+    parser.add_argument(
+        "--payload-bytes", default="64", help="comma-separated operation_body padding sizes"
+    )
+    parser.add_argument(
+        "--mix", default="record_transaction=1", help="comma-separated operation_type=weight"
+    )
+    parser.add_argument("--tenants", type=int, default=1)
+    parser.add_argument(
+        "--duplicate-ratio", type=float, default=0.0, help="share of logs re-sent as duplicates"
+    )
+    parser.add_argument("--queries-per-client", type=int, default=50)
+    parser.add_argument("--node-engine", default="segments")
+    parser.add_argument("--central-engine", default="json")
+    parser.add_argument("--node-env", action="append", default=[], metavar="KEY=VALUE")
+    parser.add_argument("--central-env", action="append", default=[], metavar="KEY=VALUE")
+    parser.add_argument("--base-port", type=int, default=5100, help="central port; nodes follow")
+    parser.add_argument("--drain-timeout", type=float, default=300)
+    parser.add_argument("--request-timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--report", default=os.path.join(ROOT_DIR, "bench_report.json"))
+    parser.add_argument("--keep-data", action="store_true")
+    return parser.parse_args()
+
+
+def latency_summary(seconds):
+    if not seconds:
+        return {"count": 0}
+    ordered = sorted(seconds)
+    summary = {"count": len(ordered), "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3)}
+    for percentile in PERCENTILES:
+        # Nearest rank.
+        rank = max(0, -(-percentile * len(ordered) // 100) - 1)
+        summary[f"p{percentile}_ms"] = round(ordered[rank] * 1000, 3)
+    summary["max_ms"] = round(ordered[-1] * 1000, 3)
+    return summary
+
+
+class Recorder:
+    """Latencies, item counts and statuses of one phase, shared by its clients."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.counts = {}
+        self.statuses = {}
+        self.items = 0
+
+    def record(self, kind, seconds, status, items=0, **counts):
+        with self._lock:
+            self.latencies.setdefault(kind, []).append(seconds)
+            key = str(status)
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+            self.items += items
+            for name, value in counts.items():
+                self.counts[name] = self.counts.get(name, 0) + value
+
+    def report(self, elapsed):
+        every = [seconds for values in self.latencies.values() for seconds in values]
+        body = {
+            "seconds": round(elapsed, 3),
+            "requests": len(every),
+            "items": self.items,
+            "requests_per_second": round(len(every) / elapsed, 1) if elapsed else None,
+            "items_per_second": round(self.items / elapsed, 1) if elapsed else None,
+            "latency": latency_summary(every),
+            "statuses": self.statuses,
+            **self.counts,
+        }
+        if len(self.latencies) > 1:
+            body["latency_by_kind"] = {
+                kind: latency_summary(values) for kind, values in sorted(self.latencies.items())
+            }
+        return body
+
+
+def timed(method, url, payload=None, timeout=60):
+    started = time.perf_counter()
+    status, body = request_json(method, url, payload, timeout=timeout)
+    return time.perf_counter() - started, status, body
+
+
+def run_clients(targets):
+    # targets: (function, args) per client; returns the wall time of the phase.
+    threads = [threading.Thread(target=function, args=args) for function, args in targets]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+class Workload:
+    def __init__(self, args):
+        self.args = args
+        self.types, self.weights = parse_mix(args.mix)
+        self.sizes = [int(size) for size in args.payload_bytes.split(",")]
+        self.tenants = [f"municipality-{index + 1}" for index in range(args.tenants)]
+
+    def log(self, rng, node_index):
+        entry = build_log(f"bench-node-{node_index}", uuid.UUID(int=rng.getrandbits(128)).hex, 1)
+        entry["operation_type"] = rng.choices(self.types, self.weights)[0]
+        entry["tenant_id"] = rng.choice(self.tenants)
+        entry["operation_body"] = {
+            "amount": rng.randint(1, 100),
+            "note": "x" * rng.choice(self.sizes),
+        }
+        return entry
+
+    def logs(self, rng, node_index, count):
+        # Yields count logs; with --duplicate-ratio some are copies of logs
+        # this client already sent.
+        sent = []
+        for _ in range(count):
+            if sent and rng.random() < self.args.duplicate_ratio:
+                yield rng.choice(sent)
+                continue
+            entry = self.log(rng, node_index)
+            sent.append(entry)
+            yield entry
+
+
+def ingest_client(args, workload, recorder, node_url, node_index, seed):
+    rng = random.Random(seed)
+    logs = workload.logs(rng, node_index, args.logs_per_client)
+    if args.batch_size <= 0:
+        for entry in logs:
+            seconds, status, _ = timed("POST", f"{node_url}/logs", entry, args.request_timeout)
+            recorder.record(
+                "log",
+                seconds,
+                status,
+                items=1,
+                accepted=int(status == 201),
+                duplicates=int(status == 409),
+                errors=int(status not in (201, 409)),
+            )
+        return
+    batch = []
+    for entry in logs:
+        batch.append(entry)
+        if len(batch) == args.batch_size:
+            post_batch(args, recorder, node_url, batch)
+            batch = []
+    if batch:
+        post_batch(args, recorder, node_url, batch)
+
+
+def post_batch(args, recorder, node_url, batch):
+    seconds, status, body = timed(
+        "POST", f"{node_url}/node/logs/batch", batch, args.request_timeout
+    )
+    if status == 200:
+        counts = {name: body[name] for name in ("accepted", "duplicates", "errors")}
+    else:
+        counts = {"accepted": 0, "duplicates": 0, "errors": len(batch)}
+    recorder.record("batch", seconds, status, items=len(batch), **counts)
+
+
+def drain_node(args, recorder, node_url, deadline):
+    # Pushes until a sync finds nothing left to send. Failed pushes wait out a
+    # short pause, and logs deferred by their retry backoff until they are
+    # due, and are retried until the deadline.
+    while time.perf_counter() < deadline:
+        seconds, status, body = timed(
+            "POST", f"{node_url}/sync/central", timeout=args.request_timeout
+        )
+        if status != 200:
+            recorder.record("sync", seconds, status, failed_syncs=1)
+            time.sleep(0.5)
+            continue
+        recorder.record(
+            "sync",
+            seconds,
+            status,
+            items=body["synced"] + body["duplicates"],
+            synced=body["synced"],
+            duplicates=body["duplicates"],
+            errors=body["errors"],
+        )
+        if body["pushed"] == 0:
+            if not body.get("deferred"):
+                return
+            time.sleep(max(min(body["retry_in"], deadline - time.perf_counter()), 0.01))
+
+
+def query_client(args, workload, recorder, central_url, node_url, seed, high_water):
+    # Cycles through the query kinds; items are the rows the lists return.
+    rng = random.Random(seed)
+    queries = (
+        ("central_logs", lambda: "/central/logs?limit=100"),
+        (
+            "central_logs_tenant",
+            lambda: f"/central/logs?limit=100&tenant_id={rng.choice(workload.tenants)}",
+        ),
+        (
+            "central_changes",
+            lambda: f"/central/changes?limit=100&since={rng.randint(0, high_water)}",
+        ),
+        ("central_summary", lambda: "/central/reports/summary"),
+    )
+    for index in range(args.queries_per_client):
+        if index % (len(queries) + 1) == len(queries):
+            kind, url = "node_unsynced", f"{node_url}/logs?synced=false"
+        else:
+            kind, path = queries[index % (len(queries) + 1)]
+            url = f"{central_url}{path()}"
+        seconds, status, body = timed("GET", url, timeout=args.request_timeout)
+        rows = 0
+        if status == 200 and kind != "central_summary":
+            rows = body["count"]
+        recorder.record(kind, seconds, status, items=rows)
+
+
+def central_count(central_url):
+    status, body = request_json("GET", f"{central_url}/central/reports/summary", timeout=60)
+    return body["count"] if status == 200 else None
+
+
+def backlog(node_url):
+    status, body = request_json("GET", f"{node_url}/logs?synced=false", timeout=60)
+    return body["count"] if status == 200 else None
+
+
+def start_services(args, root):
+    # Returns (central_url, [node urls], [processes]); output goes to
+    # <root>/<name>.log.
+    processes = []
+    central_env = {"STORAGE_ENGINE": args.central_engine, **parse_env(args.central_env)}
+    node_env = {"STORAGE_ENGINE": args.node_engine, **parse_env(args.node_env)}
+    central_url = f"http://localhost:{args.base_port}"
+
+    output = open(os.path.join(root, "central.log"), "wb")
+    processes.append(
+        start_central(args.base_port, os.path.join(root, "central"), central_env, output)
+    )
+    node_urls = []
+    for index in range(args.nodes):
+        port = args.base_port + 1 + index
+        output = open(os.path.join(root, f"node-{index}.log"), "wb")
+        data_dir = os.path.join(root, f"node-{index}")
+        processes.append(start_node(port, data_dir, central_url, node_env, output))
+        node_urls.append(f"http://localhost:{port}")
+    for url in [central_url, *node_urls]:
+        if not wait_for_health(f"{url}/health", timeout_seconds=30):
+            raise RuntimeError(f"{url} did not become healthy; see the logs in {root}")
+    return central_url, node_urls, processes
+
+
+def run(args, central_url, node_urls):
+    workload = Workload(args)
+    phases = {}
+
+    recorder = Recorder()
+    elapsed = run_clients(
+        (ingest_client, (args, workload, recorder, node_url, node_index, seed))
+        for node_index, node_url in enumerate(node_urls)
+        for seed in client_seeds(args, node_index, "ingest")
+    )
+    phases["ingest"] = recorder.report(elapsed)
+
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.drain_timeout
+    elapsed = run_clients(
+        (drain_node, (args, recorder, node_url, deadline)) for node_url in node_urls
+    )
+    phases["drain"] = recorder.report(elapsed)
+    phases["drain"]["backlog_after"] = [backlog(node_url) for node_url in node_urls]
+
+    recorder = Recorder()
+    high_water = central_count(central_url) or 0
+    elapsed = run_clients(
+        (query_client, (args, workload, recorder, central_url, node_url, seed, high_water))
+        for node_index, node_url in enumerate(node_urls)
+        for seed in client_seeds(args, node_index, "query")
+    )
+    phases["query"] = recorder.report(elapsed)
+    return phases
+
+
+def client_seeds(args, node_index, phase):
+    return [f"{args.seed}:{phase}:{node_index}:{client}" for client in range(args.clients)]
+
+
+def print_summary(report):
+    for name, phase in report["phases"].items():
+        latency = phase["latency"]
+        print(
+            f"{name:>7}: {phase['items']:>8} items in {phase['seconds']:>8.2f}s "
+            f"= {phase['items_per_second'] or 0:>9,.0f} items/s  "
+            f"p50 {latency.get('p50_ms', 0):.1f}ms  p99 {latency.get('p99_ms', 0):.1f}ms",
+            flush=True,
+        )
+    print(f"central stored {report['central_count']} logs", flush=True)
+
+
+def main():
+    args = parse_args()
+    root = tempfile.mkdtemp(prefix="bench-")
+    processes = []
+    try:
+        central_url, node_urls, processes = start_services(args, root)
+        started_at = datetime.now(timezone.utc).isoformat()
+        phases = run(args, central_url, node_urls)
+        report = {
+            "started_at": started_at,
+            "config": vars(args),
+            "phases": phases,
+            "central_count": central_count(central_url),
+        }
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+        if args.keep_data:
+            print(f"data and service logs kept in {root}", flush=True)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+    with open(args.report, "w", encoding="utf-8") as handle:
+        json.dump(report, handle, indent=2)
+    print_summary(report)
+    print(f"report written to {args.report}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
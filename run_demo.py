@@ -13,8 +13,10 @@ ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 CENTRAL_DIR = os.path.join(ROOT_DIR, "centralDB")
 NODE_DIR = os.path.join(ROOT_DIR, "asyncSyncing")
 NODE_APP = os.path.join(NODE_DIR, "app.py")
+CENTRAL_APP = os.path.join(CENTRAL_DIR, "app.py")
 
-CENTRAL_BASE_URL = "http://localhost:5001"
+CENTRAL_PORT = 5001
+CENTRAL_BASE_URL = f"http://localhost:{CENTRAL_PORT}"
 NODE_A_PORT = 5000
 NODE_B_PORT = 5002
 NODE_A_URL = f"http://localhost:{NODE_A_PORT}"
@@ -128,12 +130,25 @@ def build_log(source_node_id, id_suffix, amount):
     }
 
 
-def start_node(port, data_dir, central_url):
+def start_central(port, data_dir, extra_env=None, output=None):
     env = os.environ.copy()
+    env.update(extra_env or {})
+    env["PORT"] = str(port)
+    env["DATA_DIR"] = data_dir
+    return subprocess.Popen(
+        [sys.executable, CENTRAL_APP], cwd=CENTRAL_DIR, env=env, stdout=output, stderr=output
+    )
+
+
+def start_node(port, data_dir, central_url, extra_env=None, output=None):
+    env = os.environ.copy()
+    env.update(extra_env or {})
     env["PORT"] = str(port)
     env["DATA_DIR"] = data_dir
     env["CENTRAL_DB_URL"] = central_url
-    return subprocess.Popen([sys.executable, NODE_APP], cwd=NODE_DIR, env=env)
+    return subprocess.Popen(
+        [sys.executable, NODE_APP], cwd=NODE_DIR, env=env, stdout=output, stderr=output
+    )
 
 
 def stop_process(proc, label):
@@ -145,7 +160,7 @@ def stop_process(proc, label):
 
 
 def main():
-    central_app = os.path.join(CENTRAL_DIR, "app.py")
+    central_data = os.path.join(CENTRAL_DIR, "data")
     node_a_data = os.path.join(NODE_DIR, "data", "node-a")
     node_b_data = os.path.join(NODE_DIR, "data", "node-b")
 
@@ -155,7 +170,7 @@ def main():
         "In a real deployment these would be separate sites with intermittent connectivity.",
     )
     step("Starting Central DB...")
-    central_proc = subprocess.Popen([sys.executable, central_app], cwd=CENTRAL_DIR)
+    central_proc = start_central(CENTRAL_PORT, central_data)
     node_a_proc = None
     node_b_proc = None
     try:
@@ -0,0 +1,164 @@
+"""Data-path micro-benchmarks for both services, with regression tracking.
+
+Runs asyncSyncing/bench_data_path.py and centralDB/bench_data_path.py (each
+in its own process, since both services have an ``app`` module; no servers
+are started), compares every result with the history of earlier runs on the
+same host and Python version, and appends this run to the history file:
+
+    python run_microbench.py                         # 1k, 10k, 100k and 1M logs
+    python run_microbench.py --sizes 1000,10000 --threshold 0.3
+    python run_microbench.py --no-record             # check only
+
+The 1M tier takes several minutes and about 4 GB of memory per suite.
+
+A result regresses when its ops/s falls more than ``--threshold`` below the
+median of the last ``--window`` recorded runs; results timed in under
+``--min-seconds`` are shown but not judged. On a regression the script exits
+with status 1, so it can gate a CI job.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+SUITES = (
+    ("node", os.path.join(ROOT_DIR, "asyncSyncing")),
+    ("central", os.path.join(ROOT_DIR, "centralDB")),
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--node-engines", default="segments")
+    parser.add_argument("--central-engines", default="json,sqlite")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="allowed ops/s drop, 0.2 = 20%%"
+    )
+    parser.add_argument("--window", type=int, default=5, help="recorded runs the baseline uses")
+    parser.add_argument(
+        "--min-seconds",
+        type=float,
+        default=0.005,
+        help="results timed faster than this are too noisy to judge",
+    )
+    parser.add_argument("--history", default=os.path.join(ROOT_DIR, "bench_history.jsonl"))
+    parser.add_argument("--no-record", action="store_true", help="do not append this run")
+    return parser.parse_args()
+
+
+def run_suite(directory, engines, args):
+    command = [
+        sys.executable,
+        "bench_data_path.py",
+        "--json",
+        "--sizes",
+        args.sizes,
+        "--engines",
+        engines,
+        "--repeat",
+        str(args.repeat),
+    ]
+    output = subprocess.run(command, cwd=directory, check=True, stdout=subprocess.PIPE, text=True)
+    return json.loads(output.stdout)
+
+
+def result_key(result):
+    return result["service"], result["engine"], result["size"], result["benchmark"]
+
+
+def read_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def baselines(history, environment, window):
+    # Median ops/s per benchmark over the last `window` runs that measured
+    # it in the same environment.
+    samples = {}
+    for run in reversed(history):
+        if run["environment"] != environment:
+            continue
+        for result in run["results"]:
+            values = samples.setdefault(result_key(result), [])
+            if len(values) < window:
+                values.append(result["ops_per_second"])
+    return {key: statistics.median(values) for key, values in samples.items()}
+
+
+def git_commit():
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True
+        )
+    except OSError:
+        return None
+    return output.stdout.strip() or None
+
+
+def main():
+    args = parse_args()
+    environment = {"host": platform.node(), "python": platform.python_version()}
+    results = []
+    for service, directory in SUITES:
+        engines = args.node_engines if service == "node" else args.central_engines
+        results.extend(run_suite(directory, engines, args))
+
+    baseline = baselines(read_history(args.history), environment, args.window)
+    regressions = []
+    print(
+        f"{'service':>8} {'engine':>9} {'size':>8} {'benchmark':>20} {'ops/s':>14} {'change':>8}"
+    )
+    for result in results:
+        key = result_key(result)
+        reference = baseline.get(key)
+        change = ""
+        if reference:
+            ratio = result["ops_per_second"] / reference - 1
+            change = f"{ratio:+.1%}"
+            if ratio < -args.threshold and result["seconds"] >= args.min_seconds:
+                regressions.append({**result, "baseline_ops_per_second": reference})
+                change += " !"
+        service, engine, size, benchmark = key
+        print(
+            f"{service:>8} {engine:>9} {size:>8} {benchmark:>20} "
+            f"{result['ops_per_second']:>14,.0f} {change:>8}"
+        )
+
+    if not args.no_record:
+        run = {
+            "recorded_at": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "environment": environment,
+            "results": results,
+        }
+        with open(args.history, "a", encoding="utf-8") as handle:
+            handle.write(json.dumps(run) + "\n")
+
+    if regressions:
+        print(
+            f"{len(regressions)} result(s) regressed more than {args.threshold:.0%} "
+            f"against the median of the last {args.window} runs",
+            file=sys.stderr,
+        )
+        for result in regressions:
+            print(
+                "  {service} {engine} {size} {benchmark}: {ops_per_second:,.0f} ops/s, "
+                "baseline {baseline_ops_per_second:,.0f}".format(**result),
+                file=sys.stderr,
+            )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()